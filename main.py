@@ -4,11 +4,14 @@
 import os
 import sys
 import curses
-import shutil
-import subprocess
 import locale
-from pathlib import Path
-import textwrap
+import errno
+import time
+import stat
+import threading
+from collections import OrderedDict, deque
+# shutil, subprocess, hashlib, textwrap импортируются по месту: они нужны только
+# операциям, помощи и открытию файлов, а их загрузка заметно удлиняет старт
 
 
 class OperationCancelled(Exception):
@@ -17,22 +20,4359 @@ class OperationCancelled(Exception):
 # Файл для сохранения последнего посещенного каталога
 CD_FILE = os.path.expanduser("~/.tui_fm_last_dir")
 
+# Сверять контрольную сумму при перемещении между разными ФС (до удаления исходника)
+VERIFY_CROSS_DEVICE_MOVE = True
+
+# Сколько записей читать до первого кадра при старте (остальное — сразу после)
+STARTUP_LISTING = 200
+
+# Размер блока для потокового копирования
+COPY_CHUNK = 8 * 1024 * 1024
+
+# Потоки копирования дерева: на мелких файлах упираемся в метаданные, а не в CPU
+COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
 # Включаем поддержку локали для корректного отображения Unicode (в том числе кириллицы)
 locale.setlocale(locale.LC_ALL, '')
 
-class FileManager:
-    def __init__(self, stdscr):
-        self.stdscr = stdscr
-        self.current_dir = os.getcwd()
-        self.last_dir = self.current_dir # Запоминаем начальную директорию
-        self.cursor_pos = 0
+
+# --- Метрики операций ---
+
+# JSON-lines журнал завершённых операций и листингов; пустая строка в SUSANIN_METRICS — выключить
+METRICS_LOG = os.path.expanduser(os.environ.get("SUSANIN_METRICS", "~/.tui_fm_metrics.jsonl"))
+# Файл для textfile-коллектора node-exporter (Prometheus); не задан — не пишем
+METRICS_PROM = os.environ.get("SUSANIN_PROM_TEXTFILE") or None
+# Как часто фоновый поток сбрасывает накопленное на диск
+METRICS_FLUSH = 1.0
+
+
+class MetricsSink:
+    """
+    Сбор метрик вне горячего пути: emit() только кладёт словарь в очередь, а фоновый поток
+    раз в METRICS_FLUSH секунд дописывает пачку в JSON-lines журнал и переписывает
+    textfile для Prometheus (счётчики с начала процесса, запись через временный файл).
+    """
+
+    PROM_HELP = {
+        "susanin_jobs_total": "Завершённые операции",
+        "susanin_job_files_total": "Обработано файлов",
+        "susanin_job_bytes_total": "Обработано байт",
+        "susanin_job_errors_total": "Ошибок в операциях",
+        "susanin_job_seconds_total": "Время операций, с",
+        "susanin_listings_total": "Прочитано директорий",
+        "susanin_listing_entries_total": "Записей в листингах",
+        "susanin_listing_seconds_total": "Время листингов, с",
+    }
+
+    def __init__(self, log=METRICS_LOG, prom=METRICS_PROM, interval=METRICS_FLUSH):
+        self.log = log
+        self.prom = prom
+        self.interval = interval
+        self._queue = deque()
+        self._wake = threading.Event()
+        self._thread = None
+        self._closed = False
+        self._counters = {}  # (метрика, kind) -> значение; трогает только поток записи
+
+    @property
+    def enabled(self):
+        return bool(self.log or self.prom)
+
+    def emit(self, event, **fields):
+        if not self.enabled or self._closed:
+            return
+        self._queue.append({"event": event, "ts": round(time.time(), 3), **fields})  # deque.append потокобезопасен
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        import atexit
+        with _metrics_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="metrics", daemon=True)
+            self._thread.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(self.interval)
+            self.flush()
+
+    def flush(self):
+        batch = []
+        while self._queue:
+            batch.append(self._queue.popleft())
+        if not batch:
+            return
+        if self.log:
+            import json
+            try:
+                with open(self.log, "a", encoding="utf-8") as f:
+                    f.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in batch))
+            except OSError:
+                pass  # метрики не должны ломать работу
+        if self.prom:
+            for e in batch:
+                self._count(e)
+            self._write_prom()
+
+    def _count(self, e):
+        c = self._counters
+        if e["event"] == "job":
+            kind = e["kind"]
+            for metric, value in (("susanin_jobs_total", 1), ("susanin_job_files_total", e["files"]),
+                                  ("susanin_job_bytes_total", e["bytes"]), ("susanin_job_errors_total", e["errors"]),
+                                  ("susanin_job_seconds_total", e["seconds"])):
+                c[metric, kind] = c.get((metric, kind), 0) + value
+        elif e["event"] == "listing":
+            for metric, value in (("susanin_listings_total", 1), ("susanin_listing_entries_total", e["entries"]),
+                                  ("susanin_listing_seconds_total", e["seconds"])):
+                c[metric, ""] = c.get((metric, ""), 0) + value
+
+    def _write_prom(self):
+        lines = []
+        for metric, help_text in self.PROM_HELP.items():
+            samples = [(kind, v) for (m, kind), v in sorted(self._counters.items()) if m == metric]
+            if not samples:
+                continue
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} counter")
+            for kind, value in samples:
+                label = f'{{kind="{kind}"}}' if kind else ""
+                lines.append(f"{metric}{label} {value:g}" if isinstance(value, float) else f"{metric}{label} {value}")
+        tmp = f"{self.prom}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp, self.prom)
+        except OSError:
+            pass
+
+    def close(self):
+        """Дописать остаток; вызывается при выходе (atexit)."""
+        self._closed = True
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+        self.flush()
+
+
+_metrics_lock = threading.Lock()
+METRICS = MetricsSink()
+
+
+# --- Файловые операции (без curses) ---
+
+class Job:
+    """Счётчики одной файловой операции: файлы, байты, ошибки и прогресс."""
+
+    def __init__(self, name, progress=None):
+        self.name = name
+        self.files = 0
+        self.bytes = 0
+        self.errors = []
+        self.skipped = 0  # байты дыр разрежённых файлов, которые не пришлось копировать
+        self.changed = 0  # записей, у которых действительно менялись атрибуты
+        self.strategy = set()  # какие способы применялись: rename, copy, ...
+        self.progress = progress  # callback(job), вызывается не чаще PROGRESS_INTERVAL
+        self.started = time.monotonic()
+        self._last_tick = 0.0
+        self._lock = threading.Lock()
+        self.total = 0  # ожидаемый объём в байтах, если известен (для процентов)
+        self.manifest = None  # Manifest: при копировании заодно считать суммы записанных файлов
+        self.undo = None  # UndoBatch: сюда попадают обратимые переименования операции
+
+    PROGRESS_INTERVAL = 0.1
+
+    def add(self, nbytes=0, files=0, skipped=0, changed=0):
+        # Вызывается и из рабочих потоков — счётчики под замком
+        with self._lock:
+            self.bytes += nbytes
+            self.files += files
+            self.skipped += skipped
+            self.changed += changed
+        self.tick()
+
+    def tick(self):
+        """Перерисовать прогресс, если пора; рисуем только из главного потока (curses)."""
+        if self.progress is None or threading.current_thread() is not threading.main_thread():
+            return
+        now = time.monotonic()
+        if now - self._last_tick >= self.PROGRESS_INTERVAL:
+            self._last_tick = now
+            self.progress(self)
+
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def finish(self, errors=0):
+        """Операция закончена: отправить метрики (errors — число ошибок, если их собирали снаружи)."""
+        seconds = self.elapsed()
+        METRICS.emit("job", kind=self.name, files=self.files, bytes=self.bytes,
+                     errors=errors + len(self.errors), seconds=round(seconds, 6),
+                     throughput=round(self.bytes / seconds) if seconds > 0 else 0,
+                     skipped=self.skipped, changed=self.changed, strategy=sorted(self.strategy))
+
+    def summary(self):
+        parts = [f"{self.files} файл(ов)", format_size(self.bytes)]
+        if self.skipped:
+            parts.append(f"пропущено дыр {format_size(self.skipped)}")
+        if self.changed:
+            parts.append(f"изменено {self.changed}")
+        if self.strategy:
+            parts.append("/".join(sorted(self.strategy)))
+        return ", ".join(parts) + f" за {self.elapsed():.1f} с"
+
+
+def format_size(n):
+    """Человекочитаемый размер: 1.5 MiB."""
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if n < 1024 or unit == "TiB":
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+
+
+def dest_candidates(dest_path):
+    """Имена-кандидаты для назначения: dest, dest_copy, dest_copy1, ... (x.tar.gz -> x_copy.tar.gz)."""
+    yield dest_path
+    base, ext = os.path.splitext(dest_path)
+    for suffix in ('.tar.gz', '.tar.bz2', '.tar.xz'):
+        if dest_path.lower().endswith(suffix):
+            base, ext = dest_path[:-len(suffix)], dest_path[-len(suffix):]
+    yield f"{base}_copy{ext}"
+    count = 1
+    while True:
+        yield f"{base}_copy{count}{ext}"
+        count += 1
+
+
+_renameat2 = None
+AT_FDCWD = -100
+RENAME_NOREPLACE = 1
+
+
+def _load_renameat2():
+    global _renameat2
+    if _renameat2 is None:
+        _renameat2 = False
+        if sys.platform.startswith("linux"):
+            try:
+                import ctypes
+                libc = ctypes.CDLL(None, use_errno=True)
+                fn = libc.renameat2
+                fn.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_uint]
+                fn.restype = ctypes.c_int
+                _renameat2 = fn
+            except (OSError, AttributeError):
+                pass
+    return _renameat2
+
+
+def rename_noreplace(src, dest):
+    """Атомарно переименовать src в dest; если dest уже есть — FileExistsError, ничего не трогаем."""
+    fn = _load_renameat2()
+    if fn:
+        import ctypes
+        if fn(AT_FDCWD, os.fsencode(src), AT_FDCWD, os.fsencode(dest), RENAME_NOREPLACE) == 0:
+            return
+        err = ctypes.get_errno()
+        # EINVAL/ENOSYS — ФС или ядро не поддерживают флаг, пробуем по-старому
+        if err not in (errno.EINVAL, errno.ENOSYS):
+            raise OSError(err, os.strerror(err), src, None, dest)
+
+    if not os.path.isdir(src) or os.path.islink(src):
+        # link() не перезаписывает существующий файл — атомарная проверка
+        try:
+            os.link(src, dest, follow_symlinks=False)
+        except FileExistsError:
+            raise
+        except OSError:
+            pass  # жёсткие ссылки не поддерживаются — см. ниже
+        else:
+            os.unlink(src)
+            return
+
+    if os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+    os.rename(src, dest)
+
+
+def _copy_fd(fsrc, fdst, size, job=None, digest=None):
+    """Потоковое копирование между дескрипторами; при digest читаем через userspace, чтобы считать хеш."""
+    copied = 0
+    if digest is None and hasattr(os, "copy_file_range"):
+        try:
+            while copied < size:
+                n = os.copy_file_range(fsrc, fdst, min(COPY_CHUNK, size - copied))
+                if n == 0:
+                    break
+                copied += n
+                if job:
+                    job.add(n)
+            if job and copied:
+                job.strategy.add("copy_file_range")
+            return copied
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP) or copied:
+                raise
+    while copied < size:
+        buf = os.read(fsrc, min(COPY_CHUNK, size - copied))
+        if not buf:
+            break
+        if digest is not None:
+            digest.update(buf)
+        view = memoryview(buf)
+        while view:
+            view = view[os.write(fdst, view):]
+        copied += len(buf)
+        if job:
+            job.add(len(buf))
+    if job and copied:
+        job.strategy.add("read/write")
+    return copied
+
+
+def fd_digest(fd, algo="sha256", job=None):
+    import hashlib
+    h = hashlib.new(algo)
+    os.lseek(fd, 0, os.SEEK_SET)
+    if hasattr(os, "posix_fadvise"):
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+    while True:
+        buf = os.read(fd, COPY_CHUNK)
+        if not buf:
+            break
+        h.update(buf)
+        if job:
+            job.add(len(buf))
+    return h.hexdigest()
+
+
+def file_digest(path, algo="sha256", job=None):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return fd_digest(fd, algo, job)
+    finally:
+        os.close(fd)
+
+
+def _data_extents(fd, size):
+    """Участки с данными разрежённого файла через SEEK_DATA/SEEK_HOLE: [(start, end), ...]."""
+    extents = []
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:  # дальше только дыра до конца файла
+                break
+            raise
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        extents.append((start, end))
+        pos = end
+    return extents
+
+
+_ZERO_BLOCK = bytes(1024 * 1024)
+
+# Мелким файлам предварительное размещение не нужно — лишний системный вызов
+PREALLOC_MIN = 1024 * 1024
+
+
+def _copy_contents(fsrc, fdst, size, st, job=None, digest=None):
+    """
+    Копирует содержимое: у разрежённых файлов (образы ВМ, БД) — только участки с данными,
+    дыры остаются дырами; плотные файлы заранее размещаются через posix_fallocate.
+    """
+    sparse = hasattr(os, "SEEK_DATA") and st.st_blocks * 512 < size
+    extents = None
+    if sparse:
+        try:
+            extents = _data_extents(fsrc, size)
+        except OSError:
+            extents = None  # ФС не умеет SEEK_DATA — копируем как плотный
+
+    if extents is None:
+        if size >= PREALLOC_MIN and hasattr(os, "posix_fallocate"):
+            try:
+                os.posix_fallocate(fdst, 0, size)
+            except OSError:
+                pass
+        os.lseek(fsrc, 0, os.SEEK_SET)
+        return _copy_fd(fsrc, fdst, size, job, digest)
+
+    copied = 0
+    pos = 0
+    for start, end in extents:
+        if digest is not None:
+            _digest_zeros(digest, start - pos)
+        os.lseek(fsrc, start, os.SEEK_SET)
+        os.lseek(fdst, start, os.SEEK_SET)
+        copied += _copy_fd(fsrc, fdst, end - start, job, digest)
+        pos = end
+    if digest is not None:
+        _digest_zeros(digest, size - pos)
+    os.ftruncate(fdst, size)  # хвостовая дыра
+    if job:
+        job.strategy.add("sparse")
+        job.add(skipped=size - copied)
+    return copied
+
+
+def _digest_zeros(digest, n):
+    while n > 0:
+        chunk = min(n, len(_ZERO_BLOCK))
+        digest.update(memoryview(_ZERO_BLOCK)[:chunk])
+        n -= chunk
+
+
+def _copy_digest(job, verify):
+    """Хеш, считаемый по ходу копирования: для манифеста задания (им же сверяем) или sha256 для verify."""
+    if job is not None and job.manifest is not None:
+        return job.manifest.new()
+    if verify:
+        import hashlib
+        return hashlib.sha256()
+    return None
+
+
+def copy_file(src, dest, job=None, fsync=False, verify=False, exclusive=False):
+    """
+    Скопировать файл (с метаданными, как copy2). verify — сверить хеш копии с исходником;
+    если у job есть манифест, сумма исходника считается по ходу чтения и попадает в него.
+    """
+    import shutil
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dest)
+        if job:
+            job.add(files=1)  # ссылка — тоже скопированный объект, в счётчиках и метриках
+        return
+    digest = _copy_digest(job, verify)
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_EXCL if exclusive else os.O_TRUNC)
+    fsrc = os.open(src, os.O_RDONLY)
+    try:
+        st = os.fstat(fsrc)
+        fdst = os.open(dest, flags, st.st_mode & 0o7777)
+        try:
+            _copy_contents(fsrc, fdst, st.st_size, st, job, digest)
+            if fsync:
+                os.fsync(fdst)
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+    shutil.copystat(src, dest)
+    if job:
+        job.add(files=1)
+    if verify and file_digest(dest, digest.name) != digest.hexdigest():
+        raise OSError(errno.EIO, "контрольная сумма копии не совпадает", dest)
+    if job and job.manifest is not None:
+        job.manifest.add(dest, digest.hexdigest())
+
+
+def copy_xattrs(src, dst, follow_symlinks=True):
+    """Перенести расширенные атрибуты; ФС без xattr молча пропускаем."""
+    if not hasattr(os, "listxattr"):
+        return
+    try:
+        names = os.listxattr(src, follow_symlinks=follow_symlinks)
+    except OSError as e:
+        if e.errno in (errno.ENOTSUP, errno.ENODATA, errno.EINVAL):
+            return
+        raise
+    for name in names:
+        try:
+            value = os.getxattr(src, name, follow_symlinks=follow_symlinks)
+            os.setxattr(dst, name, value, follow_symlinks=follow_symlinks)
+        except OSError as e:
+            if e.errno not in (errno.EPERM, errno.ENOTSUP, errno.ENODATA, errno.EINVAL):
+                raise
+
+
+# Сколько директорий дерева держим открытыми, пока их файлы копируются
+MAX_OPEN_DIRS = 64
+
+
+def _copy_tree_file(sfd, dfd, name, job, fsync, verify, dest_path):
+    """Рабочий поток copy_tree: копирует один файл относительно dir_fd, метаданные не трогает."""
+    fsrc = os.open(name, os.O_RDONLY | os.O_NOFOLLOW, dir_fd=sfd)
+    try:
+        st = os.fstat(fsrc)
+        fdst = os.open(name, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0o600, dir_fd=dfd)
+        try:
+            digest = _copy_digest(job, verify)
+            _copy_contents(fsrc, fdst, st.st_size, st, job, digest)
+            if fsync:
+                os.fsync(fdst)
+            if verify and fd_digest(fdst, digest.name) != digest.hexdigest():
+                raise OSError(errno.EIO, "контрольная сумма копии не совпадает", name)
+        finally:
+            os.close(fdst)
+    finally:
+        os.close(fsrc)
+    if job:
+        job.add(files=1)
+        if job.manifest is not None:
+            job.manifest.add(dest_path, digest.hexdigest())
+    return st
+
+
+class _TreeDir:
+    """Директория copy_tree, ожидающая своих файлов, чтобы применить метаданные пачкой."""
+
+    __slots__ = ("src", "dest", "st", "sfd", "dfd", "files", "links")
+
+    def __init__(self, src, dest, st, sfd, dfd):
+        self.src, self.dest, self.st = src, dest, st
+        self.sfd, self.dfd = sfd, dfd
+        self.files = []  # (name, future)
+        self.links = []  # (name, stat) символических ссылок
+
+
+def _finish_tree_dir(d, job, errors):
+    from concurrent.futures import TimeoutError as FutureTimeout
+    metas = []
+    for name, fut in d.files:
+        while True:
+            try:
+                metas.append((name, fut.result(timeout=Job.PROGRESS_INTERVAL)))
+                break
+            except FutureTimeout:
+                if job:
+                    job.tick()
+            except OSError as e:
+                errors.append((os.path.join(d.src, name), os.path.join(d.dest, name), str(e)))
+                break
+    try:
+        for name, st in metas:
+            os.chmod(name, st.st_mode & 0o7777, dir_fd=d.dfd)
+            os.utime(name, ns=(st.st_atime_ns, st.st_mtime_ns), dir_fd=d.dfd)
+            copy_xattrs(os.path.join(d.src, name), os.path.join(d.dest, name))
+        for name, st in d.links:
+            try:
+                os.utime(name, ns=(st.st_atime_ns, st.st_mtime_ns), dir_fd=d.dfd, follow_symlinks=False)
+            except NotImplementedError:
+                pass
+        # Сама директория — последней: после этого в ней уже ничего не меняется
+        copy_xattrs(d.src, d.dest)
+        os.chmod(d.dfd, d.st.st_mode & 0o7777)
+        os.utime(d.dfd, ns=(d.st.st_atime_ns, d.st.st_mtime_ns))
+    except OSError as e:
+        errors.append((d.src, d.dest, str(e)))
+    finally:
+        os.close(d.sfd)
+        os.close(d.dfd)
+
+
+def copy_tree(src, dest, job=None, workers=COPY_WORKERS, dirs_exist_ok=False, fsync=False, verify=False):
+    """
+    Копирование дерева, рассчитанное на миллионы мелких файлов. Обход через os.scandir,
+    open/mkdir относительно dir_fd; директории создаёт главный поток раньше, чем до них
+    доходят воркеры, а права/время/xattr применяются пачкой, когда файлы директории готовы.
+    Ошибки собираются и выбрасываются в конце одним shutil.Error, как у shutil.copytree.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    errors = []
+    try:
+        os.mkdir(dest, 0o700)
+    except FileExistsError:
+        if not dirs_exist_ok:
+            raise
+    stack = [(src, dest, os.stat(src))]
+    pending = deque()
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        while stack:
+            s_path, d_path, st = stack.pop()
+            try:
+                sfd = os.open(s_path, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError as e:
+                errors.append((s_path, d_path, str(e)))
+                continue
+            try:
+                dfd = os.open(d_path, os.O_RDONLY | os.O_DIRECTORY)
+            except OSError as e:
+                os.close(sfd)
+                errors.append((s_path, d_path, str(e)))
+                continue
+            d = _TreeDir(s_path, d_path, st, sfd, dfd)
+            try:
+                with os.scandir(sfd) as it:
+                    for entry in it:
+                        name = entry.name
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                # 0o700 до финальных прав, чтобы read-only директории можно было наполнить
+                                os.mkdir(name, 0o700, dir_fd=dfd)
+                                stack.append((os.path.join(s_path, name), os.path.join(d_path, name),
+                                              entry.stat(follow_symlinks=False)))
+                            elif entry.is_symlink():
+                                os.symlink(os.readlink(name, dir_fd=sfd), name, dir_fd=dfd)
+                                d.links.append((name, entry.stat(follow_symlinks=False)))
+                                if job:
+                                    job.add(files=1)
+                            elif entry.is_file(follow_symlinks=False):
+                                d.files.append((name, pool.submit(_copy_tree_file, sfd, dfd, name, job, fsync, verify,
+                                                                         os.path.join(d_path, name))))
+                            else:
+                                errors.append((entry.path, os.path.join(d_path, name), "специальный файл пропущен"))
+                        except OSError as e:
+                            errors.append((os.path.join(s_path, name), os.path.join(d_path, name), str(e)))
+            except OSError as e:
+                errors.append((s_path, d_path, str(e)))
+            pending.append(d)
+            while len(pending) > MAX_OPEN_DIRS:
+                _finish_tree_dir(pending.popleft(), job, errors)
+        while pending:
+            _finish_tree_dir(pending.popleft(), job, errors)
+    if fsync:
+        _fsync_dir(os.path.dirname(dest) or ".")
+    if errors:
+        import shutil
+        raise shutil.Error(errors)
+    return dest
+
+
+def copy_path(src, dest, job=None):
+    """Скопировать файл или директорию целиком (директории — через copy_tree, из архива — извлечением)."""
+    fs, inner = vfs_split(src)
+    if fs is not None:
+        fs.extract(inner, dest, job)
+    elif os.path.isdir(src) and not os.path.islink(src):
+        copy_tree(src, dest, job)
+    else:
+        # Имя подобрано вызывающим; O_EXCL — чтобы параллельная операция не оказалась перезаписана
+        copy_file(src, dest, job, exclusive=True)
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def move_path(src, dest, job=None, verify=VERIFY_CROSS_DEVICE_MOVE):
+    """
+    Переместить src в dest, подбирая свободное имя (dest_copy, ...) без гонки exists-then-act.
+    В пределах одной ФС — атомарный rename; между ФС — копия с fsync и сверкой,
+    исходник удаляется только после успешной записи. Возвращает фактический путь назначения.
+    """
+    import shutil
+    dest_dir = os.path.dirname(dest) or "."
+    for path, enter in ((src, False), (dest_dir, True)):
+        if vfs_split(path, enter)[0] is not None:
+            raise ReadOnlyFS(path)
+    if os.lstat(src).st_dev == os.stat(dest_dir).st_dev:
+        for candidate in dest_candidates(dest):
+            try:
+                rename_noreplace(src, candidate)
+            except FileExistsError:
+                continue
+            except OSError as e:
+                # Та же ФС, но другая точка монтирования (bind mount, overlayfs) — rename невозможен,
+                # перемещаем копией со сверкой ниже
+                if e.errno != errno.EXDEV:
+                    raise
+                break
+            if job:
+                job.strategy.add("rename")
+                job.add(files=1)
+                if job.undo is not None:
+                    job.undo.add(src, candidate)
+            return candidate
+
+    if job:
+        job.strategy.add("copy+unlink")
+    is_dir = os.path.isdir(src) and not os.path.islink(src)
+    for candidate in dest_candidates(dest):
+        # Резервируем имя атомарно: mkdir/O_EXCL падают, если имя уже занято
+        try:
+            if is_dir:
+                os.mkdir(candidate)
+            elif not os.path.islink(src):
+                os.close(os.open(candidate, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+            elif os.path.lexists(candidate):
+                continue
+        except FileExistsError:
+            continue
+        dest = candidate
+        break
+
+    try:
+        if is_dir:
+            copy_tree(src, dest, job, dirs_exist_ok=True, fsync=True, verify=verify)
+        else:
+            copy_file(src, dest, job, fsync=True, verify=verify)
+        _fsync_dir(dest_dir)
+    except BaseException:
+        # Откатываем частичную копию; исходник остаётся нетронутым
+        try:
+            if is_dir:
+                shutil.rmtree(dest)
+            else:
+                os.unlink(dest)
+        except OSError:
+            pass
+        raise
+
+    if is_dir:
+        shutil.rmtree(src)
+    else:
+        os.unlink(src)
+    return dest
+
+# --- Виртуальная ФС: архивы как директории ---
+
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+
+
+class ReadOnlyFS(OSError):
+    """Операция записи внутри архива."""
+
+    def __init__(self, path):
+        super().__init__(errno.EROFS, "архив доступен только для чтения", path)
+
+
+def is_archive_name(name):
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def safe_member_path(name, strict=True):
+    """
+    Нормализованный относительный путь члена архива или None, если он небезопасен:
+    содержит .. или (при strict) абсолютный. Без strict ведущий / просто отбрасывается.
+    """
+    name = name.replace("\\", "/")
+    if strict and (name.startswith("/") or (len(name) > 1 and name[1] == ":")):
+        return None
+    parts = [p for p in name.split("/") if p not in ("", ".")]
+    if not parts or ".." in parts:
+        return None
+    return "/".join(parts)
+
+
+class ArchiveEntry:
+    __slots__ = ("name", "is_dir", "size", "mtime", "mode", "member", "offset")
+
+    def __init__(self, name, is_dir, size=0, mtime=0, mode=0o644, member=None, offset=None):
+        self.name = name      # путь внутри архива без завершающего /
+        self.is_dir = is_dir
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.member = member  # имя члена в архиве (для zip)
+        self.offset = offset  # смещение данных в несжатом tar — читаем без распаковки
+
+
+class ArchiveFS:
+    """
+    Архив (zip/tar), открытый как дерево директорий, только для чтения.
+    Индекс членов строится один раз при первом входе; данные читаются потоково по запросу.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {"": ArchiveEntry("", True)}
+        self.children = {"": {}}
+        self.is_zip = path.lower().endswith(".zip")
+        self.compressed = not self.is_zip and not path.lower().endswith(".tar")
+        if self.is_zip:
+            self._index_zip()
+        else:
+            self._index_tar()
+
+    @staticmethod
+    def _clean(name):
+        return safe_member_path(name, strict=False)
+
+    def _add(self, entry):
+        parent, _, base = entry.name.rpartition("/")
+        self._ensure_dir(parent)
+        old = self.entries.get(entry.name)
+        if old is not None and old.is_dir and entry.is_dir:
+            old.mtime, old.mode = entry.mtime, entry.mode
+            return
+        self.entries[entry.name] = entry
+        self.children[parent][base] = entry
+        if entry.is_dir:
+            self.children.setdefault(entry.name, {})
+
+    def _ensure_dir(self, name):
+        # Промежуточные директории, которых нет в архиве явно
+        if name in self.children:
+            return
+        self._add(ArchiveEntry(name, True, mode=0o755))
+
+    def _index_zip(self):
+        import zipfile
+        with zipfile.ZipFile(self.path) as zf:
+            for info in zf.infolist():
+                name = self._clean(info.filename)
+                if name is None:
+                    continue
+                mode = (info.external_attr >> 16) & 0o7777 or (0o755 if info.is_dir() else 0o644)
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                self._add(ArchiveEntry(name, info.is_dir(), info.file_size, mtime, mode, info.filename))
+
+    def _index_tar(self):
+        import tarfile
+        # Сжатый tar приходится один раз прочитать целиком; дальше — только индекс
+        with (TarStream.open(self.path) if self.compressed else tarfile.open(self.path, "r:")) as tf:
+            for ti in tf:
+                name = self._clean(ti.name)
+                if name is None or not (ti.isdir() or ti.isfile()):
+                    continue
+                self._add(ArchiveEntry(name, ti.isdir(), ti.size, ti.mtime, ti.mode, ti.name,
+                                       None if self.compressed else ti.offset_data))
+
+    def entry(self, inner):
+        return self.entries.get(inner.strip("/"))
+
+    def stat(self, inner):
+        e = self.entry(inner)
+        if e is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), os.path.join(self.path, inner))
+        kind = stat.S_IFDIR if e.is_dir else stat.S_IFREG
+        return os.stat_result((kind | (e.mode & 0o7777), 0, 0, 1, 0, 0, e.size, e.mtime, e.mtime, e.mtime))
+
+    def open(self, inner):
+        """Потоковое чтение одного члена архива."""
+        e = self.entry(inner)
+        if e is None or e.is_dir:
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), os.path.join(self.path, inner))
+        if self.is_zip:
+            import zipfile
+            zf = zipfile.ZipFile(self.path)
+            return _LimitedReader(zf.open(e.member), e.size, owner=zf)
+        if not self.compressed:
+            f = open(self.path, "rb")
+            f.seek(e.offset)
+            return _LimitedReader(f, e.size, owner=f)
+        tf = TarStream.open(self.path)
+        for ti in tf:
+            if ti.name == e.member:
+                return _LimitedReader(tf.extractfile(ti), e.size, owner=tf)
+        tf.close()
+        raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), os.path.join(self.path, inner))
+
+    def listdir(self, inner):
+        children = self.children.get(inner.strip("/"))
+        if children is None:
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), os.path.join(self.path, inner))
+        return list(children)
+
+    def _write_member(self, fobj, entry, dest, job):
+        fd = os.open(dest, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            while True:
+                buf = fobj.read(COPY_CHUNK)
+                if not buf:
+                    break
+                os.write(fd, buf)
+                if job:
+                    job.add(len(buf))
+        finally:
+            os.close(fd)
+        os.chmod(dest, entry.mode & 0o7777)
+        os.utime(dest, (entry.mtime, entry.mtime))
+        if job:
+            job.add(files=1)
+
+    def extract(self, inner, dest, job=None):
+        """Извлечь файл или поддерево inner в dest, не распаковывая остальной архив."""
+        root = self.entry(inner)
+        if root is None:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), os.path.join(self.path, inner))
+        wanted = {}  # member -> (entry, dest)
+        dirs = []
+        if root.is_dir:
+            prefix = root.name + "/" if root.name else ""
+            for name, e in self.entries.items():
+                if name == root.name or not name.startswith(prefix):
+                    continue
+                target = os.path.join(dest, name[len(prefix):])
+                if e.is_dir:
+                    dirs.append((e, target))
+                else:
+                    wanted[e.member] = (e, target)
+            os.mkdir(dest)
+            for e, target in sorted(dirs, key=lambda d: d[1]):
+                os.makedirs(target, exist_ok=True)
+        else:
+            wanted[root.member] = (root, dest)
+
+        if self.is_zip:
+            import zipfile
+            with zipfile.ZipFile(self.path) as zf:
+                for member, (e, target) in wanted.items():
+                    with zf.open(member) as f:
+                        self._write_member(f, e, target, job)
+        elif not self.compressed:
+            with open(self.path, "rb") as f:
+                for member, (e, target) in wanted.items():
+                    f.seek(e.offset)
+                    self._write_member(_LimitedReader(f, e.size), e, target, job)
+        elif wanted:
+            # Потоково идём по архиву и останавливаемся, как только собрали всё нужное
+            remaining = len(wanted)
+            with TarStream.open(self.path) as tf:
+                for ti in tf:
+                    item = wanted.get(ti.name)
+                    if item is None or not ti.isfile():
+                        continue
+                    self._write_member(tf.extractfile(ti), item[0], item[1], job)
+                    remaining -= 1
+                    if not remaining:
+                        break
+
+        for e, target in sorted(dirs, key=lambda d: d[1], reverse=True):
+            os.utime(target, (e.mtime, e.mtime))
+        return dest
+
+
+class TarStream:
+    """
+    Потоковое чтение tar (режим "r|"). gzip/bz2/xz распаковываются модулями gzip/bz2/lzma:
+    они читают многочленные потоки (pigz, ParallelGzipWriter), а "r|*" у tarfile останавливается
+    после первого члена. Тип сжатия — по сигнатуре; wrap — обёртка над сырым файлом (счётчик прогресса).
+    """
+
+    def __init__(self, raw, wrap=None, own=False):
+        import tarfile
+        self._files = [raw] if own else []
+        head = raw.read(6)
+        raw.seek(0)
+        src = wrap(raw) if wrap is not None else raw
+        if head.startswith(b"\x1f\x8b"):
+            import gzip
+            src = gzip.GzipFile(fileobj=src, mode="rb")
+            self._files.append(src)
+        elif head.startswith(b"BZh"):
+            import bz2
+            src = bz2.BZ2File(src)
+            self._files.append(src)
+        elif head.startswith(b"\xfd7zXZ\x00"):
+            import lzma
+            src = lzma.LZMAFile(src)
+            self._files.append(src)
+        self.tf = tarfile.open(fileobj=src, mode="r|")
+
+    @classmethod
+    def open(cls, path):
+        raw = open(path, "rb")
+        try:
+            return cls(raw, own=True)
+        except BaseException:
+            raw.close()
+            raise
+
+    def __iter__(self):
+        return iter(self.tf)
+
+    def extractfile(self, ti):
+        return self.tf.extractfile(ti)
+
+    def close(self):
+        self.tf.close()
+        for f in reversed(self._files):
+            f.close()
+        self._files = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _LimitedReader:
+    """Чтение не более size байт из открытого файла (член архива); owner закрывается вместе с ним."""
+
+    def __init__(self, f, size, owner=None):
+        self.f, self.left, self.owner = f, size, owner
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.owner is not None:
+            self.owner.close()
+            self.owner = None
+
+    def read(self, n):
+        n = min(n, self.left)
+        if n <= 0:
+            return b""
+        buf = self.f.read(n)
+        self.left -= len(buf)
+        return buf
+
+
+# Индексы открытых архивов: (путь, mtime, размер) -> ArchiveFS или ошибка; последние ARCHIVE_CACHE_MAX
+ARCHIVE_CACHE_MAX = 8
+_ARCHIVE_CACHE = OrderedDict()
+_archive_lock = threading.Lock()
+
+
+def open_archive(path):
+    """ArchiveFS для файла архива; повреждённый или обрезанный архив — OSError (и она тоже кешируется)."""
+    import lzma
+    import tarfile
+    import zipfile
+    import zlib
+    st = os.stat(path)
+    key = (path, st.st_mtime_ns, st.st_size)
+    with _archive_lock:
+        fs = _ARCHIVE_CACHE.get(key)
+        if fs is not None:
+            _ARCHIVE_CACHE.move_to_end(key)
+    if fs is None:
+        try:
+            fs = ArchiveFS(path)
+        except (zipfile.BadZipFile, zipfile.LargeZipFile, tarfile.TarError, EOFError, zlib.error,
+                lzma.LZMAError) as e:
+            fs = OSError(errno.EINVAL, f"повреждённый архив: {e}", path)
+        with _archive_lock:
+            _ARCHIVE_CACHE[key] = fs
+            while len(_ARCHIVE_CACHE) > ARCHIVE_CACHE_MAX:
+                _ARCHIVE_CACHE.popitem(last=False)
+    if isinstance(fs, OSError):
+        raise fs
+    return fs
+
+
+def vfs_split(path, enter=False):
+    """
+    Разбить путь на (ArchiveFS, путь внутри) для путей вида /x/a.tar.gz/dir/file,
+    иначе (None, path). Сам файл архива считается корнем архива только при enter=True
+    (листинг, «текущая директория»); для копирования/удаления это обычный файл.
+    Обычные пути не стоят ни одного stat, если в них нет имён архивов.
+    Архив, который не открыть (см. open_archive), считается обычным файлом.
+    """
+    parts = path.rstrip(os.sep).split(os.sep)
+    last = len(parts) if enter else len(parts) - 1
+    for i in range(1, last):
+        if is_archive_name(parts[i]):
+            prefix = os.sep.join(parts[:i + 1])
+            if os.path.isfile(prefix):
+                try:
+                    return open_archive(prefix), "/".join(parts[i + 1:])
+                except OSError:
+                    break
+    return None, path
+
+
+def vfs_exists(path):
+    fs, inner = vfs_split(path)
+    return os.path.exists(path) if fs is None else fs.entry(inner) is not None
+
+
+def vfs_isdir(path):
+    fs, inner = vfs_split(path)
+    if fs is None:
+        return os.path.isdir(path)
+    e = fs.entry(inner)
+    return e is not None and e.is_dir
+
+
+# --- Бэкенды хранилища ---
+
+class Backend:
+    """
+    Всё, что FileManager делает с хранилищем: листинг, stat, чтение, копирование,
+    перемещение, удаление. Пути — строки POSIX-вида; по умолчанию используется LocalBackend.
+    """
+
+    def listdir(self, path):
+        raise NotImplementedError
+
+    def stat(self, path):
+        raise NotImplementedError
+
+    def lstat(self, path):
+        return self.stat(path)
+
+    def listdir_partial(self, path, limit):
+        """Не более limit имён (в любом порядке) и признак, что это весь листинг."""
+        names = self.listdir(path)
+        return names[:limit], len(names) <= limit
+
+    def open(self, path):
+        """Файловый объект для чтения в двоичном режиме."""
+        raise NotImplementedError
+
+    def copy(self, src, dest, job=None):
+        raise NotImplementedError
+
+    def move(self, src, dest, job=None):
+        """Переместить, подобрав свободное имя; вернуть фактический путь назначения."""
+        raise NotImplementedError
+
+    def delete(self, path):
+        raise NotImplementedError
+
+    def rename(self, src, dest):
+        raise NotImplementedError
+
+    def rename_noreplace(self, src, dest):
+        """Переименовать, только если dest не существует (иначе FileExistsError)."""
+        raise NotImplementedError
+
+    def trash(self, path):
+        """Удалить с возможностью восстановления; вернуть путь в корзине. Без корзины — обычное удаление."""
+        self.delete(path)
+        return None
+
+    def mkdir(self, path):
+        raise NotImplementedError
+
+    def create_file(self, path):
+        raise NotImplementedError
+
+    def is_readonly(self, path):
+        return False
+
+    # Производные проверки через stat — бэкенды могут переопределить более дешёвыми
+
+    def exists(self, path):
+        try:
+            self.lstat(path)
+            return True
+        except OSError:
+            return False
+
+    def isdir(self, path):
+        try:
+            return stat.S_ISDIR(self.stat(path).st_mode)
+        except OSError:
+            return False
+
+    def islink(self, path):
+        try:
+            return stat.S_ISLNK(self.lstat(path).st_mode)
+        except OSError:
+            return False
+
+    def is_executable(self, path):
+        try:
+            return bool(self.stat(path).st_mode & 0o111)
+        except OSError:
+            return False
+
+
+class LocalBackend(Backend):
+    """Локальная POSIX-ФС; пути внутри архивов обслуживаются ArchiveFS (только чтение)."""
+
+    def listdir(self, path):
+        fs, inner = vfs_split(path, enter=True)
+        return fs.listdir(inner) if fs is not None else os.listdir(path)
+
+    def stat(self, path):
+        fs, inner = vfs_split(path)
+        return fs.stat(inner) if fs is not None else os.stat(path)
+
+    def listdir_partial(self, path, limit):
+        if vfs_split(path, enter=True)[0] is not None:
+            return super().listdir_partial(path, limit)
+        names = []
+        with os.scandir(path) as it:
+            for entry in it:
+                if len(names) >= limit:
+                    return names, False
+                names.append(entry.name)
+        return names, True
+
+    def lstat(self, path):
+        fs, inner = vfs_split(path)
+        return fs.stat(inner) if fs is not None else os.lstat(path)
+
+    def open(self, path):
+        fs, inner = vfs_split(path)
+        return fs.open(inner) if fs is not None else open(path, "rb")
+
+    def copy(self, src, dest, job=None):
+        copy_path(src, dest, job)
+        return dest
+
+    def move(self, src, dest, job=None):
+        return move_path(src, dest, job)
+
+    def delete(self, path):
+        if vfs_split(path)[0] is not None:
+            raise ReadOnlyFS(path)
+        if os.path.isdir(path) and not os.path.islink(path):
+            import shutil
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+
+    def rename(self, src, dest):
+        os.rename(src, dest)
+
+    def rename_noreplace(self, src, dest):
+        rename_noreplace(src, dest)
+
+    def trash(self, path):
+        if vfs_split(path)[0] is not None:
+            raise ReadOnlyFS(path)
+        return trash_path(path).file
+
+    def mkdir(self, path):
+        os.mkdir(path)
+
+    def create_file(self, path):
+        open(path, 'a').close()
+
+    def is_readonly(self, path):
+        return vfs_split(path, enter=True)[0] is not None
+
+    def exists(self, path):
+        return vfs_exists(path)
+
+    def isdir(self, path):
+        return vfs_isdir(path)
+
+    def islink(self, path):
+        return os.path.islink(path)
+
+    def is_executable(self, path):
+        return os.access(path, os.X_OK)
+
+
+class _MemDir:
+    """
+    Директория MemoryBackend. synthetic/subdirs — число сгенерированных файлов и поддиректорий
+    (по child_files файлов в каждой), которые существуют, пока их не тронули.
+    """
+
+    __slots__ = ("children", "synthetic", "subdirs", "child_files", "mtime")
+
+    def __init__(self, synthetic=0, subdirs=0, child_files=0):
+        self.children = {}  # name -> _MemDir | bytes
+        self.synthetic = synthetic
+        self.subdirs = subdirs
+        self.child_files = child_files
+        self.mtime = 0.0
+
+    def materialize(self):
+        """Превратить сгенерированные записи в настоящие (перед изменением директории)."""
+        if self.synthetic or self.subdirs:
+            for i in range(self.subdirs):
+                self.children.setdefault(f"dir{i:06d}", _MemDir(self.child_files))
+            for i in range(self.synthetic):
+                self.children.setdefault(f"file{i:08d}", MemoryBackend.SYNTHETIC_DATA)
+            self.synthetic = self.subdirs = 0
+
+
+class MemoryBackend(Backend):
+    """
+    Хранилище в памяти для тестов и профилирования без дискового шума.
+    Большие деревья генерируются лениво: synthetic_tree(root, 10_000, 1000) — 10M записей,
+    но память тратится только на реально открытые директории. latency — задержка на каждый вызов.
+    """
+
+    SYNTHETIC_DATA = b"x" * 64
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.root = _MemDir()
+        self.calls = 0
+
+    def _wait(self):
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _split(self, path):
+        return [p for p in path.split("/") if p]
+
+    def _lookup(self, path):
+        node = self.root
+        for part in self._split(path):
+            if not isinstance(node, _MemDir):
+                raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+            child = node.children.get(part)
+            if child is None:
+                child = self._synthetic_child(node, part)
+            if child is None:
+                raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+            node = child
+        return node
+
+    @staticmethod
+    def _synthetic_child(node, name):
+        if name.startswith("dir") and name[3:].isdigit() and int(name[3:]) < node.subdirs:
+            node.children[name] = _MemDir(node.child_files)
+            return node.children[name]
+        if name.startswith("file") and name[4:].isdigit() and int(name[4:]) < node.synthetic:
+            return MemoryBackend.SYNTHETIC_DATA
+        return None
+
+    def _parent(self, path):
+        parent, _, name = path.rstrip("/").rpartition("/")
+        node = self._lookup(parent)
+        if not isinstance(node, _MemDir):
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), parent)
+        node.materialize()
+        return node, name
+
+    def synthetic_tree(self, root, dirs, files_per_dir):
+        """Сгенерировать в root dirs поддиректорий по files_per_dir файлов в каждой."""
+        self.makedirs(root)
+        parent, name = self._parent(root)
+        parent.children[name] = _MemDir(0, dirs, files_per_dir)
+
+    def makedirs(self, path):
+        node = self.root
+        for part in self._split(path):
+            node.materialize()
+            node = node.children.setdefault(part, _MemDir())
+
+    def write_file(self, path, data):
+        parent, name = self._parent(path)
+        parent.children[name] = bytes(data)
+        parent.mtime = time.time()
+
+    def listdir(self, path):
+        self._wait()
+        node = self._lookup(path)
+        if not isinstance(node, _MemDir):
+            raise NotADirectoryError(errno.ENOTDIR, os.strerror(errno.ENOTDIR), path)
+        names = list(node.children)
+        if node.subdirs or node.synthetic:
+            names.extend(n for n in (f"dir{i:06d}" for i in range(node.subdirs)) if n not in node.children)
+            names.extend(f"file{i:08d}" for i in range(node.synthetic))
+        return names
+
+    def stat(self, path):
+        self._wait()
+        node = self._lookup(path)
+        if isinstance(node, _MemDir):
+            return os.stat_result((stat.S_IFDIR | 0o755, 0, 0, 1, 0, 0, 0, node.mtime, node.mtime, node.mtime))
+        return os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, len(node), 0, 0, 0))
+
+    def open(self, path):
+        import io
+        self._wait()
+        node = self._lookup(path)
+        if isinstance(node, _MemDir):
+            raise IsADirectoryError(errno.EISDIR, os.strerror(errno.EISDIR), path)
+        return io.BytesIO(node)
+
+    def _clone(self, node, job):
+        if isinstance(node, _MemDir):
+            node.materialize()
+            copy = _MemDir()
+            copy.children = {k: self._clone(v, job) for k, v in node.children.items()}
+            return copy
+        if job:
+            job.add(len(node), files=1)
+        return node  # bytes неизменяемы — копия не нужна
+
+    def copy(self, src, dest, job=None):
+        self._wait()
+        node = self._lookup(src)
+        parent, name = self._parent(dest)
+        if name in parent.children:
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+        parent.children[name] = self._clone(node, job)
+        return dest
+
+    def move(self, src, dest, job=None):
+        self._wait()
+        sparent, sname = self._parent(src)
+        node = self._lookup(src)
+        dparent, _ = self._parent(dest)
+        for candidate in dest_candidates(dest):
+            name = candidate.rstrip("/").rpartition("/")[2]
+            if name not in dparent.children:
+                dparent.children[name] = node
+                del sparent.children[sname]
+                if job:
+                    job.strategy.add("rename")
+                    job.add(files=1)
+                return candidate
+
+    def delete(self, path):
+        self._wait()
+        parent, name = self._parent(path)
+        if name not in parent.children:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+        del parent.children[name]
+
+    def rename(self, src, dest):
+        self._wait()
+        sparent, sname = self._parent(src)
+        dparent, dname = self._parent(dest)
+        if sname not in sparent.children:
+            raise FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), src)
+        dparent.children[dname] = sparent.children.pop(sname)
+
+    def rename_noreplace(self, src, dest):
+        self._wait()
+        dparent, dname = self._parent(dest)
+        if dname in dparent.children:
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+        self.rename(src, dest)
+
+    def mkdir(self, path):
+        self._wait()
+        parent, name = self._parent(path)
+        if name in parent.children:
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), path)
+        parent.children[name] = _MemDir()
+
+    def create_file(self, path):
+        self._wait()
+        parent, name = self._parent(path)
+        parent.children.setdefault(name, b"")
+
+
+# --- Корзина (XDG Trash) ---
+
+# Квоты фоновой очистки: старше срока — удаляем, сверх объёма — удаляем самые старые,
+# но только старше TRASH_GRACE_DAYS: недавно удалённое всегда можно вернуть
+TRASH_MAX_AGE_DAYS = 30
+TRASH_MAX_BYTES = 10 * 1024 ** 3
+TRASH_GRACE_DAYS = 3
+# Метка d удаляет в корзину (False — навсегда, как раньше)
+USE_TRASH = True
+
+
+class TrashEntry:
+    __slots__ = ("trash_dir", "name", "path", "deleted")
+
+    def __init__(self, trash_dir, name, path, deleted):
+        self.trash_dir = trash_dir  # корзина (с files/ и info/)
+        self.name = name            # имя в files/
+        self.path = path            # откуда удалён
+        self.deleted = deleted      # время удаления, секунды
+
+    @property
+    def file(self):
+        return os.path.join(self.trash_dir, "files", self.name)
+
+    @property
+    def info(self):
+        return os.path.join(self.trash_dir, "info", self.name + ".trashinfo")
+
+
+def home_trash():
+    data = os.environ.get("XDG_DATA_HOME") or os.path.expanduser("~/.local/share")
+    return os.path.join(data, "Trash")
+
+
+def _mount_root(path):
+    """
+    Точка монтирования, в которой лежит path. По /proc/self/mountinfo — так видны и bind mount
+    той же ФС, которые os.path.ismount не различает (st_dev у них общий).
+    """
+    path = os.path.realpath(path)
+    try:
+        with open("/proc/self/mountinfo", encoding="utf-8", errors="surrogateescape") as f:
+            points = [line.split()[4].replace("\\040", " ").replace("\\011", "\t").replace("\\134", "\\")
+                      for line in f]
+    except OSError:
+        points = []
+    best = None
+    for point in points:
+        if (path == point or path.startswith(point.rstrip(os.sep) + os.sep)) and \
+                (best is None or len(point) > len(best)):
+            best = point
+    if best is not None:
+        return best
+    while not os.path.ismount(path):
+        path = os.path.dirname(path)
+    return path
+
+
+def trash_dirs_for(path):
+    """
+    Корзины для path в порядке предпочтения: домашняя, если она на той же ФС, затем
+    $topdir/.Trash-$UID в корне точки монтирования — удаление в них обычно один rename.
+    Корзины, которые не создать или не записать, пропускаются.
+    """
+    parent = os.path.dirname(os.path.abspath(path)) or "/"
+    dev = os.stat(parent).st_dev
+    home = home_trash()
+    try:
+        os.makedirs(home, 0o700, exist_ok=True)
+        usable = os.stat(home).st_dev == dev and _trash_writable(home)
+    except OSError:
+        usable = False
+    if usable:
+        yield home
+    trash = os.path.join(_mount_root(parent), f".Trash-{os.getuid()}")
+    try:
+        os.mkdir(trash, 0o700)
+    except FileExistsError:
+        st = os.lstat(trash)
+        # Чужая или подменённая ссылкой корзина не годится (спецификация XDG)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+            return
+    except OSError:
+        return  # корень ФС закрыт на запись — остаётся домашняя корзина (копией)
+    if _trash_writable(trash):
+        yield trash
+
+
+def _trash_writable(trash):
+    """Создать files/ и info/; False — в эту корзину не записать."""
+    try:
+        for sub in ("files", "info"):
+            os.makedirs(os.path.join(trash, sub), 0o700, exist_ok=True)
+    except OSError:
+        return False
+    return all(os.access(os.path.join(trash, sub), os.W_OK | os.X_OK) for sub in ("files", "info"))
+
+
+def _move_into_trash(src, dest):
+    """Перенос копией со сверкой — когда rename не проходит ни в одну корзину."""
+    if os.path.lexists(dest):
+        raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), dest)
+    move_path(src, dest)
+
+
+def trash_path(path):
+    """
+    Перенести path в корзину переименованием (O(1) для любого размера); вернуть TrashEntry.
+    Если ни в одну корзину не переименовать (EXDEV на bind mount и overlayfs, корзину
+    не создать или не записать), переносим в домашнюю копией со сверкой, как между ФС.
+    """
+    path = os.path.abspath(path)
+    for trash in trash_dirs_for(path):
+        try:
+            entry = _trash_into(trash, path, rename_noreplace)
+        except OSError as e:
+            # Ошибка в самой корзине (files/, info/) — как EXDEV: пробуем следующую
+            if e.errno != errno.EXDEV and not str(e.filename or "").startswith(trash + os.sep):
+                raise
+            continue
+        _recent_trash.add(entry.file)
+        return entry
+    entry = _trash_into(home_trash(), path, _move_into_trash)
+    _recent_trash.add(entry.file)
+    return entry
+
+
+def _trash_into(trash, path, move):
+    from urllib.parse import quote
+    files, info = os.path.join(trash, "files"), os.path.join(trash, "info")
+    os.makedirs(files, 0o700, exist_ok=True)
+    os.makedirs(info, 0o700, exist_ok=True)
+    base = os.path.basename(path.rstrip(os.sep))
+    now = time.time()
+    record = ("[Trash Info]\nPath=" + quote(path) + "\nDeletionDate=" +
+              time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(now)) + "\n").encode()
+    for n in range(1, 10_000):
+        name = base if n == 1 else f"{base}.{n}"
+        # Имя резервируем созданием .trashinfo с O_EXCL, потом переносим сам файл
+        try:
+            fd = os.open(os.path.join(info, name + ".trashinfo"), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        except FileExistsError:
+            continue
+        entry = TrashEntry(trash, name, path, now)
+        try:
+            os.write(fd, record)
+        finally:
+            os.close(fd)
+        try:
+            move(path, entry.file)
+        except FileExistsError:
+            os.unlink(entry.info)  # осиротевший файл без info — берём следующее имя
+            continue
+        except BaseException:
+            os.unlink(entry.info)
+            raise
+        return entry
+    raise OSError(errno.EEXIST, "не удалось подобрать имя в корзине", path)
+
+
+def _read_trashinfo(trash, info_name):
+    from urllib.parse import unquote
+    path = deleted = None
+    with open(os.path.join(trash, "info", info_name), encoding="utf-8", errors="surrogateescape") as f:
+        for line in f:
+            key, _, value = line.strip().partition("=")
+            if key == "Path":
+                path = unquote(value)
+                if not os.path.isabs(path):
+                    path = os.path.join(os.path.dirname(trash), path)  # относительно корня ФС
+            elif key == "DeletionDate":
+                try:
+                    deleted = time.mktime(time.strptime(value, "%Y-%m-%dT%H:%M:%S"))
+                except ValueError:
+                    pass
+    if path is None:
+        return None
+    return TrashEntry(trash, info_name[:-len(".trashinfo")], path, deleted or 0)
+
+
+def trash_dirs():
+    """Домашняя корзина и .Trash-$UID на всех смонтированных ФС, где они есть."""
+    dirs = [home_trash()]
+    suffix = f".Trash-{os.getuid()}"
+    try:
+        with open("/proc/self/mounts") as f:
+            for line in f:
+                mount = line.split()[1].replace("\\040", " ")
+                dirs.append(os.path.join(mount, suffix))
+    except OSError:
+        pass
+    return [d for d in dict.fromkeys(dirs) if os.path.isdir(os.path.join(d, "info"))]
+
+
+def trash_entries(dirs=None):
+    """Все записи корзин, новые первыми."""
+    entries = []
+    for trash in dirs or trash_dirs():
+        try:
+            names = os.listdir(os.path.join(trash, "info"))
+        except OSError:
+            continue
+        for info_name in names:
+            if not info_name.endswith(".trashinfo"):
+                continue
+            try:
+                entry = _read_trashinfo(trash, info_name)
+            except OSError:
+                continue
+            if entry is not None and os.path.lexists(entry.file):
+                entries.append(entry)
+    entries.sort(key=lambda e: e.deleted, reverse=True)
+    return entries
+
+
+def restore_trash(entry):
+    """Вернуть запись на место переименованием; если имя занято — рядом с суффиксом _copy. Вернуть путь."""
+    os.makedirs(os.path.dirname(entry.path), exist_ok=True)
+    for candidate in dest_candidates(entry.path):
+        try:
+            rename_noreplace(entry.file, candidate)
+        except FileExistsError:
+            continue
+        try:
+            os.unlink(entry.info)
+        except OSError:
+            pass
+        return candidate
+
+
+# Удалённое в этом запуске: очистка по объёму его не трогает, даже если часы врут
+_recent_trash = set()
+
+# Кеш размеров директорий в корзине по спецификации XDG: "размер mtime-info имя-в-%-кодировке"
+TRASH_SIZES = "directorysizes"
+
+
+def _read_dir_sizes(trash):
+    from urllib.parse import unquote
+    sizes = {}
+    try:
+        with open(os.path.join(trash, TRASH_SIZES), encoding="utf-8", errors="surrogateescape") as f:
+            for line in f:
+                parts = line.split(" ", 2)
+                if len(parts) == 3:
+                    try:
+                        sizes[unquote(parts[2].rstrip("\n"))] = (int(parts[0]), int(parts[1]))
+                    except ValueError:
+                        pass
+    except OSError:
+        pass
+    return sizes
+
+
+def _write_dir_sizes(trash, sizes):
+    from urllib.parse import quote
+    path = os.path.join(trash, TRASH_SIZES)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp, "w", encoding="utf-8", errors="surrogateescape") as f:
+            f.write("".join(f"{size} {mtime} {quote(name)}\n" for name, (size, mtime) in sizes.items()))
+        os.replace(tmp, path)
+    except OSError:
+        pass  # кеш — не более чем ускорение
+
+
+def trash_sizes(trash, entries):
+    """
+    {имя: байт на диске} для записей корзины. Директории считаются обходом один раз:
+    результат кешируется в directorysizes и действителен, пока не изменился их .trashinfo.
+    """
+    cached = _read_dir_sizes(trash)
+    fresh = {}
+    sizes = {}
+    for entry in entries:
+        try:
+            st = os.lstat(entry.file)
+            info_mtime = int(os.stat(entry.info).st_mtime)
+        except OSError:
+            sizes[entry.name] = 0
+            continue
+        if not stat.S_ISDIR(st.st_mode):
+            sizes[entry.name] = st.st_blocks * 512
+            continue
+        size, mtime = cached.get(entry.name, (None, None))
+        if size is None or mtime != info_mtime:
+            size = _tree_size(entry.file)
+        fresh[entry.name] = (size, info_mtime)
+        sizes[entry.name] = size
+    if fresh != cached:
+        _write_dir_sizes(trash, fresh)
+    return sizes
+
+
+def _tree_size(path):
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return 0
+    if not stat.S_ISDIR(st.st_mode):
+        return st.st_blocks * 512
+    total = st.st_blocks * 512
+    for dirpath, dirnames, filenames in os.walk(path):
+        for name in dirnames + filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except OSError:
+                pass
+    return total
+
+
+def purge_trash(max_age_days=TRASH_MAX_AGE_DAYS, max_bytes=TRASH_MAX_BYTES, dirs=None,
+                grace_days=TRASH_GRACE_DAYS):
+    """
+    Очистить корзины по квотам (каждую отдельно — объём считается на своей ФС). Вернуть число удалённых.
+    Записи моложе grace_days и удалённые в этом запуске не трогаются никогда, даже сверх объёма.
+    """
+    import shutil
+    removed = 0
+    now = time.time()
+    cutoff = now - max_age_days * 86400
+    grace = now - grace_days * 86400
+    for trash in dirs or trash_dirs():
+        entries = trash_entries([trash])
+        sizes = trash_sizes(trash, entries)
+        total = sum(sizes.values())
+        # От старых к новым: сначала всё старше срока, затем пока не влезем в объём
+        for entry in reversed(entries):
+            if entry.deleted >= grace:
+                break
+            if entry.deleted >= cutoff and total <= max_bytes:
+                break
+            if entry.file in _recent_trash:
+                continue
+            try:
+                if os.path.isdir(entry.file) and not os.path.islink(entry.file):
+                    shutil.rmtree(entry.file)
+                else:
+                    os.unlink(entry.file)
+                os.unlink(entry.info)  # info — после файла, чтобы не остались невидимые данные
+            except OSError:
+                continue
+            total -= sizes[entry.name]
+            removed += 1
+    return removed
+
+
+_purge_lock = threading.Lock()
+
+
+def purge_trash_async(**quotas):
+    """Очистка в фоновом потоке; если очистка уже идёт — ничего не делаем."""
+    if not _purge_lock.acquire(blocking=False):
+        return
+
+    def run():
+        try:
+            purge_trash(**quotas)
+        finally:
+            _purge_lock.release()
+
+    threading.Thread(target=run, name="trash-purge", daemon=True).start()
+
+
+# --- Журнал отмены ---
+
+# Обратимые операции (переименование, перемещение в пределах ФС, корзина) — по строке на операцию
+UNDO_LOG = os.path.expanduser("~/.tui_fm_undo.log")
+# Сколько последних операций хранить; журнал сжимается, когда перерастает UNDO_LOG_MAX
+UNDO_KEEP = 50
+UNDO_LOG_MAX = 4 * 1024 * 1024
+
+
+class UndoBatch:
+    """
+    Переименования одной операции в порядке выполнения: (откуда, куда, вид, inode, mtime_ns),
+    вид "r" — переименование/перемещение, "t" — в корзину. inode и mtime назначения
+    запоминаются сразу, чтобы при отмене не тронуть то, что с тех пор заменили или изменили.
+    """
+
+    def __init__(self, op):
+        self.op = op
+        self.items = []
+        self._lock = threading.Lock()  # перемещения пакетного режима идут из пула
+
+    def add(self, src, dest, kind="r"):
+        try:
+            st = os.lstat(dest)
+        except OSError:
+            return
+        with self._lock:
+            self.items.append((src, dest, kind, st.st_ino, st.st_mtime_ns))
+
+    def discard(self, count):
+        """Оставить только первые count записей (остальное откатили)."""
+        with self._lock:
+            del self.items[count:]
+
+
+class UndoLog:
+    """
+    Журнал отмены: JSON-строка на операцию, пути хранятся относительно общих директорий
+    источников и назначений. Отмена дописывает отметку {"undone": id}, поэтому запись —
+    всегда дозапись одной строкой; старые операции отбрасываются при сжатии.
+    """
+
+    def __init__(self, path=UNDO_LOG):
+        self.path = path
+
+    def record(self, batch):
+        import json
+        if not batch.items:
+            return
+        srcs = [item[0] for item in batch.items]
+        dests = [item[1] for item in batch.items]
+        s_base = os.path.commonpath([os.path.dirname(p) for p in srcs])
+        d_base = os.path.commonpath([os.path.dirname(p) for p in dests])
+        line = json.dumps({"id": time.time_ns(), "t": int(time.time()), "op": batch.op, "s": s_base, "d": d_base,
+                           "items": [[os.path.relpath(src, s_base), os.path.relpath(dest, d_base), kind, ino, mtime]
+                                     for src, dest, kind, ino, mtime in batch.items]},
+                          ensure_ascii=False, separators=(",", ":"))
+        self._append(line)
+        try:
+            if os.path.getsize(self.path) > UNDO_LOG_MAX:
+                self._compact()
+        except OSError:
+            pass
+
+    def _append(self, line):
+        # Одна запись O_APPEND — несколько окон susanin не перемешают строки
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        try:
+            os.write(fd, (line + "\n").encode("utf-8", "surrogateescape"))
+        finally:
+            os.close(fd)
+
+    def batches(self):
+        """Ещё не отменённые операции, от старых к новым."""
+        import json
+        live, undone = [], set()
+        try:
+            with open(self.path, encoding="utf-8", errors="surrogateescape") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # оборванная запись
+                    if "undone" in entry:
+                        undone.add(entry["undone"])
+                    else:
+                        live.append(entry)
+        except FileNotFoundError:
+            pass
+        return [entry for entry in live if entry["id"] not in undone]
+
+    def last(self):
+        live = self.batches()
+        return live[-1] if live else None
+
+    def _compact(self):
+        import json
+        tmp = self.path + ".tmp"
+        with open(tmp, "w", encoding="utf-8", errors="surrogateescape") as f:
+            for entry in self.batches()[-UNDO_KEEP:]:
+                f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
+        os.replace(tmp, self.path)
+
+    def undo(self, entry, job=None):
+        """
+        Обратные переименования в обратном порядке; запись, которую с тех пор изменили, заменили
+        или заняли её исходное имя, пропускается. Возвращает (восстановлено, [ошибки]).
+        """
+        import json
+        restored, errors = 0, []
+        for s_rel, d_rel, kind, ino, mtime in reversed(entry["items"]):
+            src = os.path.normpath(os.path.join(entry["s"], s_rel))
+            dest = os.path.normpath(os.path.join(entry["d"], d_rel))
+            try:
+                st = os.lstat(dest)
+                if (st.st_ino, st.st_mtime_ns) != (ino, mtime):
+                    errors.append(f"{dest}: изменён после операции, пропущен")
+                    continue
+                rename_noreplace(dest, src)
+            except FileNotFoundError:
+                errors.append(f"{dest}: уже не на месте (или нет папки {os.path.dirname(src)})")
+                continue
+            except OSError as e:
+                errors.append(f"{dest} -> {src}: {e.strerror or e}")
+                continue
+            if kind == "t":
+                trash_dir, name = os.path.split(os.path.dirname(dest))[0], os.path.basename(dest)
+                try:
+                    os.unlink(os.path.join(trash_dir, "info", name + ".trashinfo"))
+                except OSError:
+                    pass
+            restored += 1
+            if job:
+                job.add(files=1)
+        self._append(json.dumps({"undone": entry["id"]}))
+        return restored, errors
+
+
+# --- Операции по плану (без интерфейса) ---
+
+# Сколько операций плана выполнять одновременно в пакетном режиме
+BATCH_WORKERS = 4
+BATCH_ACTIONS = {"copy": "copy", "cp": "copy", "move": "move", "mv": "move", "delete": "delete", "rm": "delete",
+                 "trash": "trash"}
+# План выполняется фазами, как пометки в интерфейсе: сначала все копирования, затем перемещения,
+# затем удаления; внутри фазы операции идут параллельно
+BATCH_PHASES = (("copy",), ("move",), ("trash", "delete"))
+
+
+class OperationError(Exception):
+    """Операция не прошла проверки или не выполнилась; текст — для пользователя."""
+
+
+class DestClaims:
+    """Имена назначения, выбранные в рамках одного применения: параллельные операции не получат одно имя."""
+
+    def __init__(self):
+        self._claimed = set()
+        self._lock = threading.Lock()
+
+    def claim(self, fs, dest_path):
+        """Первое свободное имя из dest_candidates (dest, dest_copy, dest_copy1, ...)."""
+        with self._lock:
+            for candidate in dest_candidates(dest_path):
+                if candidate not in self._claimed and not fs.exists(candidate):
+                    self._claimed.add(candidate)
+                    return candidate
+
+
+def apply_operation(fs, action, src, dest_dir=None, job=None, claims=None, dry_run=False, name=None):
+    """
+    Одна операция режима меток с его проверками: исходник существует, папка назначения есть,
+    директорию не перемещаем внутрь неё самой, занятое имя уникализируется. Возвращает
+    фактический путь назначения (для delete — удалённый путь); при dry_run только проверяет
+    и предсказывает имя. Ошибки — OperationError с готовым сообщением.
+    """
+    name = name or os.path.basename(src.rstrip(os.sep))
+    label = action.capitalize()
+    if not fs.exists(src):
+        if action in ("delete", "trash"):
+            raise OperationError(f"{label}: не найден {name}")
+        raise OperationError(f"{label}: исходник не найден: {name}")
+    if action in ("delete", "trash"):
+        if dry_run:
+            return src
+        try:
+            # В корзину — переименованием; вернётся путь внутри корзины
+            result = fs.trash(src) if action == "trash" else fs.delete(src)
+        except Exception as e:
+            raise OperationError(f"{label} {name}: {e}")
+        if job:
+            job.add(files=1)
+            job.strategy.add(action)
+            if action == "trash" and result and job.undo is not None:
+                job.undo.add(src, result, "t")
+        return result or src
+
+    # basename: в результатах поиска имена — пути относительно корня поиска
+    dest = os.path.join(dest_dir, os.path.basename(src.rstrip(os.sep)))
+    if not fs.isdir(dest_dir):
+        raise OperationError(f"{label}: папка назначения не существует для {name}: {dest_dir}")
+    claims = claims or DestClaims()
+    if action == "move":
+        # защита от перемещения в потомка
+        src_real = os.path.realpath(src)
+        dest_real = os.path.realpath(dest)
+        if dest_real.startswith(src_real + os.sep) or dest_real == src_real:
+            raise OperationError(f"Move: нельзя переместить {name} внутрь него самого")
+        if dry_run:
+            return claims.claim(fs, dest)
+        try:
+            # уникальное имя подбирается внутри move_path атомарно
+            return fs.move(src, dest, job)
+        except Exception as e:
+            raise OperationError(f"Move {name}: {e}")
+
+    dest = claims.claim(fs, dest)
+    if not dry_run:
+        try:
+            fs.copy(src, dest, job)
+        except Exception as e:
+            raise OperationError(f"Copy {name}: {e}")
+    return dest
+
+
+def parse_plan(text, base_dir=None):
+    """
+    План операций: JSON (список объектов {"action", "src", "dest"} или {"operations": [...]})
+    либо строки "действие src [dest]" — через табуляцию или с кавычками как в shell; # — комментарий.
+    Возвращает [(действие, src, папка назначения или None)]; относительные пути — от base_dir.
+    """
+    base_dir = base_dir or os.getcwd()
+    stripped = text.lstrip()
+    if stripped.startswith(("[", "{")):
+        import json
+        data = json.loads(stripped)
+        items = data.get("operations", []) if isinstance(data, dict) else data
+        if not isinstance(items, list):
+            raise ValueError("ожидается список операций")
+        rows = []
+        for n, item in enumerate(items, 1):
+            if not isinstance(item, dict):
+                raise ValueError(f"операция {n}: ожидается объект {{\"action\", \"src\", \"dest\"}}, а не {item!r}")
+            row = (item.get("action", ""), item.get("src", ""), item.get("dest"))
+            if not all(isinstance(v, str) for v in row if v is not None):
+                raise ValueError(f"операция {n}: action, src и dest должны быть строками")
+            rows.append(row)
+    else:
+        import shlex
+        rows = []
+        for lineno, line in enumerate(text.splitlines(), 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            parts = line.split("\t") if "\t" in line else shlex.split(line)
+            if len(parts) not in (2, 3):
+                raise ValueError(f"строка {lineno}: ожидается «действие src [dest]»")
+            rows.append((parts[0], parts[1], parts[2] if len(parts) == 3 else None))
+    def resolve(path):
+        return os.path.join(base_dir, os.path.expanduser(path))
+
+    plan = []
+    for row in rows:
+        action, src, dest = row
+        action = BATCH_ACTIONS.get(str(action).strip().lower())
+        if action is None or not src or (action not in ("delete", "trash") and not dest):
+            raise ValueError(f"неверная операция: {row!r}")
+        plan.append((action, resolve(src), resolve(dest) if dest and action not in ("delete", "trash") else None))
+    return plan
+
+
+def run_plan(plan, fs=None, workers=BATCH_WORKERS, dry_run=False, manifest=None):
+    """
+    Выполнить план на пуле потоков по фазам BATCH_PHASES (delete не обгонит copy того же файла);
+    отчёт — словарь, пригодный для JSON, результаты — в порядке плана.
+    manifest — алгоритм: суммы копируемых файлов считаются по ходу копирования и пишутся
+    манифестом в каждую папку назначения.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    job = Job("batch")
+    if manifest and not dry_run:
+        job.manifest = Manifest(manifest)
+    # Журнал отмены — только для локальной ФС (бэкенд по умолчанию)
+    if fs is None and not dry_run:
+        job.undo = UndoBatch("batch")
+    fs = fs or LocalBackend()
+    claims = DestClaims()
+
+    def one(op):
+        action, src, dest_dir = op
+        entry = {"action": action, "src": src, "dest": None, "status": "ok", "error": None}
+        try:
+            entry["dest"] = apply_operation(fs, action, src, dest_dir, job, claims, dry_run)
+            if dry_run:
+                entry["status"] = "planned"
+        except OperationError as e:
+            entry["status"], entry["error"] = "error", str(e)
+        return entry
+
+    results = [None] * len(plan)
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        for actions in BATCH_PHASES:
+            phase = [i for i, op in enumerate(plan) if op[0] in actions]
+            for i, entry in zip(phase, pool.map(one, [plan[i] for i in phase])):
+                results[i] = entry
+    failed = sum(1 for r in results if r["status"] == "error")
+    manifests = []
+    if job.manifest is not None:
+        try:
+            manifests = write_copy_manifests(job.manifest, [op[2] for op in plan if op[0] == "copy"], fs, claims)
+        except OSError as e:
+            failed += 1
+            results.append({"action": "manifest", "src": None, "dest": None, "status": "error", "error": str(e)})
+    if job.undo is not None:
+        try:
+            UndoLog().record(job.undo)
+        except OSError:
+            pass  # отмена — удобство, операцию из-за неё не проваливаем
+    if not dry_run:
+        job.finish(failed)
+    return {"dry_run": dry_run, "operations": len(results), "failed": failed,
+            "files": job.files, "bytes": job.bytes, "seconds": round(job.elapsed(), 3),
+            "strategy": sorted(job.strategy), "manifests": manifests, "results": results}
+
+
+def batch_main(argv):
+    """
+    python main.py --batch <план|-> [--dry-run] [--workers N] [--report файл] [--manifest sha256|blake2b]
+    Без curses и терминала; отчёт JSON — в stdout или в файл, код выхода 1 при ошибках.
+    """
+    import json
+    source, dry_run, workers, report, manifest = None, False, BATCH_WORKERS, None, MANIFEST_ON_COPY
+    usage = "использование: " + batch_main.__doc__.strip().splitlines()[0]
+    args = iter(argv)
+
+    def value(option):
+        arg = next(args, None)
+        if arg is None:
+            raise SystemExit(f"{option}: нет значения\n{usage}")
+        return arg
+
+    for arg in args:
+        if arg == "--dry-run":
+            dry_run = True
+        elif arg == "--workers":
+            workers = value(arg)
+            if not workers.isdigit() or int(workers) < 1:
+                raise SystemExit(f"--workers: ожидается целое число больше нуля, а не {workers!r}\n{usage}")
+            workers = int(workers)
+        elif arg == "--manifest":
+            try:
+                manifest = parse_algo(value(arg))
+            except ValueError as e:
+                raise SystemExit(str(e))
+        elif arg == "--report":
+            report = value(arg)
+        elif source is None:
+            source = arg
+        else:
+            raise SystemExit(f"лишний аргумент: {arg}\n{usage}")
+    if source in (None, "-"):
+        text = sys.stdin.read()
+    else:
+        try:
+            with open(source, encoding="utf-8") as f:
+                text = f.read()
+        except (OSError, UnicodeDecodeError) as e:
+            raise SystemExit(f"не удалось прочитать план: {e}")
+    try:
+        plan = parse_plan(text)
+    except ValueError as e:
+        raise SystemExit(f"ошибка в плане: {e}")
+    result = run_plan(plan, workers=workers, dry_run=dry_run, manifest=manifest)
+    out = json.dumps(result, ensure_ascii=False, indent=2)
+    if report:
+        with open(report, "w", encoding="utf-8") as f:
+            f.write(out + "\n")
+    else:
+        print(out)
+    return 1 if result["failed"] else 0
+
+
+# --- Частые директории (frecency) ---
+
+# База посещённых директорий и журнал новых посещений, который вливается в неё в фоне
+FRECENCY_DB = os.path.expanduser("~/.tui_fm_dirs.db")
+
+# Сумма рангов, после которой все ранги пропорционально уменьшаются (старые пути вытесняются)
+FRECENCY_MAX_RANK = 1_000_000
+# Посещения копятся в памяти и дописываются в журнал не чаще раза в столько секунд (и при выходе)
+FRECENCY_FLUSH_INTERVAL = 30.0
+
+
+def frecency_score(rank, atime, now):
+    age = now - atime
+    if age < 3600:
+        return rank * 4
+    if age < 86400:
+        return rank * 2
+    if age < 604800:
+        return rank / 2
+    return rank / 4
+
+
+class FrecencyIndex:
+    """
+    Посещённые директории с рангом по частоте и давности. Посещение правит загруженную таблицу
+    на месте и копится в памяти; в журнал оно дописывается по таймеру и при выходе.
+    Слияние журнала, старение и запись компактной базы (отсортированной по score) — в фоне.
+    Поиск идёт по одной строке из имён директорий (последнее слово запроса должно быть в имени),
+    так что перебор в Python касается только кандидатов, а не всех путей.
+    """
+
+    MAGIC = b"SFR1"
+
+    def __init__(self, db=FRECENCY_DB):
+        self.db = db
+        self.log = db + ".log"
+        self._lock = threading.Lock()
+        self.paths = None  # загружаются при первом поиске, по убыванию score
+        self._table = {}  # path -> [rank, atime] для загруженных paths
+        self._dirty = False  # посещения после загрузки: порядок paths нужно пересчитать
+        self._names = ""  # имена директорий в нижнем регистре через \n, в порядке paths
+        self._pending = []  # (ts, path), ещё не дописанные в журнал
+        self._timer = None
+        self._atexit = False
+
+    def visit(self, path):
+        import atexit
+        ts = int(time.time())
+        with self._lock:
+            self._pending.append((ts, path))
+            if self.paths is not None:
+                if path not in self._table:
+                    self.paths.append(path)
+                self._bump(self._table, ts, path)
+                self._dirty = True
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(FRECENCY_FLUSH_INTERVAL, self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+            if self._atexit:
+                return
+            self._atexit = True
+        atexit.register(self.flush)
+
+    def flush(self):
+        """Дописать накопленные посещения в журнал одной записью."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            if not pending:
+                return
+            data = "".join(f"{ts}\t{path}\n" for ts, path in pending).encode("utf-8", "surrogateescape")
+            try:
+                fd = os.open(self.log, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+            except OSError:
+                return
+            try:
+                os.write(fd, data)
+            except OSError:
+                pass
+            finally:
+                os.close(fd)
+
+    @staticmethod
+    def _bump(table, ts, path):
+        item = table.get(path)
+        if item is None:
+            table[path] = [1.0, ts]
+        else:
+            item[0] += 1
+            item[1] = max(item[1], ts)
+
+    def _read_db(self):
+        from array import array
+        try:
+            with open(self.db, "rb") as f:
+                data = f.read()
+        except OSError:
+            return [], array("d"), array("d")
+        if data[:4] != self.MAGIC:
+            return [], array("d"), array("d")
+        count = int.from_bytes(data[4:8], "little")
+        ranks, atimes = array("d"), array("d")
+        pos = 8
+        ranks.frombytes(data[pos:pos + 8 * count])
+        pos += 8 * count
+        atimes.frombytes(data[pos:pos + 8 * count])
+        pos += 8 * count
+        paths = data[pos:].decode("utf-8", "surrogateescape").split("\n") if count else []
+        return paths, ranks, atimes
+
+    def _read_logs(self, logs):
+        visits = []
+        for log in logs:
+            try:
+                with open(log, "rb") as f:
+                    for raw in f:
+                        ts, _, path = raw.rstrip(b"\n").partition(b"\t")
+                        if path:
+                            visits.append((float(ts), path.decode("utf-8", "surrogateescape")))
+            except (OSError, ValueError):
+                pass
+        return visits
+
+    def _merge(self, logs):
+        """База + журналы -> (paths, ranks, atimes), отсортированные по score."""
+        from array import array
+        paths, ranks, atimes = self._read_db()
+        visits = self._read_logs(logs)
+        if not visits:
+            return paths, ranks, atimes
+        table = {p: [r, a] for p, r, a in zip(paths, ranks, atimes)}
+        for ts, path in visits:
+            self._bump(table, ts, path)
+        total = sum(item[0] for item in table.values())
+        if total > FRECENCY_MAX_RANK:
+            factor = 0.9 * FRECENCY_MAX_RANK / total
+            table = {p: [r * factor, a] for p, (r, a) in table.items() if r * factor >= 1}
+        now = time.time()
+        order = sorted(table.items(), key=lambda kv: frecency_score(kv[1][0], kv[1][1], now), reverse=True)
+        return ([p for p, _ in order], array("d", (v[0] for _, v in order)),
+                array("d", (v[1] for _, v in order)))
+
+    def _write_db(self, paths, ranks, atimes):
+        tmp = f"{self.db}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(self.MAGIC + len(paths).to_bytes(4, "little"))
+            f.write(ranks.tobytes())
+            f.write(atimes.tobytes())
+            f.write("\n".join(paths).encode("utf-8", "surrogateescape"))
+        os.replace(tmp, self.db)
+
+    def compact(self):
+        """Влить журнал в базу. Журнал сначала переименовывается, так что новые посещения не теряются."""
+        pending = self.log + ".compacting"
+        with self._lock:
+            try:
+                if os.path.exists(self.log) and not os.path.exists(pending):
+                    os.replace(self.log, pending)
+            except OSError:
+                return
+        if not os.path.exists(pending):
+            return
+        self._write_db(*self._merge([pending]))
+        os.unlink(pending)
+
+    def compact_async(self):
+        if os.path.exists(self.log) or os.path.exists(self.log + ".compacting"):
+            threading.Thread(target=self._compact_quietly, daemon=True).start()
+
+    def _compact_quietly(self):
+        try:
+            self.compact()
+        except OSError:
+            pass
+
+    def load(self):
+        paths, ranks, atimes = self._merge([self.log + ".compacting", self.log])
+        with self._lock:
+            self._table = {p: [r, a] for p, r, a in zip(paths, ranks, atimes)}
+            for ts, path in self._pending:  # ещё не в журнале
+                if path not in self._table:
+                    paths.append(path)
+                self._bump(self._table, ts, path)
+            self.paths = paths
+            self._dirty = bool(self._pending)
+        self._reindex()
+
+    def _resort(self):
+        now = time.time()
+        with self._lock:
+            self.paths.sort(key=lambda p: frecency_score(*self._table[p], now), reverse=True)
+            self._dirty = False
+        self._reindex()
+
+    def _reindex(self):
+        self._names = "\n".join(p.rpartition("/")[2].lower() for p in self.paths)
+
+    def search(self, query, limit=10):
+        """Лучшие по score пути, содержащие все слова запроса по порядку; последнее — в имени директории."""
+        import re
+        if self.paths is None:
+            self.load()
+        if self._dirty:
+            self._resort()
+        words = query.lower().split()
+        if not words:
+            return self.paths[:limit]
+        *head, last = words
+        # Остальные слова — по порядку где-то в пути до имени директории
+        full = re.compile("".join(re.escape(w) + ".*" for w in head) + "/[^/]*" + re.escape(last) + "[^/]*$") if head else None
+        found = []
+        line, pos = 0, 0
+        for m in re.finditer(re.escape(last), self._names):
+            line += self._names.count("\n", pos, m.start())
+            pos = m.start()
+            if found and found[-1] == line:
+                continue
+            if full is None or full.search(self.paths[line].lower()):
+                found.append(line)
+                if len(found) >= limit:
+                    break
+        return [self.paths[i] for i in found]
+
+    def forget(self, path):
+        """Убрать из выдачи путь, которого больше нет (до следующего слияния)."""
+        if self.paths is not None and path in self._table:
+            with self._lock:
+                del self._table[path]
+                self.paths.remove(path)
+            self._reindex()
+
+
+# --- Поиск по содержимому ---
+
+# Файлы больше этого размера при поиске по содержимому пропускаются
+SEARCH_MAX_FILE_SIZE = 256 * 1024 * 1024
+# Блок чтения при поиске и сколько начальных байт проверять на \0 (признак двоичного файла)
+SEARCH_CHUNK = 1024 * 1024
+SEARCH_SNIFF = 8192
+# Сколько путей отдавать процессу-воркеру за раз
+SEARCH_BATCH = 64
+
+
+def grep_file(path, needle, ignore_case=False):
+    """
+    Есть ли needle в файле; двоичные файлы отсеиваются по первому блоку.
+    needle — bytes, а при ignore_case — str после casefold(): текст декодируется как UTF-8
+    (битые байты — U+FFFD) и тоже приводится casefold(), так что регистр не учитывается и вне ASCII.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return False
+    try:
+        buf = os.read(fd, SEARCH_CHUNK)
+        if b"\0" in buf[:SEARCH_SNIFF]:
+            return False
+        if ignore_case:
+            import codecs
+            decoder = codecs.getincrementaldecoder("utf-8")("replace")  # символ на стыке блоков не рвётся
+
+            def fold(data, final=False):
+                return decoder.decode(data, final).casefold()
+            buf = fold(buf)
+        keep = len(needle) - 1  # перекрытие, чтобы не пропустить совпадение на границе блоков
+        while True:
+            if needle in buf:
+                return True
+            chunk = os.read(fd, SEARCH_CHUNK)
+            if ignore_case:
+                chunk = fold(chunk, not chunk)
+            if not chunk:
+                return False
+            buf = (buf[-keep:] if keep else buf[:0]) + chunk
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
+
+
+def _grep_batch(paths, needle, ignore_case):
+    # Выполняется в процессе-воркере
+    return [p for p in paths if grep_file(p, needle, ignore_case)]
+
+
+class ContentSearch:
+    """
+    Поиск текста в файлах дерева: обход в фоновом потоке, чтение и сравнение — в пуле процессов.
+    Найденные пути (относительно root) появляются в results по мере готовности; cancel() — в любой момент.
+    Регистр учитывается, только если в запросе есть заглавные буквы.
+    """
+
+    def __init__(self, root, text, glob=None, show_hidden=False, max_size=SEARCH_MAX_FILE_SIZE, workers=None):
+        self.root = root
+        self.text = text
+        self.glob = glob or None
+        self.show_hidden = show_hidden
+        self.max_size = max_size
+        self.workers = workers or os.cpu_count() or 1
+        self.ignore_case = text == text.lower()
+        self.needle = text.casefold() if self.ignore_case else text.encode("utf-8", "surrogateescape")
+        self.results = []  # пополняется из потока пула; list.append атомарен
+        self.scanned = 0
+        self.cancelled = threading.Event()
+        self._walk_done = False
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(self.workers * 4)  # не заваливаем очередь пула
+        self.pool = None
+
+    def start(self):
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        # forkserver: не форкаем процесс с curses и фоновыми потоками
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context(method))
+        threading.Thread(target=self._walk, daemon=True).start()
+        return self
+
+    def _walk(self):
+        from fnmatch import fnmatch
+        batch = []
+        stack = [self.root]
+        while stack and not self.cancelled.is_set():
+            try:
+                with os.scandir(stack.pop()) as it:
+                    entries = list(it)
+            except OSError:
+                continue
+            for entry in entries:
+                if not self.show_hidden and entry.name.startswith('.'):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    if self.glob and not fnmatch(entry.name, self.glob):
+                        continue
+                    size = entry.stat(follow_symlinks=False).st_size
+                except OSError:
+                    continue
+                if 0 < size <= self.max_size:
+                    batch.append(entry.path)
+                    if len(batch) >= SEARCH_BATCH:
+                        self._submit(batch)
+                        batch = []
+        if batch:
+            self._submit(batch)
+        self._walk_done = True
+
+    def _submit(self, batch):
+        while not self._slots.acquire(timeout=0.1):
+            if self.cancelled.is_set():
+                return
+        with self._lock:
+            self._pending += 1
+        pool = self.pool
+        try:
+            if pool is None:
+                raise RuntimeError("пул остановлен")
+            fut = pool.submit(_grep_batch, batch, self.needle, self.ignore_case)
+        except RuntimeError:  # пул уже остановлен отменой
+            self._done_batch(0)
+            return
+        fut.add_done_callback(lambda f, n=len(batch): self._collect(f, n))
+
+    def _collect(self, fut, count):
+        if not fut.cancelled() and fut.exception() is None:
+            for path in fut.result():
+                self.results.append(os.path.relpath(path, self.root))
+        self._done_batch(count)
+
+    def _done_batch(self, count):
+        with self._lock:
+            self._pending -= 1
+            self.scanned += count
+        self._slots.release()
+
+    @property
+    def running(self):
+        return not self.cancelled.is_set() and not (self._walk_done and self._pending == 0)
+
+    def finish(self):
+        """Освободить пул после завершения или отмены (вызывается из главного потока)."""
+        if self.pool is not None and not self.running:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
+
+    def cancel(self):
+        self.cancelled.set()
+        self.finish()
+
+
+# --- Статус git ---
+
+# Чем левее, тем важнее пометка директории, собранная из её содержимого
+GIT_PRIORITY = "UMADRT?"
+
+
+def find_git_dir(path):
+    """(корень рабочего дерева, git-директория) или (None, None); .git может быть файлом "gitdir: ..."."""
+    path = os.path.abspath(path)
+    while True:
+        dotgit = os.path.join(path, ".git")
+        if os.path.isdir(dotgit):
+            return path, dotgit
+        if os.path.isfile(dotgit):
+            try:
+                with open(dotgit) as f:
+                    line = f.readline().strip()
+            except OSError:
+                return None, None
+            if line.startswith("gitdir:"):
+                return path, os.path.join(path, line[len("gitdir:"):].strip())
+            return None, None
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None, None
+        path = parent
+
+
+def parse_porcelain(data):
+    """Вывод git status --porcelain -z -> {путь от корня: XY}."""
+    result = {}
+    fields = data.split(b"\0")
+    i = 0
+    while i < len(fields):
+        entry = fields[i]
+        i += 1
+        if len(entry) < 4:
+            continue
+        xy = entry[:2].decode("ascii", "replace")
+        result[os.fsdecode(entry[3:]).rstrip("/")] = xy
+        if xy[0] in "RC":
+            i += 1  # следом идёт исходное имя
+    return result
+
+
+def git_code(xy):
+    """Одна буква для колонки: U — конфликт, ? — не отслеживается, ! — игнорируется, иначе буква изменения."""
+    if "U" in xy or xy in ("AA", "DD"):
+        return "U"
+    if xy[1] != " ":
+        return xy[1]
+    return xy[0]
+
+
+def git_dir_marks(statuses):
+    """{путь директории от корня ("" — корень): {имя: буква}}; директории наследуют важнейшую пометку содержимого."""
+    by_dir = {}
+    for path, xy in statuses.items():
+        code = git_code(xy)
+        parts = path.split("/")
+        for depth, name in enumerate(parts):
+            inner = depth < len(parts) - 1
+            if inner and code == "!":
+                continue  # игнорируемое внутри не делает игнорируемой всю директорию
+            marks = by_dir.setdefault("/".join(parts[:depth]), {})
+            prev = marks.get(name)
+            if prev is None or GIT_PRIORITY.find(code) % 8 < GIT_PRIORITY.find(prev) % 8:
+                marks[name] = code
+    return by_dir
+
+
+def index_mtime(index):
+    try:
+        return os.stat(index).st_mtime_ns
+    except OSError:
+        return 0
+
+
+class GitStatus:
+    """
+    Фоновый git status: get() отдаёт пометки из кеша и при необходимости запускает обновление
+    в отдельном потоке — UI на git никогда не ждёт. Кеш — по корню репозитория с ключом mtime
+    index; git перезапускается только при смене index или по просьбе вызывающего (rescan —
+    переход в директорию, перечитывание списка), сам по себе — никогда.
+    """
+
+    def __init__(self):
+        self.generation = 0  # растёт с каждым завершённым запуском
+        self.available = True  # нет git — больше не пробуем
+        self._cache = {}  # root -> (index_mtime, {директория: {имя: буква}})
+        self._running = set()
+        self._lock = threading.Lock()
+
+    @property
+    def busy(self):
+        return bool(self._running)
+
+    def get(self, directory, rescan=False):
+        if not self.available:
+            return None
+        root, gitdir = find_git_dir(directory)
+        if root is None:
+            return None
+        index = os.path.join(gitdir, "index")
+        mtime = index_mtime(index)
+        with self._lock:
+            cached = self._cache.get(root)
+            stale = rescan or cached is None or cached[0] != mtime
+            if stale and root not in self._running:
+                self._running.add(root)
+                threading.Thread(target=self._refresh, args=(root, index), daemon=True).start()
+        if cached is None:
+            return None
+        rel = os.path.relpath(os.path.abspath(directory), root)
+        return cached[1].get("" if rel == "." else rel, {})
+
+    def _refresh(self, root, index):
+        import subprocess
+        statuses = {}
+        try:
+            proc = subprocess.run(["git", "-C", root, "status", "--porcelain", "-z", "--ignored=matching"],
+                                  stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=120)
+            if proc.returncode == 0:
+                statuses = parse_porcelain(proc.stdout)
+        except FileNotFoundError:
+            self.available = False
+        except (OSError, subprocess.SubprocessError):
+            pass
+        marks = git_dir_marks(statuses)
+        with self._lock:
+            # mtime берём после запуска: git status сам переписывает index, и это не повод для нового круга
+            self._cache[root] = (index_mtime(index), marks)
+            self._running.discard(root)
+            self.generation += 1
+
+
+# --- Типы файлов ---
+
+# Цвета и программы по типам: секции [colors] и [open], ключи — MIME-маски (image/*),
+# значения — имя цвета или номер из 256, и команда (%f — путь; "!" в начале — терминальная, ждём её)
+TYPES_CONFIG = os.path.expanduser("~/.tui_fm_types.conf")
+TYPE_CACHE_MAX = 50_000
+TYPE_SNIFF = 512
+DEFAULT_TYPE_COLORS = [
+    ("image/*", "magenta"), ("video/*", "magenta"), ("audio/*", "cyan"),
+    ("application/zip", "red"), ("application/gzip", "red"), ("application/x-tar", "red"),
+    ("application/x-bzip2", "red"), ("application/x-xz", "red"), ("application/x-7z-compressed", "red"),
+    ("application/pdf", "yellow"),
+]
+COLOR_NAMES = {"black": 0, "red": 1, "green": 2, "yellow": 3, "blue": 4, "magenta": 5, "cyan": 6, "white": 7}
+MAGIC = [
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"BZh", "application/x-bzip2"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz"),
+    (0, b"7z\xbc\xaf\x27\x1c", "application/x-7z-compressed"),
+    (257, b"ustar", "application/x-tar"),
+    (0, b"\x7fELF", "application/x-executable"),
+    (0, b"SQLite format 3\x00", "application/vnd.sqlite3"),
+    (0, b"\x1aE\xdf\xa3", "video/x-matroska"),
+    (4, b"ftyp", "video/mp4"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"#!", "text/x-script"),
+]
+
+
+def sniff_type(head):
+    """MIME по первым байтам файла; текст без нулевых байт — text/plain."""
+    if not head:
+        return "inode/x-empty"
+    for offset, magic, mime in MAGIC:
+        if head.startswith(magic, offset):
+            return mime
+    if b"\0" not in head:
+        try:
+            head.decode("utf-8")
+            return "text/plain"
+        except UnicodeDecodeError as e:
+            if e.start >= len(head) - 3:  # символ обрезан границей чтения
+                return "text/plain"
+    return "application/octet-stream"
+
+
+class FileTypes:
+    """
+    Определение типа: сначала по расширению, иначе по сигнатуре первых байт (кроме файлов
+    внутри архивов). Результат
+    кешируется по (dev, inode, mtime), так что при перерисовке файл не открывается снова;
+    вызывается только для видимых строк. Правила цвета и открытия — из TYPES_CONFIG.
+    """
+
+    def __init__(self, config=TYPES_CONFIG):
+        self.config = config
+        self._cache = {}
+        self._rules = None  # (colors, openers): списки (маска, значение), читаются при первом обращении
+        self._by_mime = {}  # mime -> (цвет, команда)
+
+    def detect(self, fs, path, st):
+        key = (st.st_dev, st.st_ino, st.st_mtime_ns) if st.st_ino else (path, st.st_mtime)
+        mime = self._cache.get(key)
+        if mime is None:
+            mime = self._detect(fs, path)
+            if len(self._cache) >= TYPE_CACHE_MAX:
+                self._cache.clear()
+            self._cache[key] = mime
+        return mime
+
+    def _detect(self, fs, path):
+        import mimetypes
+        mime = mimetypes.guess_type(os.path.basename(path), strict=False)[0]
+        if mime:
+            return mime
+        if fs.is_readonly(path):
+            # Внутри архива открыть член сжатого tar — значит распаковать его с начала,
+            # и так на каждую видимую строку при отрисовке: там — только по расширению
+            return "application/octet-stream"
+        try:
+            with fs.open(path) as f:
+                return sniff_type(f.read(TYPE_SNIFF))
+        except OSError:
+            return "application/octet-stream"
+
+    def _load_rules(self):
+        colors, openers = list(DEFAULT_TYPE_COLORS), []
+        try:
+            import configparser
+            parser = configparser.ConfigParser(interpolation=None, delimiters=("=",))
+            if parser.read(self.config, encoding="utf-8"):
+                # Правила из файла проверяются раньше встроенных
+                colors = list(parser.items("colors")) + colors if parser.has_section("colors") else colors
+                openers = list(parser.items("open")) if parser.has_section("open") else []
+        except Exception:
+            pass  # битый конфиг — работаем со встроенными цветами
+        self._rules = (colors, openers)
+
+    def rules_for(self, mime):
+        """(номер цвета или None, команда открытия или None) для MIME."""
+        found = self._by_mime.get(mime)
+        if found is None:
+            if self._rules is None:
+                self._load_rules()
+            from fnmatch import fnmatchcase
+            colors, openers = self._rules
+            color = next((c for pat, c in colors if fnmatchcase(mime, pat)), None)
+            if color is not None:
+                name = color.strip().lower()
+                color = COLOR_NAMES.get(name, int(name) if name.isdigit() else None)
+            command = next((cmd for pat, cmd in openers if fnmatchcase(mime, pat)), None)
+            found = self._by_mime[mime] = (color, command)
+        return found
+
+
+def run_opener(command, path):
+    """
+    Запустить команду из правил [open]: %f заменяется путём (если %f нет — путь последним
+    аргументом). Возвращает True для терминальной команды ("!..."), которую дождались.
+    """
+    import shlex
+    import subprocess
+    terminal = command.startswith("!")
+    args = shlex.split(command[1:] if terminal else command)
+    if any("%f" in a for a in args):
+        args = [a.replace("%f", path) for a in args]
+    else:
+        args.append(path)
+    if terminal:
+        subprocess.run(args)
+        return True
+    subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                     stderr=subprocess.DEVNULL, start_new_session=True)
+    return False
+
+
+# --- Создание архивов ---
+
+# Блок, сжимаемый одним независимым gzip-членом
+GZIP_BLOCK = 2 * 1024 * 1024
+
+
+class ParallelGzipWriter:
+    """
+    Файловый объект для записи .gz в стиле pigz: данные режутся на блоки, каждый сжимается
+    независимым gzip-членом в пуле потоков (zlib отпускает GIL), члены пишутся по порядку.
+    Склейка gzip-членов — корректный gzip-файл для gzip/tar.
+    """
+
+    def __init__(self, fileobj, level=6, workers=None, block=GZIP_BLOCK):
+        from concurrent.futures import ThreadPoolExecutor
+        self.fileobj = fileobj
+        self.level = level
+        self.block = block
+        self.workers = workers or os.cpu_count() or 1
+        self._pool = ThreadPoolExecutor(self.workers)
+        self._buf = bytearray()
+        self._futures = deque()
+        self._members = 0
+
+    def write(self, data):
+        self._buf += data
+        while len(self._buf) >= self.block:
+            self._submit(bytes(self._buf[:self.block]))
+            del self._buf[:self.block]
+        return len(data)
+
+    def _submit(self, chunk):
+        import gzip
+        self._futures.append(self._pool.submit(gzip.compress, chunk, self.level, mtime=0))
+        self._members += 1
+        # Ограничиваем очередь: память не растёт, а воркеры всегда заняты
+        while len(self._futures) > self.workers * 2:
+            self.fileobj.write(self._futures.popleft().result())
+
+    def flush(self):
+        pass
+
+    def close(self):
+        if self._buf or not self._members:
+            self._submit(bytes(self._buf))
+            self._buf.clear()
+        try:
+            while self._futures:
+                self.fileobj.write(self._futures.popleft().result())
+        finally:
+            self._pool.shutdown()
+
+
+def archive_format(path):
+    lower = path.lower()
+    if lower.endswith('.zip'):
+        return 'zip'
+    if lower.endswith(('.tar.gz', '.tgz')):
+        return 'tar.gz'
+    if lower.endswith('.tar'):
+        return 'tar'
+    return None
+
+
+def create_archive(sources, dest, job=None, workers=None, level=6):
+    """
+    Упаковать sources в dest (.tar.gz/.tgz, .tar или .zip — по расширению) потоково, без временных
+    копий. gzip сжимается параллельно (ParallelGzipWriter), zip — последовательно по файлам.
+    Имя подбирается атомарно, как при перемещении; возвращает фактический путь архива.
+    """
+    fmt = archive_format(dest)
+    if fmt is None:
+        raise ValueError(f"неизвестный формат архива: {os.path.basename(dest)}")
+    for candidate in dest_candidates(dest):
+        try:
+            f = open(candidate, "xb")
+        except FileExistsError:
+            continue
+        dest = candidate
+        break
+
+    def count(ti):
+        if job and ti.isfile():
+            job.add(ti.size, files=1)
+        return ti
+
+    try:
+        with f:
+            if fmt == 'zip':
+                import zipfile
+                with zipfile.ZipFile(f, "w", zipfile.ZIP_DEFLATED, compresslevel=level) as zf:
+                    for src in sources:
+                        base = os.path.dirname(src.rstrip(os.sep))
+                        for path in _walk_paths(src):
+                            zf.write(path, os.path.relpath(path, base))
+                            if job and os.path.isfile(path) and not os.path.islink(path):
+                                job.add(os.path.getsize(path), files=1)
+            else:
+                import tarfile
+                out = ParallelGzipWriter(f, level, workers) if fmt == 'tar.gz' else f
+                try:
+                    with tarfile.open(fileobj=out, mode="w|", format=tarfile.PAX_FORMAT) as tf:
+                        for src in sources:
+                            tf.add(src, arcname=os.path.basename(src.rstrip(os.sep)), filter=count)
+                finally:
+                    if out is not f:
+                        out.close()
+    except BaseException:
+        try:
+            os.unlink(dest)
+        except OSError:
+            pass
+        raise
+    if job:
+        job.strategy.add(fmt)
+    return dest
+
+
+# --- Распаковка архивов ---
+
+# Сколько распакованных, но ещё не записанных байт может висеть в очереди воркеров
+EXTRACT_INFLIGHT = 64 * 1024 * 1024
+
+
+class _CountingReader:
+    """Обёртка над сырым файлом архива: считает прочитанные (сжатые) байты для прогресса."""
+
+    def __init__(self, f, job):
+        self.f, self.job = f, job
+
+    def read(self, n=-1):
+        buf = self.f.read(n)
+        if self.job:
+            self.job.add(len(buf))
+        return buf
+
+    def seek(self, *args):
+        return self.f.seek(*args)
+
+    def tell(self):
+        return self.f.tell()
+
+    def seekable(self):
+        return self.f.seekable()
+
+
+class _PendingFile:
+    """Файл, куда воркеры пишут блоки через pwrite; последний закончивший закрывает и ставит метаданные."""
+
+    def __init__(self, fd, path, mode, mtime):
+        self.fd, self.path, self.mode, self.mtime = fd, path, mode, mtime
+        self.pending = 1  # +1 держит главный поток, пока подаёт блоки
+        self.lock = threading.Lock()
+        self.error = None
+
+    def release(self):
+        with self.lock:
+            self.pending -= 1
+            last = self.pending == 0
+        if last:
+            os.close(self.fd)
+            if self.error is None:
+                os.chmod(self.path, self.mode & 0o7777)
+                os.utime(self.path, (self.mtime, self.mtime))
+
+
+class Extractor:
+    """
+    Потоковая распаковка tar/zip в dest_dir. Главный поток распаковывает поток архива, запись
+    блоков (pwrite) уходит в пул потоков — распаковка и запись на диск идут одновременно.
+    Пути проверяются на выход за пределы dest_dir, ссылки создаются последними и только
+    внутрь распакованного дерева. Имена верхнего уровня, которые уже заняты, получают _copy-суффикс.
+    Прогресс — по прочитанным сжатым байтам архива (job.total = размер архива).
+    """
+
+    def __init__(self, archive, dest_dir, job=None, workers=COPY_WORKERS):
+        from concurrent.futures import ThreadPoolExecutor
+        self.archive = archive
+        self.dest_dir = dest_dir
+        self.job = job or Job("extract")
+        self.pool = ThreadPoolExecutor(max(1, workers))
+        self.errors = []
+        self.tops = {}  # верхний компонент в архиве -> фактическое имя в dest_dir
+        self.links = []  # (symlink?, target, member_path) — создаются в конце
+        self._budget = threading.Semaphore(EXTRACT_INFLIGHT // COPY_CHUNK)
+        self._dirs = []  # (path, mode, mtime) — метаданные директорий в конце
+
+    def _target(self, name, reserve):
+        """
+        Путь назначения для члена архива. Имя верхнего уровня при первой встрече занимается
+        атомарно вызовом reserve(путь) (mkdir, O_EXCL, symlink), с _copy-суффиксами, как в
+        _unique_dest. Возвращает (путь, создан_ли_он_уже_через_reserve).
+        """
+        top, _, rest = name.partition("/")
+        actual = self.tops.get(top)
+        if actual is not None:
+            return (os.path.join(actual, rest) if rest else actual), False
+        if rest:
+            reserve = os.mkdir  # под ним есть члены — значит, директория
+        for candidate in dest_candidates(os.path.join(self.dest_dir, top)):
+            try:
+                reserve(candidate)
+            except FileExistsError:
+                continue
+            self.tops[top] = candidate
+            return (os.path.join(candidate, rest) if rest else candidate), not rest
+
+    def _mapped(self, clean):
+        """Уже распакованный член архива -> путь на диске (для жёстких ссылок)."""
+        top, _, rest = clean.partition("/")
+        if top not in self.tops:
+            raise FileNotFoundError(errno.ENOENT, "цель ссылки не распакована", clean)
+        return os.path.join(self.tops[top], rest) if rest else self.tops[top]
+
+    @staticmethod
+    def _reserve_file(path):
+        os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600))
+
+    def _write_chunk(self, pf, buf, offset):
+        try:
+            if pf.error is None:
+                os.pwrite(pf.fd, buf, offset)
+        except OSError as e:
+            pf.error = e
+            self.errors.append(f"{pf.path}: {e}")
+        finally:
+            self._budget.release()
+            pf.release()
+
+    def _extract_stream(self, fobj, target, size, mode, mtime):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        pf = _PendingFile(fd, target, mode, mtime)
+        offset = 0
+        try:
+            while True:
+                buf = fobj.read(COPY_CHUNK)
+                if not buf:
+                    break
+                while not self._budget.acquire(timeout=Job.PROGRESS_INTERVAL):
+                    self.job.tick()
+                with pf.lock:
+                    pf.pending += 1
+                self.pool.submit(self._write_chunk, pf, buf, offset)
+                offset += len(buf)
+        finally:
+            pf.release()
+        self.job.add(files=1)
+
+    def _member(self, name, kind, size, mode, mtime, fobj=None, linkname=None):
+        clean = safe_member_path(name)
+        if clean is None:
+            self.errors.append(f"{name}: небезопасный путь, пропущен")
+            return
+        if kind == "link" or kind == "hardlink":
+            # Цель ссылки должна остаться внутри распакованного дерева. ".." — только в начале цели:
+            # подъём идёт по настоящим директориям (см. run), а "a/../.." сквозь ссылку a ушёл бы наружу
+            base = os.path.dirname(clean) if kind == "link" else ""
+            resolved = os.path.normpath(os.path.join(base, linkname or ""))
+            parts = [p for p in (linkname or "").split("/") if p not in ("", ".")]
+            ups = next((i for i, p in enumerate(parts) if p != ".."), len(parts))
+            if not linkname or os.path.isabs(linkname) or resolved == ".." or resolved.startswith("../") \
+                    or (kind == "link" and ".." in parts[ups:]):
+                self.errors.append(f"{name}: ссылка наружу ({linkname}), пропущена")
+                return
+            self.links.append((kind, linkname if kind == "link" else resolved, clean))
+            return
+        target, _ = self._target(clean, os.mkdir if kind == "dir" else self._reserve_file)
+        if kind == "dir":
+            os.makedirs(target, exist_ok=True)
+            self._dirs.append((target, mode, mtime))
+        elif kind == "file":
+            self._extract_stream(fobj, target, size, mode, mtime)
+        else:
+            self.errors.append(f"{name}: специальный файл пропущен")
+
+    def run(self):
+        self.job.total = os.path.getsize(self.archive)
+        try:
+            if archive_format(self.archive) == 'zip':
+                self._run_zip()
+            else:
+                self._run_tar()
+        finally:
+            self.pool.shutdown(wait=True)
+        # Ссылки — после всех файлов: писать «сквозь» ссылку из архива уже нечего
+        symlinks = set()  # созданные символьные ссылки (имена в архиве)
+        for kind, link_target, clean in self.links:
+            parts = clean.split("/")
+            if any("/".join(parts[:i]) in symlinks for i in range(1, len(parts))):
+                # Ссылка внутри директории-ссылки оказалась бы совсем в другом месте
+                self.errors.append(f"{clean}: путь проходит через ссылку из архива, пропущен")
+                continue
+            try:
+                if kind == "link":
+                    make = lambda p, t=link_target: os.symlink(t, p)
+                else:
+                    make = lambda p, t=self._mapped(link_target): os.link(t, p, follow_symlinks=False)
+                path, created = self._target(clean, make)
+                if not created:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    make(path)
+                if kind == "link":
+                    symlinks.add(clean)
+            except OSError as e:
+                self.errors.append(f"{clean}: {e}")
+        for path, mode, mtime in reversed(self._dirs):
+            try:
+                os.chmod(path, mode & 0o7777)
+                os.utime(path, (mtime, mtime))
+            except OSError:
+                pass
+        return list(dict.fromkeys(self.tops.values()))
+
+    def _run_tar(self):
+        with open(self.archive, "rb") as raw:
+            with TarStream(raw, wrap=lambda f: _CountingReader(f, self.job)) as tf:
+                for ti in tf:
+                    if ti.isdir():
+                        kind = "dir"
+                    elif ti.isfile():
+                        kind = "file"
+                    elif ti.issym():
+                        kind = "link"
+                    elif ti.islnk():
+                        kind = "hardlink"
+                    else:
+                        kind = "special"
+                    self._member(ti.name, kind, ti.size, ti.mode, ti.mtime,
+                                 tf.extractfile(ti) if kind == "file" else None, ti.linkname)
+
+    def _run_zip(self):
+        import zipfile
+        with zipfile.ZipFile(self.archive) as zf:
+            for info in zf.infolist():
+                mode = (info.external_attr >> 16) & 0o7777 or (0o755 if info.is_dir() else 0o644)
+                mtime = time.mktime(info.date_time + (0, 0, -1))
+                if info.is_dir():
+                    self._member(info.filename, "dir", 0, mode, mtime)
+                elif stat.S_ISLNK(info.external_attr >> 16):
+                    self._member(info.filename, "link", 0, mode, mtime, linkname=zf.read(info).decode("utf-8", "surrogateescape"))
+                else:
+                    with zf.open(info) as f:
+                        self._member(info.filename, "file", info.file_size, mode, mtime, f)
+                # zip читается с произвольным доступом — прогресс по сжатому размеру членов
+                self.job.add(info.compress_size)
+
+
+def extract_archive(archive, dest_dir, job=None):
+    """Распаковать архив в dest_dir; возвращает (созданные пути верхнего уровня, ошибки)."""
+    ex = Extractor(archive, dest_dir, job)
+    created = ex.run()
+    return created, ex.errors
+
+
+# --- Автодополнение путей ---
+
+class ListingCache:
+    """
+    Несколько последних листингов директорий — общие для панелей и автодополнения: ключ — путь,
+    запись действительна, пока не изменился mtime директории. Имена хранятся отсортированными,
+    поэтому кандидатов на префикс находим бинарным поиском даже в директориях на 100k записей.
+    Списки из кеша общие — менять их нельзя.
+    """
+
+    def __init__(self, max_dirs=16):
+        self.max_dirs = max_dirs
+        self._dirs = OrderedDict()  # path -> (mtime_ns, names, dirnames)
+        self._lock = threading.Lock()  # панели читают из фоновых потоков
+
+    def listing(self, path):
+        try:
+            return self.load(path)
+        except OSError:
+            return [], frozenset()
+
+    def load(self, path):
+        """(имена, директории) из кеша или с диска; ошибки чтения — OSError."""
+        mtime = os.stat(path).st_mtime_ns
+        with self._lock:
+            cached = self._dirs.get(path)
+            if cached is not None and cached[0] == mtime:
+                self._dirs.move_to_end(path)
+                return cached[1], cached[2]
+        names, dirnames = [], set()
+        with os.scandir(path) as it:
+            for entry in it:
+                names.append(entry.name)
+                try:
+                    if entry.is_dir():  # d_type, по ссылкам — stat
+                        dirnames.add(entry.name)
+                except OSError:
+                    pass
+        names.sort()
+        with self._lock:
+            self._dirs[path] = (mtime, names, dirnames)
+            self._dirs.move_to_end(path)
+            while len(self._dirs) > self.max_dirs:
+                self._dirs.popitem(last=False)
+        return names, dirnames
+
+    def complete(self, text, base_dir):
+        """
+        Варианты дополнения text (абсолютного или относительно base_dir, с ~) — строки целиком,
+        директории со слешем на конце. Скрытые имена — только если префикс начинается с точки.
+        """
+        from bisect import bisect_left
+        head, prefix = os.path.split(text)
+        directory = os.path.join(base_dir, os.path.expanduser(head)) if head else base_dir
+        names, dirnames = self.listing(directory)
+        lo = bisect_left(names, prefix)
+        hi = bisect_left(names, prefix + "\U0010ffff") if prefix else len(names)
+        result = []
+        for name in names[lo:hi]:
+            if not prefix and name.startswith("."):
+                continue
+            full = os.path.join(head, name) if head else name
+            result.append(full + "/" if name in dirnames else full)
+        return result
+
+
+# --- Пакетное переименование ---
+
+def batch_rename_names(names, pattern, replacement):
+    """
+    Новые имена по регулярному выражению: replacement — как в re.sub (\\1, \\g<name>),
+    плюс {n} / {n:03} — порядковый номер среди совпавших. Возвращает [(старое, новое)] для изменившихся.
+    """
+    import re
+    rx = re.compile(pattern)
+    # Шаблон режется по {n}: куски раскрываются m.expand() по отдельности, номер вставляется
+    # между ними — иначе "\1{n}" превратился бы в "\11", а {n} в тексте имени — в номер
+    counter = re.compile(r"\{n(?::(0?)(\d+))?\}")
+    pieces, counters, pos = [], [], 0
+    for c in counter.finditer(replacement):
+        pieces.append(replacement[pos:c.start()])
+        counters.append((int(c.group(2) or 0), "0" if c.group(1) else " "))
+        pos = c.end()
+    pieces.append(replacement[pos:])
+    pairs = []
+    n = 0
+    for name in names:
+        if not rx.search(name):
+            continue
+        n += 1
+        numbers = [str(n).rjust(width, fill) for width, fill in counters]
+
+        def expand(m):
+            out = [m.expand(pieces[0])]
+            for number, piece in zip(numbers, pieces[1:]):
+                out += (number, m.expand(piece))
+            return "".join(out)
+        new = rx.sub(expand, name)
+        if new != name:
+            pairs.append((name, new))
+    return pairs
+
+
+class RenamePlan:
+    """
+    Граф переименований внутри одной директории. Каждое имя-цель уникально, поэтому граф —
+    это непересекающиеся цепочки и циклы: цепочку применяем с конца, цикл разрываем
+    временным именем. conflicts — {старое имя: причина} для исключённых из плана.
+    """
+
+    def __init__(self, directory, pairs, existing):
+        self.directory = directory
+        self.conflicts = {}
+        existing = set(existing)
+        mapping = {}
+        seen = {}
+        for old, new in pairs:
+            if not new or "/" in new or new in (".", "..") or "\0" in new:
+                self.conflicts[old] = f"недопустимое имя {new!r}"
+            elif new in seen:
+                self.conflicts[old] = f"то же имя, что и у {seen[new]}"
+                self.conflicts.setdefault(seen[new], f"то же имя, что и у {old}")
+            else:
+                seen[new] = old
+                mapping[old] = new
+        for old in self.conflicts:
+            mapping.pop(old, None)
+        # Цель занята файлом, который сам никуда не уезжает; исключение может освободить
+        # не ту цель, а занять другую — повторяем до устойчивости
+        changed = True
+        while changed:
+            changed = False
+            for old, new in list(mapping.items()):
+                if new in existing and new not in mapping:
+                    self.conflicts[old] = f"{new} уже существует"
+                    del mapping[old]
+                    changed = True
+        self.mapping = mapping
+        self.steps = self._order(mapping, existing)
+
+    @staticmethod
+    def _order(mapping, existing):
+        inverse = {new: old for old, new in mapping.items()}
+        steps = []
+        done = set()
+        taken = set(existing) | set(mapping.values())
+        # Концы цепочек: цель свободна — двигаемся от конца к началу
+        for old, new in mapping.items():
+            if new in mapping:
+                continue
+            node = old
+            while node is not None and node not in done:
+                steps.append((node, mapping[node]))
+                done.add(node)
+                node = inverse.get(node)
+        # Остались только циклы
+        serial = 0
+        for start in mapping:
+            if start in done:
+                continue
+            while True:
+                tmp = f".{start}.rename{serial}"
+                serial += 1
+                if tmp not in taken:
+                    break
+            taken.add(tmp)
+            steps.append((start, tmp))
+            done.add(start)
+            node = inverse[start]
+            while node != start:
+                steps.append((node, mapping[node]))
+                done.add(node)
+                node = inverse[node]
+            steps.append((tmp, mapping[start]))
+        return steps
+
+    def apply(self, rename=rename_noreplace, job=None):
+        """
+        Выполнить шаги без перезаписи. При первой ошибке откатываем сделанное в обратном
+        порядке и возвращаем (False, ошибка); при успехе — (True, None).
+        """
+        join = os.path.join
+        done = []
+        undo = job.undo if job else None
+        mark = len(undo.items) if undo is not None else 0
+        try:
+            for old, new in self.steps:
+                rename(join(self.directory, old), join(self.directory, new))
+                done.append((old, new))
+                if undo is not None:
+                    # inode запоминаем сразу: временное имя цикла дальше снова переименуется
+                    undo.add(join(self.directory, old), join(self.directory, new))
+                if job and not len(done) % 256:
+                    job.add(files=256)
+        except OSError as e:
+            if undo is not None:
+                undo.discard(mark)  # откаченное отменять не нужно
+            failed = f"{old} -> {new}: {e.strerror or e}"
+            for old, new in reversed(done):
+                try:
+                    rename(join(self.directory, new), join(self.directory, old))
+                except OSError as e2:
+                    failed += f"\nоткат {new} -> {old}: {e2.strerror or e2}"
+            return False, failed
+        if job:
+            job.add(files=len(done) % 256)
+        return True, None
+
+
+# --- Манифесты контрольных сумм ---
+
+# Алгоритм -> имя манифеста по умолчанию (форматы вывода sha256sum и b2sum)
+MANIFEST_NAMES = {"sha256": "SHA256SUMS", "blake2b": "B2SUMS"}
+MANIFEST_SUFFIXES = (".sha256", ".sha256sum", ".b2", ".b2sum")
+# Длина hex-суммы -> алгоритм: манифест проверяется без указания алгоритма
+_DIGEST_ALGOS = {64: "sha256", 128: "blake2b"}
+
+# Потоки хеширования: hashlib отпускает GIL на больших блоках, так что упираемся в диск
+HASH_WORKERS = min(8, os.cpu_count() or 1)
+
+# При копировании писать манифест в папку назначения ("sha256"/"blake2b"; None — не писать).
+# Суммы считаются по ходу копирования — исходник читается один раз
+MANIFEST_ON_COPY = None
+
+
+def is_manifest_name(name):
+    return name.upper().startswith(tuple(MANIFEST_NAMES.values())) or name.lower().endswith(MANIFEST_SUFFIXES)
+
+
+def parse_algo(text):
+    algo = {"": "sha256", "sha256": "sha256", "blake2b": "blake2b", "blake2": "blake2b", "b2": "blake2b"}.get(
+        text.strip().lower())
+    if algo is None:
+        raise ValueError(f"неизвестный алгоритм: {text} (sha256 или blake2b)")
+    return algo
+
+
+class Manifest:
+    """
+    Суммы файлов по абсолютным путям. Записывается в формате sha256sum/b2sum («hex  путь»,
+    пути относительно папки манифеста, имена с \\ или переводом строки экранируются как в
+    coreutils), поэтому `sha256sum -c` / `b2sum -c` из этой папки его проверяют.
+    add() вызывается из рабочих потоков.
+    """
+
+    def __init__(self, algo="sha256"):
+        if algo not in MANIFEST_NAMES:
+            raise ValueError(f"неизвестный алгоритм: {algo}")
+        self.algo = algo
+        self.entries = {}  # полный путь -> hex
+        self._lock = threading.Lock()
+
+    def new(self):
+        import hashlib
+        return hashlib.new(self.algo)
+
+    def add(self, path, hexdigest):
+        with self._lock:
+            self.entries[path] = hexdigest
+
+    def write(self, path, within=None):
+        """Записать манифест; within — только файлы под этой директорией. Возвращает число строк."""
+        root = os.path.dirname(os.path.abspath(path))
+        lines = []
+        with self._lock:
+            items = sorted(self.entries.items())
+        for full, hexdigest in items:
+            if within is not None and not full.startswith(within.rstrip(os.sep) + os.sep):
+                continue
+            rel = os.path.relpath(full, root)
+            if "\\" in rel or "\n" in rel:
+                lines.append("\\" + hexdigest + "  " + rel.replace("\\", "\\\\").replace("\n", "\\n"))
+            else:
+                lines.append(hexdigest + "  " + rel)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8", errors="surrogateescape") as f:
+            f.write("".join(line + "\n" for line in lines))
+        os.replace(tmp, path)
+        return len(lines)
+
+    @classmethod
+    def load(cls, path):
+        """Прочитать манифест sha256sum/b2sum; алгоритм — по длине сумм. Ошибки формата — ValueError."""
+        root = os.path.dirname(os.path.abspath(path))
+        manifest = None
+        with open(path, encoding="utf-8", errors="surrogateescape") as f:
+            for lineno, line in enumerate(f, 1):
+                line = line.rstrip("\n")
+                if not line.strip() or line.startswith("#"):
+                    continue
+                escaped = line.startswith("\\")
+                if escaped:
+                    line = line[1:]
+                hexdigest, sep, name = line.partition(" ")
+                algo = _DIGEST_ALGOS.get(len(hexdigest))
+                if not sep or algo is None or not name or name[0] not in " *":
+                    raise ValueError(f"{path}:{lineno}: строка не в формате sha256sum")
+                name = name[1:]  # " " — текстовый режим, "*" — двоичный
+                if escaped:
+                    name = name.replace("\\\\", "\0").replace("\\n", "\n").replace("\0", "\\")
+                if manifest is None:
+                    manifest = cls(algo)
+                elif manifest.algo != algo:
+                    raise ValueError(f"{path}:{lineno}: суммы разной длины")
+                manifest.entries[os.path.normpath(os.path.join(root, name))] = hexdigest.lower()
+        return manifest or cls()
+
+
+def _hash_on_pool(items, fn, job=None, workers=HASH_WORKERS):
+    """fn(item) на пуле; заданий в полёте не больше workers*4, главный поток тем временем рисует прогресс."""
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        running = set()
+
+        def drain(limit):
+            nonlocal running
+            while len(running) > limit:
+                _, running = wait(running, timeout=Job.PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+                if job:
+                    job.tick()
+
+        for item in items:
+            running.add(pool.submit(fn, item))
+            drain(workers * 4)
+        drain(0)
+
+
+def generate_manifest(paths, algo="sha256", job=None, workers=HASH_WORKERS, exclude=()):
+    """Суммы всех файлов paths (директории — рекурсивно); возвращает (Manifest, ошибки)."""
+    manifest = Manifest(algo)
+    errors = []
+
+    def files():
+        for top in paths:
+            for path in _walk_paths(top):
+                if path not in exclude and os.path.isfile(path):
+                    yield path
+
+    def one(path):
+        try:
+            manifest.add(path, file_digest(path, algo, job))
+            if job:
+                job.add(files=1)
+        except OSError as e:
+            errors.append(f"{path}: {e.strerror or e}")
+
+    _hash_on_pool(files(), one, job, workers)
+    return manifest, errors
+
+
+def verify_manifest(manifest, job=None, workers=HASH_WORKERS):
+    """Пересчитать суммы файлов манифеста; возвращает (совпавших, [«путь: причина»])."""
+    failures = []
+
+    def one(item):
+        path, expected = item
+        try:
+            if file_digest(path, manifest.algo, job) != expected:
+                failures.append(f"{path}: НЕ СОВПАДАЕТ")
+            if job:
+                job.add(files=1)
+        except OSError as e:
+            failures.append(f"{path}: {e.strerror or e}")
+
+    _hash_on_pool(sorted(manifest.entries.items()), one, job, workers)
+    return len(manifest.entries) - len(failures), failures
+
+
+def write_copy_manifests(manifest, dest_dirs, fs, claims=None):
+    """После копирования с манифестом: по файлу в каждую папку назначения (имя не перезаписывает чужое)."""
+    claims = claims or DestClaims()
+    written = []
+    for dest_dir in sorted(set(dest_dirs)):
+        prefix = dest_dir.rstrip(os.sep) + os.sep
+        if not any(path.startswith(prefix) for path in manifest.entries):
+            continue
+        path = claims.claim(fs, os.path.join(dest_dir, MANIFEST_NAMES[manifest.algo]))
+        manifest.write(path, within=dest_dir)
+        written.append(path)
+    return written
+
+
+# --- Массовая смена атрибутов ---
+
+def parse_mode(spec):
+    """
+    Права в восьмеричном ("755") или символьном виде ("u+x,go-w", "a=rX") -> функция
+    (старый режим, директория?) -> новый режим. Без указания кому — для всех (umask не учитывается).
+    """
+    spec = spec.strip()
+    if spec and all(c in "01234567" for c in spec):
+        value = int(spec, 8)
+        return lambda mode, is_dir: value
+    who_bits = {"u": 0o4700, "g": 0o2070, "o": 0o1007}
+    clauses = []
+    for clause in spec.split(","):
+        i = 0
+        while i < len(clause) and clause[i] in "ugoa":
+            i += 1
+        who = clause[:i].replace("a", "ugo") or "ugo"
+        rest = clause[i:]
+        if not rest or rest[0] not in "+-=":
+            raise ValueError(f"неверные права: {spec}")
+        # Допускаем несколько операций подряд: u+x-w
+        ops = []
+        while rest:
+            op, j = rest[0], 1
+            while j < len(rest) and rest[j] not in "+-=":
+                if rest[j] not in "rwxXst":
+                    raise ValueError(f"неверные права: {spec}")
+                j += 1
+            ops.append((op, rest[1:j]))
+            rest = rest[j:]
+        clauses.append((who, ops))
+
+    def apply(mode, is_dir):
+        mode = stat.S_IMODE(mode)
+        for who, ops in clauses:
+            mask = 0
+            for w in who:
+                mask |= who_bits[w]
+            for op, perms in ops:
+                bits = 0
+                for p in perms:
+                    if p == "r":
+                        bits |= 0o444
+                    elif p == "w":
+                        bits |= 0o222
+                    elif p == "x" or (p == "X" and (is_dir or mode & 0o111)):
+                        bits |= 0o111
+                    elif p == "s":
+                        bits |= 0o6000
+                    elif p == "t":
+                        bits |= 0o1000
+                bits &= mask
+                if op == "+":
+                    mode |= bits
+                elif op == "-":
+                    mode &= ~bits
+                else:
+                    # Как chmod: "=" сбрасывает и setuid/setgid/sticky своих классов; у директорий
+                    # setuid/setgid остаются, если "s" не указано явно
+                    keep = 0o6000 if is_dir and "s" not in perms else 0
+                    mode = (mode & ~(mask & ~keep)) | bits
+        return mode
+    return apply
+
+
+def parse_owner(spec):
+    """"user:group", "user", ":group" (имена или числа) -> (uid, gid); -1 — не менять."""
+    user, _, group = spec.strip().partition(":")
+    uid = gid = -1
+    if user:
+        if user.isdigit():
+            uid = int(user)
+        else:
+            import pwd
+            try:
+                uid = pwd.getpwnam(user).pw_uid
+            except KeyError:
+                raise ValueError(f"нет пользователя {user}")
+    if group:
+        if group.isdigit():
+            gid = int(group)
+        else:
+            import grp
+            try:
+                gid = grp.getgrnam(group).gr_gid
+            except KeyError:
+                raise ValueError(f"нет группы {group}")
+    return uid, gid
+
+
+def parse_time(spec):
+    """"now", "@секунды" или "YYYY-MM-DD[ HH:MM[:SS]]" -> время в наносекундах."""
+    spec = spec.strip()
+    if spec == "now":
+        return time.time_ns()
+    if spec.startswith("@"):
+        return int(float(spec[1:]) * 1e9)
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return int(time.mktime(time.strptime(spec, fmt)) * 1e9)
+        except ValueError:
+            continue
+    raise ValueError(f"неверное время: {spec}")
+
+
+class AttrChange:
+    """Что поменять: mode — функция из parse_mode, uid/gid (-1 — не трогать), mtime_ns (None — не трогать)."""
+
+    def __init__(self, mode=None, uid=-1, gid=-1, mtime_ns=None):
+        self.mode, self.uid, self.gid, self.mtime_ns = mode, uid, gid, mtime_ns
+
+    def apply(self, name, st, dir_fd=None):
+        """Применить к записи; пропускает то, что уже совпадает. True, если что-то менялось."""
+        changed = False
+        is_link = stat.S_ISLNK(st.st_mode)
+        if (self.uid != -1 and st.st_uid != self.uid) or (self.gid != -1 and st.st_gid != self.gid):
+            os.chown(name, self.uid, self.gid, dir_fd=dir_fd, follow_symlinks=False)
+            changed = True
+        if self.mode is not None and not is_link:
+            new = self.mode(st.st_mode, stat.S_ISDIR(st.st_mode))
+            if new != stat.S_IMODE(st.st_mode):
+                os.chmod(name, new, dir_fd=dir_fd)
+                changed = True
+        if self.mtime_ns is not None and st.st_mtime_ns != self.mtime_ns:
+            try:
+                os.utime(name, ns=(self.mtime_ns, self.mtime_ns), dir_fd=dir_fd, follow_symlinks=False)
+                changed = True
+            except NotImplementedError:
+                pass
+        return changed
+
+
+def change_attrs(paths, change, job=None, workers=COPY_WORKERS):
+    """
+    Рекурсивно применить change к paths. Обход параллельный (директория — задача пула),
+    файлы меняются по ходу обхода относительно dir_fd, а директории — в конце от глубоких
+    к верхним, чтобы снятые права r/x не мешали спуститься. Возвращает список ошибок.
+    """
+    from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+    errors = []
+    dirs = []  # (глубина, путь, stat)
+    lock = threading.Lock()
+
+    def record(n_files, n_changed):
+        if job:
+            job.add(files=n_files, changed=n_changed)
+
+    def scan(path, depth):
+        subdirs = []
+        n = c = 0
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError as e:
+            errors.append(f"{path}: {e}")
+            return subdirs
+        try:
+            with os.scandir(fd) as it:
+                for entry in it:
+                    try:
+                        st = entry.stat(follow_symlinks=False)
+                        if stat.S_ISDIR(st.st_mode):
+                            full = os.path.join(path, entry.name)
+                            subdirs.append(full)
+                            with lock:
+                                dirs.append((depth + 1, full, st))
+                            continue
+                        n += 1
+                        if change.apply(entry.name, st, dir_fd=fd):
+                            c += 1
+                    except OSError as e:
+                        errors.append(f"{os.path.join(path, entry.name)}: {e}")
+        except OSError as e:
+            errors.append(f"{path}: {e}")
+        finally:
+            os.close(fd)
+        record(n, c)
+        return [(d, depth + 1) for d in subdirs]
+
+    with ThreadPoolExecutor(max(1, workers)) as pool:
+        running = set()
+        for path in paths:
+            try:
+                st = os.lstat(path)
+            except OSError as e:
+                errors.append(f"{path}: {e}")
+                continue
+            if stat.S_ISDIR(st.st_mode):
+                dirs.append((0, path, st))
+                running.add(pool.submit(scan, path, 0))
+            else:
+                try:
+                    record(1, int(change.apply(path, st)))
+                except OSError as e:
+                    errors.append(f"{path}: {e}")
+        while running:
+            done, running = wait(running, timeout=Job.PROGRESS_INTERVAL, return_when=FIRST_COMPLETED)
+            for fut in done:
+                for sub, depth in fut.result():
+                    running.add(pool.submit(scan, sub, depth))
+            if job:
+                job.tick()
+
+    for depth, path, st in sorted(dirs, key=lambda d: d[0], reverse=True):
+        try:
+            record(1, int(change.apply(path, st)))
+        except OSError as e:
+            errors.append(f"{path}: {e}")
+    return errors
+
+
+def _walk_paths(root):
+    """root и всё под ним (без перехода по ссылкам на директории)."""
+    yield root
+    if os.path.isdir(root) and not os.path.islink(root):
+        for dirpath, dirnames, filenames in os.walk(root):
+            for name in dirnames + filenames:
+                yield os.path.join(dirpath, name)
+
+
+# --- Встроенный просмотр больших файлов ---
+
+# Текст больше этого без своей программы в [open] открывается встроенным просмотром, а не xdg-open
+PAGER_MIN_SIZE = 64 * 1024 * 1024
+# Шаг разреженного индекса строк: одна засечка примерно на столько байт
+PAGER_INDEX_STEP = 1024 * 1024
+# Блок поиска и подсчёта строк; пройденные блоки отдаются ядру (madvise), память не растёт
+PAGER_CHUNK = 16 * 1024 * 1024
+# Строка длиннее показывается кусками по столько байт (бинарные файлы без переводов строк)
+PAGER_LINE_CAP = 64 * 1024
+# Индекс достраивается сам, только если до нужного места не дальше этого; иначе номер строки «?»
+PAGER_INDEX_AHEAD = 256 * 1024 * 1024
+# Как часто в режиме follow проверять, не дописан ли файл (мс)
+PAGER_FOLLOW_INTERVAL = 500
+
+# Управляющие символы (кроме табуляции) показываем точкой, чтобы не ломать терминал
+_PAGER_CTRL = {i: "·" for i in (*range(9), *range(10, 32), 127)}
+
+
+class MappedFile:
+    """
+    Файл, отображённый в память, для построчного просмотра. Позиция — смещение начала строки;
+    соседние строки ищутся прямо в отображении, поэтому переход на процент или байт мгновенный.
+    Номера строк — по разреженному индексу (смещение начала строки, её номер) с засечкой раз в
+    PAGER_INDEX_STEP, который достраивается по мере продвижения. refresh() подхватывает
+    дописанные данные переотображением, ничего не перечитывая.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        self.size = 0
+        self.mm = b""
+        self._offsets, self._lines = [0], [0]  # разреженный индекс, оба списка возрастают
+        self._map()
+
+    def _map(self):
+        import mmap
+        if not isinstance(self.mm, bytes):
+            self.mm.close()
+        self.size = os.fstat(self.fd).st_size
+        self.mm = mmap.mmap(self.fd, self.size, access=mmap.ACCESS_READ) if self.size else b""
+
+    def close(self):
+        if not isinstance(self.mm, bytes):
+            self.mm.close()
+        os.close(self.fd)
+
+    def refresh(self):
+        """Размер изменился — переотобразить; при усечении (ротация лога) индекс сбрасывается."""
+        size = os.fstat(self.fd).st_size
+        if size == self.size:
+            return False
+        if size < self.size:
+            self._offsets, self._lines = [0], [0]
+        self._map()
+        return True
+
+    def _release(self, start, end):
+        """Отдать ядру страницы пройденного блока: на файлах в десятки ГБ RSS остаётся ровным."""
+        if isinstance(self.mm, bytes) or end <= start:
+            return
+        import mmap
+        start -= start % mmap.PAGESIZE
+        try:
+            self.mm.madvise(mmap.MADV_DONTNEED, start, min(end, self.size) - start)
+        except (AttributeError, OSError, ValueError):
+            pass
+
+    # Строки
+
+    def line_end(self, pos):
+        end = self.mm.find(b"\n", pos, min(self.size, pos + PAGER_LINE_CAP))
+        return end if end >= 0 else min(self.size, pos + PAGER_LINE_CAP)
+
+    def line(self, pos):
+        return self.mm[pos:self.line_end(pos)]
+
+    def next_line(self, pos):
+        """Начало следующей строки; на последней строке — pos."""
+        end = self.line_end(pos)
+        nxt = end + 1 if end < self.size and self.mm[end:end + 1] == b"\n" else end
+        return nxt if nxt < self.size else pos
+
+    def line_start(self, pos):
+        """Начало строки, в которой смещение pos."""
+        if pos <= 0:
+            return 0
+        pos = min(pos, self.size)
+        lo = max(0, pos - PAGER_LINE_CAP)
+        nl = self.mm.rfind(b"\n", lo, pos)
+        return nl + 1 if nl >= 0 else lo
+
+    def prev_line(self, pos):
+        return self.line_start(pos - 1) if pos > 0 else 0
+
+    def last_page(self, rows):
+        """Начало страницы, на которой видна последняя строка."""
+        pos = self.line_start(self.size - 1) if self.size else 0
+        for _ in range(rows - 1):
+            pos = self.prev_line(pos)
+        return pos
+
+    # Разреженный индекс строк
+
+    def _extend(self, upto, progress=None):
+        """Досчитать засечки индекса до смещения upto; progress(смещение) -> True прерывает."""
+        off, line = self._offsets[-1], self._lines[-1]
+        scanned = off
+        while off < upto:
+            target = off + PAGER_INDEX_STEP
+            if target >= self.size:
+                break
+            nl = self.mm.find(b"\n", target)
+            if nl < 0:
+                break
+            line += self.mm[off:target].count(b"\n") + 1
+            off = nl + 1
+            self._offsets.append(off)
+            self._lines.append(line)
+            if off - scanned >= PAGER_CHUNK:
+                self._release(scanned, off)
+                scanned = off
+                if progress is not None and progress(off):
+                    return False
+        self._release(scanned, off)
+        return True
+
+    def line_number(self, pos, ahead=PAGER_INDEX_AHEAD):
+        """Номер строки (с 1) по смещению её начала; None, если индекс так далеко ещё не дошёл."""
+        from bisect import bisect_right
+        if pos - self._offsets[-1] > ahead:
+            return None
+        self._extend(pos)
+        i = bisect_right(self._offsets, pos) - 1
+        return self._lines[i] + self.mm[self._offsets[i]:pos].count(b"\n") + 1
+
+    def goto_line(self, number, progress=None):
+        """Смещение начала строки number (с 1); индекс достраивается сколько нужно."""
+        from bisect import bisect_right
+        target = max(0, number - 1)
+        while self._lines[-1] < target:
+            last = self._offsets[-1]
+            if not self._extend(last + PAGER_CHUNK, progress) or self._offsets[-1] == last:
+                break
+        i = bisect_right(self._lines, target) - 1
+        pos, line = self._offsets[i], self._lines[i]
+        while line < target:
+            nl = self.mm.find(b"\n", pos)
+            if nl < 0 or nl + 1 >= self.size:
+                break
+            pos, line = nl + 1, line + 1
+        return pos
+
+    # Поиск
+
+    def search(self, needle, pos, forward=True, progress=None):
+        """
+        Смещение ближайшего вхождения после pos (или до него) либо None. Просмотр блоками по
+        PAGER_CHUNK с перекрытием на длину образца; progress(смещение) -> True прерывает поиск.
+        """
+        overlap = len(needle) - 1
+        if forward:
+            start = pos
+            while start < self.size:
+                end = min(self.size, start + PAGER_CHUNK)
+                hit = self.mm.find(needle, start, min(self.size, end + overlap))
+                self._release(start, end)
+                if hit >= 0:
+                    return hit
+                if progress is not None and progress(end):
+                    return None
+                start = end
+        else:
+            end = pos
+            while end > 0:
+                start = max(0, end - PAGER_CHUNK)
+                hit = self.mm.rfind(needle, start, min(self.size, end + overlap))
+                self._release(start, end)
+                if hit >= 0:
+                    return hit
+                if progress is not None and progress(start):
+                    return None
+                end = start
+        return None
+
+
+def pager_text(raw, col, width):
+    """Видимая часть строки: декодирование с заменой, табуляции, управляющие символы точкой."""
+    text = raw[:(col + width) * 4].decode("utf-8", "replace").translate(_PAGER_CTRL).expandtabs(8)
+    return fit_width(text[col:], width)
+
+
+# --- Дерево директорий ---
+
+# Сколько узлов держим загруженными; сверх — отпускаем детей давно свёрнутых веток
+TREE_MAX_NODES = 1_000_000
+
+
+class TreeNode:
+    __slots__ = ("name", "parent", "depth", "is_dir", "children", "expanded", "loading")
+
+    def __init__(self, name, parent=None, is_dir=True):
+        self.name = name  # у корня — полный путь
+        self.parent = parent
+        self.depth = parent.depth + 1 if parent is not None else 0
+        self.is_dir = is_dir
+        self.children = None  # None — не загружены (или отпущены)
+        self.expanded = False
+        self.loading = False
+
+    @property
+    def path(self):
+        parts = []
+        node = self
+        while node.parent is not None:
+            parts.append(node.name)
+            node = node.parent
+        return os.path.join(node.name, *reversed(parts))
+
+
+def list_children(path, show_hidden=False):
+    """[(имя, директория?)] по имени; тип — из d_type, без stat на каждую запись."""
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            if not show_hidden and entry.name.startswith('.'):
+                continue
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                is_dir = False
+            entries.append((entry.name, is_dir))
+    entries.sort()
+    return entries
+
+
+class TreeView:
+    """
+    Дерево с раскрытием на месте. visible — плоский список видимых узлов, рисуется только
+    окно из него, поэтому прокрутка не зависит от размера дерева. Дети читаются в фоне
+    (submit(lister, path) -> Future) при первом раскрытии; poll() вставляет готовые.
+    Свёрнутые ветки держат детей, пока загружено не больше max_nodes узлов.
+    """
+
+    def __init__(self, root, lister, submit, max_nodes=TREE_MAX_NODES):
+        self.root = TreeNode(root)
+        self.visible = [self.root]
+        self.cursor = 0
         self.offset = 0
+        self.loaded = 1
+        self.max_nodes = max_nodes
+        self._lister = lister
+        self._submit = submit
+        self._pending = {}  # узел -> Future
+        self._collapsed = deque()  # свёрнутые с детьми, от давних к недавним
+        self.expand(self.root)
+
+    @property
+    def current(self):
+        return self.visible[self.cursor]
+
+    def move(self, delta):
+        self.cursor = max(0, min(len(self.visible) - 1, self.cursor + delta))
+
+    def _subtree(self, node):
+        """Видимые потомки node в порядке отображения."""
+        stack = list(reversed(node.children or ()))
+        while stack:
+            child = stack.pop()
+            yield child
+            if child.expanded and child.children:
+                stack.extend(reversed(child.children))
+
+    def _shown(self, node):
+        parent = node.parent
+        while parent is not None:
+            if not parent.expanded:
+                return False
+            parent = parent.parent
+        return True
+
+    def expand(self, node):
+        if not node.is_dir or node.expanded:
+            return
+        node.expanded = True
+        if node.children is None:
+            if node not in self._pending:
+                node.loading = True
+                self._pending[node] = self._submit(self._lister, node.path)
+        elif self._shown(node):
+            self._insert_children(node)
+
+    def _insert_children(self, node):
+        idx = self.visible.index(node)
+        rows = list(self._subtree(node))
+        self.visible[idx + 1:idx + 1] = rows
+        if self.cursor > idx:
+            self.cursor += len(rows)
+
+    def collapse(self, node):
+        if not node.expanded:
+            return
+        node.expanded = False
+        if self._shown(node):
+            idx = self.visible.index(node)
+            end = idx + 1
+            while end < len(self.visible) and self.visible[end].depth > node.depth:
+                end += 1
+            del self.visible[idx + 1:end]
+            if idx < self.cursor < end:
+                self.cursor = idx
+            elif self.cursor >= end:
+                self.cursor -= end - idx - 1
+        if node.children:
+            self._collapsed.append(node)
+            self._enforce_budget()
+
+    def _enforce_budget(self):
+        while self.loaded > self.max_nodes and self._collapsed:
+            node = self._collapsed.popleft()
+            if node.expanded or node.children is None:
+                continue
+            stack = node.children
+            node.children = None
+            while stack:
+                child = stack.pop()
+                self.loaded -= 1
+                self._pending.pop(child, None)
+                if child.children:
+                    stack.extend(child.children)
+                child.children = None
+                child.expanded = child.loading = False
+
+    def poll(self):
+        """Вставить дочитанных детей; (ещё что-то грузится?, что-то дочитано?)."""
+        loaded = False
+        for node, future in list(self._pending.items()):
+            if not future.done():
+                continue
+            del self._pending[node]
+            loaded = True
+            node.loading = False
+            try:
+                entries = future.result()
+            except OSError:
+                entries = []
+            node.children = [TreeNode(name, node, is_dir) for name, is_dir in entries]
+            self.loaded += len(node.children)
+            if node.expanded and self._shown(node):
+                self._insert_children(node)
+            elif node.children:
+                self._collapsed.append(node)
+            self._enforce_budget()
+        return bool(self._pending), loaded
+
+
+# --- Колонки подробностей ---
+
+# Колонки справа от имени: размер, время изменения, права, владелец (ширина в ячейках)
+DETAIL_COLUMNS = (("size", 9), ("mtime", 16), ("mode", 10), ("owner", 12))
+# Имени оставляем не меньше стольких ячеек — иначе лишние колонки справа не показываем
+DETAIL_MIN_NAME = 20
+
+_FIT_CACHE = {}  # (текст, ширина) -> строка ровно на ширину ячеек
+_OWNER_NAMES = {}  # (uid, gid) -> "user:group"
+
+
+def char_width(ch):
+    """Сколько ячеек терминала занимает символ: CJK и эмодзи — 2, комбинирующие — 0."""
+    import unicodedata
+    if unicodedata.combining(ch):
+        return 0
+    if unicodedata.category(ch) == "Cc":
+        return 2  # curses рисует управляющие символы как ^X
+    return 2 if unicodedata.east_asian_width(ch) in ("W", "F") else 1
+
+
+def _fit(text, width):
+    out, used = [], 0
+    for ch in text:
+        w = char_width(ch)
+        if used + w > width:
+            break
+        out.append(ch)
+        used += w
+    return "".join(out) + " " * (width - used)
+
+
+def fit_width(text, width):
+    """text, обрезанный или дополненный пробелами ровно до width ячеек; результат запоминается."""
+    if text.isascii() and text.isprintable():
+        return text[:width].ljust(width)
+    key = (text, width)
+    fitted = _FIT_CACHE.get(key)
+    if fitted is None:
+        if len(_FIT_CACHE) > 100_000:
+            _FIT_CACHE.clear()
+        fitted = _FIT_CACHE[key] = _fit(text, width)
+    return fitted
+
+
+def owner_name(uid, gid):
+    key = (uid, gid)
+    name = _OWNER_NAMES.get(key)
+    if name is None:
+        import pwd
+        import grp
+        try:
+            user = pwd.getpwuid(uid).pw_name
+        except KeyError:
+            user = str(uid)
+        try:
+            group = grp.getgrgid(gid).gr_name
+        except KeyError:
+            group = str(gid)
+        name = _OWNER_NAMES[key] = f"{user}:{group}"
+    return name
+
+
+def format_details(lst, st):
+    """Строки колонок DETAIL_COLUMNS: права — по самой записи (lstat), размер и время — по цели ссылки."""
+    target = st if st is not None else lst
+    if stat.S_ISDIR(target.st_mode):
+        size = "<DIR>"
+    else:
+        size = format_size(target.st_size)
+    mtime = time.strftime("%Y-%m-%d %H:%M", time.localtime(target.st_mtime))
+    return (size.rjust(9), mtime, stat.filemode(lst.st_mode), fit_width(owner_name(lst.st_uid, lst.st_gid), 12))
+
+
+class EntryInfo:
+    """stat записи и строки её колонок; считаются при первом показе и живут до перечитывания листинга."""
+
+    __slots__ = ("lst", "st", "details")
+
+    def __init__(self, fs, path):
+        try:
+            self.lst = fs.lstat(path)
+        except OSError:
+            self.lst = None
+        self.st = self.lst
+        if self.lst is not None and stat.S_ISLNK(self.lst.st_mode):
+            try:
+                self.st = fs.stat(path)
+            except OSError:
+                self.st = None  # битая ссылка
+        self.details = None
+
+    @property
+    def is_dir(self):
+        return self.st is not None and stat.S_ISDIR(self.st.st_mode)
+
+    @property
+    def is_link(self):
+        return self.lst is not None and stat.S_ISLNK(self.lst.st_mode)
+
+    @property
+    def is_executable(self):
+        return self.st is not None and bool(self.st.st_mode & 0o111)
+
+    def columns(self):
+        if self.details is None:
+            self.details = format_details(self.lst, self.st) if self.lst is not None \
+                else tuple(" " * width for _, width in DETAIL_COLUMNS)
+        return self.details
+
+
+class Pane:
+    """Состояние одной панели: директория, листинг, курсор, выделение, пометки, поиск."""
+
+    def __init__(self, current_dir):
+        self.current_dir = current_dir
         self.files = []
+        self.cursor_pos = 0
+        self.offset = 0
         self.selected_files = set()
+        self.action_map = {}  # filename -> action
+        self.listing_partial = False
+        self.search = None  # ContentSearch, пока показываем результаты поиска
+        self.git_marks = None  # {имя: буква статуса}
+        self.git_generation = 0
+        self.loader = None  # (путь, Future) — фоновое чтение директории
+        self.tree = None  # TreeView, пока панель показывает дерево
+        self.entries = {}  # имя -> EntryInfo для уже показанных строк
+
+
+def _pane_attr(name):
+    """Атрибут FileManager, который живёт в активной панели: весь прежний код работает с ней."""
+    return property(lambda self: getattr(self.pane, name),
+                    lambda self, value: setattr(self.pane, name, value))
+
+
+class FileManager:
+    current_dir = _pane_attr("current_dir")
+    files = _pane_attr("files")
+    cursor_pos = _pane_attr("cursor_pos")
+    offset = _pane_attr("offset")
+    selected_files = _pane_attr("selected_files")
+    action_map = _pane_attr("action_map")
+    listing_partial = _pane_attr("listing_partial")
+    search = _pane_attr("search")
+    git_marks = _pane_attr("git_marks")
+    git_generation = _pane_attr("git_generation")
+    tree = _pane_attr("tree")
+
+    def __init__(self, stdscr, backend=None, start_dir=None):
+        self.stdscr = stdscr
+        self.fs = backend or LocalBackend()  # весь доступ к хранилищу — через бэкенд
+        # Панели: в обычном режиме видна только активная, вторая создаётся по "w"
+        self.panes = [Pane(start_dir or os.getcwd())]
+        self.pane = self.panes[0]
+        self.dual = False
+        self._loader_pool = None
+        # Индекс посещённых директорий ведём только для реальной ФС
+        self.frecency = FrecencyIndex() if backend is None else None
+        self.git = GitStatus() if backend is None else None
+        self.needs_redraw = True  # False — последнее ожидание ввода кончилось таймаутом
+        self.undo_log = UndoLog() if backend is None else None
+        self.types = FileTypes()
+        self._type_pairs = {}  # номер цвета -> пара curses для цветов по типам
+        self.last_dir = self.current_dir # Запоминаем начальную директорию
         self.show_hidden = False
+        self.show_details = False
         self.height, self.width = stdscr.getmaxyx()
         self.max_items = self.height - 5  # Оставляем место для заголовка, строки статуса и подсказок
         curses.curs_set(0)  # Скрываем курсор
+        # Цвета настраиваются после первого кадра (init_colors), до этого — монохромные атрибуты
+        self.colors_ready = False
+
+        # Буфер (clipboard) для copy/move старой функциональности
+        self.clipboard = []  # список полных путей
+        self.clipboard_action = None
+
+        # Новое: action_map (в панели) хранит для имени файла действие: 'copy'/'move'/'delete'
+
+        # Листинги локальной ФС — общие для панелей и Tab-дополнения в get_input
+        self.listings = ListingCache()
+        # Для первого кадра хватает начала листинга, полный дочитывается сразу после
+        self.get_files(limit=max(STARTUP_LISTING, self.max_items))
+
+    # Атрибуты до настройки цветов: курсор — инверсией, директории/выделение/удаление — жирным
+    MONO_ATTRS = {1: curses.A_REVERSE, 2: curses.A_BOLD, 5: curses.A_BOLD, 8: curses.A_BOLD}
+    # Цвет буквы статуса git: изменения — как move, новые — как copy, удаления и конфликты — как delete
+    GIT_PAIRS = {"M": 7, "T": 7, "R": 7, "A": 6, "D": 8, "U": 8, "?": 9, "!": 9}
+
+    def pair(self, n):
+        if self.colors_ready:
+            return curses.color_pair(n)
+        return self.MONO_ATTRS.get(n, curses.A_NORMAL)
+
+    def init_colors(self):
+        if self.colors_ready:
+            return
         curses.start_color()
         curses.use_default_colors()
         
@@ -54,99 +4394,284 @@ class FileManager:
         curses.init_pair(7, 13, -1)   # move — жёлто-оранжевый
         curses.init_pair(8, curses.COLOR_RED, -1)    # delete
         curses.init_pair(9, 14, -1)   # сообщения — мягкий серый
-        
-        
-        # Буфер (clipboard) для copy/move старой функциональности
-        self.clipboard = []  # список полных путей
-        self.clipboard_action = None
-
-        # Новое: action_map хранит для имени файла действие: 'copy'/'move'/'delete'
-        self.action_map = {}  # filename -> action
-
-        self.get_files()
+        self.colors_ready = True
 
-    def get_files(self):
+    def get_files(self, limit=None):
         self.files = []
+        self.git_marks = None
+        if self.search is not None:
+            self.files.extend(self.search.results)
+            return
+        self._update_git_marks(rescan=True)
         try:
-            if self.show_hidden:
-                self.files.extend(sorted(os.listdir(self.current_dir)))
-            else:
-                self.files.extend(sorted([f for f in os.listdir(self.current_dir) if not f.startswith('.')]))
+            names, complete = self._read_listing(self.current_dir, limit)
+            self.listing_partial = not complete
+            self._set_listing(self.pane, names)
         except PermissionError:
             self.show_message("Ошибка доступа к директории")
             self.current_dir = os.path.dirname(self.current_dir)
             self.get_files()
+            return
+        if self.dual:
+            # Операция могла задеть и вторую панель; по общему кешу это дёшево, если не задела
+            self._load_pane_async(self.other_pane)
+
+    def _read_listing(self, path, limit=None):
+        """(имена, полный ли листинг): локальная ФС — через общий кеш, архивы и прочие бэкенды — напрямую."""
+        started = time.monotonic()
+        if limit is not None:
+            names, complete = self.fs.listdir_partial(path, limit)
+        elif isinstance(self.fs, LocalBackend) and not self.fs.is_readonly(path):
+            names, complete = self.listings.load(path)[0], True
+        else:
+            names, complete = self.fs.listdir(path), True
+        METRICS.emit("listing", path=path, entries=len(names),
+                     seconds=round(time.monotonic() - started, 6), partial=not complete)
+        return names, complete
+
+    def _set_listing(self, pane, names):
+        pane.entries = {}
+        if self.show_hidden:
+            pane.files = sorted(names)
+        else:
+            pane.files = sorted([f for f in names if not f.startswith('.')])
+
+    # --- Две панели ---
+
+    @property
+    def other_pane(self):
+        return self.panes[1] if self.pane is self.panes[0] else self.panes[0]
+
+    def toggle_dual(self):
+        """Включить/выключить вторую панель; при повторном включении она помнит свою директорию."""
+        self.dual = not self.dual
+        if self.dual:
+            if len(self.panes) == 1:
+                self.panes.append(Pane(self.current_dir))
+            self._load_pane_async(self.other_pane)
+
+    def switch_pane(self):
+        # Листинги уже в панелях — переключение ничего не перечитывает
+        if self.dual:
+            self.pane = self.other_pane
+
+    def _load_pane_async(self, pane):
+        """Перечитать панель в фоновом потоке; результат заберёт poll_background."""
+        if pane.search is not None:
+            return
+        pane.loader = (pane.current_dir, self._background().submit(self._read_listing, pane.current_dir))
+
+    def _background(self):
+        """Пул для фонового чтения директорий (панели, дерево)."""
+        if self._loader_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._loader_pool = ThreadPoolExecutor(2, thread_name_prefix="pane")
+        return self._loader_pool
+
+    def _finish_pane_load(self, pane):
+        path, future = pane.loader
+        pane.loader = None
+        if path != pane.current_dir:
+            return
+        try:
+            names, _ = future.result()
+        except OSError:
+            names = []
+        self._set_listing(pane, names)
+        pane.cursor_pos = min(pane.cursor_pos, max(0, len(pane.files) - 1))
+        pane.offset = min(pane.offset, pane.cursor_pos)
+        self._update_git_marks(pane)
 
     def draw(self):
-        self.stdscr.clear()
+        # erase, а не clear: clear заставил бы терминал перерисовать весь экран, а не разницу
+        self.stdscr.erase()
         self.height, self.width = self.stdscr.getmaxyx()
         self.max_items = self.height - 5
 
+        if self.dual:
+            # Две панели пополам; при ресайзе только перерисовываем — листинги уже в панелях
+            half = self.width // 2
+            for pane, x, width in ((self.panes[0], 0, half), (self.panes[1], half, self.width - half)):
+                self._draw_pane(pane, x, width, pane is self.pane)
+        else:
+            self._draw_pane(self.pane, 0, self.width, True)
+
+        # Подсказки больше не рисуются в строке — они доступны в popup по клавише "?"
+        self.stdscr.refresh()
+
+    def _draw_pane(self, pane, x, width, active):
+        if pane.tree is not None:
+            self._draw_tree(pane, x, width, active)
+            return
         # Заголовок + информация о буфере
         clipboard_info = ""
         if self.clipboard:
             clipboard_info = f" | Clipboard: {len(self.clipboard)} item(s) [{self.clipboard_action}]"
-        header = f" GFD - {self.current_dir} {clipboard_info} "
+        header = f" GFD - {pane.current_dir}{' …' if pane.listing_partial else ''} {clipboard_info} "
+        if pane.search is not None:
+            state = " (идёт поиск, Esc — стоп)" if pane.search.running else ""
+            header = f" GFD - «{pane.search.text}» в {pane.current_dir}: {len(pane.files)} совп.{state} {clipboard_info} "
         try:
-            self.stdscr.addstr(0, 0, header[:self.width-1], curses.A_REVERSE)
+            self.stdscr.addstr(0, x, header[:width-1], curses.A_REVERSE if active else curses.A_BOLD)
         except curses.error:
             pass
 
-        # Список файлов
+        # Колонки подробностей — сколько помещается при имени не короче DETAIL_MIN_NAME
+        git_width = 3 if pane.git_marks else 0
+        columns = 0
+        if self.show_details:
+            room = width - 1 - git_width - DETAIL_MIN_NAME
+            for _, col_width in DETAIL_COLUMNS:
+                if room < col_width + 1:
+                    break
+                room -= col_width + 1
+                columns += 1
+        details_width = sum(col_width + 1 for _, col_width in DETAIL_COLUMNS[:columns])
+
+        # Список файлов; stat и строки колонок считаются только для видимых строк и кешируются
         line = 2
-        for i in range(self.offset, min(len(self.files), self.offset + self.max_items)):
-            file_name = self.files[i]
-            full_path = os.path.join(self.current_dir, file_name)
+        for i in range(pane.offset, min(len(pane.files), pane.offset + self.max_items)):
+            file_name = pane.files[i]
+            full_path = os.path.join(pane.current_dir, file_name)
+            info = pane.entries.get(file_name)
+            if info is None:
+                info = pane.entries[file_name] = EntryInfo(self.fs, full_path)
 
             # Приписка метки в виде [C]/[M]/[D]
             tag = ""
-            if file_name in self.action_map:
-                act = self.action_map[file_name]
+            if file_name in pane.action_map:
+                act = pane.action_map[file_name]
                 tag = " [C]" if act == 'copy' else (" [M]" if act == 'move' else " [D]")
 
-            display_name = (file_name + tag)[:self.width-1]
+            # Справа — колонка статуса git (3 символа), если директория в репозитории
+            git_code = pane.git_marks.get(file_name) if pane.git_marks else None
+            name_width = max(0, width - 1 - git_width - details_width)
+            # Обрезаем по ширине в ячейках терминала, а не по числу символов (CJK, эмодзи)
+            display_name = fit_width(file_name + tag, name_width)
+            if columns:
+                display_name += "".join(" " + col for col in info.columns()[:columns])
+            display_name += " " * git_width
 
             # Определяем базовый цвет по типу файла
-            if os.path.isdir(full_path) or file_name == "..":
-                file_type_attr = curses.color_pair(2)
-            elif os.path.islink(full_path):
-                file_type_attr = curses.color_pair(4)
-            elif os.access(full_path, os.X_OK):
-                file_type_attr = curses.color_pair(3)
+            if info.is_dir or file_name == "..":
+                file_type_attr = self.pair(2)
+            elif info.is_link:
+                file_type_attr = self.pair(4)
+            elif info.is_executable:
+                file_type_attr = self.pair(3)
             else:
-                file_type_attr = curses.A_NORMAL
+                file_type_attr = self.type_attr(full_path, info.st)
 
             # Если для файла назначено действие — цвет соответствующей пометки
-            if file_name in self.action_map:
-                act = self.action_map[file_name]
+            if file_name in pane.action_map:
+                act = pane.action_map[file_name]
                 if act == 'copy':
-                    file_type_attr = curses.color_pair(6)
+                    file_type_attr = self.pair(6)
                 elif act == 'move':
-                    file_type_attr = curses.color_pair(7)
+                    file_type_attr = self.pair(7)
                 elif act == 'delete':
-                    file_type_attr = curses.color_pair(8) | curses.A_BOLD
+                    file_type_attr = self.pair(8) | curses.A_BOLD
 
-            # Если курсор на строке — используем курсор-атрибут (он имеет приоритет визуально)
-            if i == self.cursor_pos:
-                attr = curses.color_pair(1)
-            elif file_name in self.selected_files:
-                attr = curses.color_pair(5)
+            # Если курсор на строке — используем курсор-атрибут (он имеет приоритет визуально);
+            # в неактивной панели курсор только подчёркнут
+            cursor = i == pane.cursor_pos and active
+            if cursor:
+                attr = self.pair(1)
+            elif file_name in pane.selected_files:
+                attr = self.pair(5)
             else:
                 attr = curses.A_NORMAL
+            if i == pane.cursor_pos and not active:
+                file_type_attr |= curses.A_UNDERLINE
 
             try:
                 # Рисуем: если курсор на строке, рисуем с курсор-атрибутом (и текстом display_name)
-                if i == self.cursor_pos or file_name in self.selected_files:
-                    self.stdscr.addstr(line, 0, display_name.ljust(self.width-1), attr)
+                if cursor or file_name in pane.selected_files:
+                    self.stdscr.addstr(line, x, display_name, attr)
                 else:
-                    self.stdscr.addstr(line, 0, display_name.ljust(self.width-1), file_type_attr)
+                    self.stdscr.addstr(line, x, display_name, file_type_attr)
+                if git_code:
+                    git_attr = attr if cursor else self.pair(self.GIT_PAIRS.get(git_code, 9))
+                    self.stdscr.addstr(line, x + width - 3, git_code, git_attr)
             except curses.error:
                 pass
 
             line += 1
 
-        # Подсказки больше не рисуются в строке — они доступны в popup по клавише "?"
-        self.stdscr.refresh()
+    def _draw_tree(self, pane, x, width, active):
+        tree = pane.tree
+        header = f" GFD - дерево {tree.root.name} ({len(tree.visible)} строк, загружено {tree.loaded}) "
+        try:
+            self.stdscr.addstr(0, x, header[:width-1], curses.A_REVERSE if active else curses.A_BOLD)
+        except curses.error:
+            pass
+
+        # Рисуем только окно из плоского списка видимых узлов
+        if tree.cursor < tree.offset:
+            tree.offset = tree.cursor
+        elif tree.cursor >= tree.offset + self.max_items:
+            tree.offset = tree.cursor - self.max_items + 1
+        line = 2
+        for i in range(tree.offset, min(len(tree.visible), tree.offset + self.max_items)):
+            node = tree.visible[i]
+            if node.is_dir:
+                marker = "… " if node.loading else ("▾ " if node.expanded else "▸ ")
+            else:
+                marker = "  "
+            text = ("  " * node.depth + marker + node.name)[:width-1]
+            if i == tree.cursor and active:
+                attr = self.pair(1)
+            else:
+                attr = self.pair(2) if node.is_dir else curses.A_NORMAL
+                if i == tree.cursor:
+                    attr |= curses.A_UNDERLINE
+            try:
+                self.stdscr.addstr(line, x, text.ljust(width-1), attr)
+            except curses.error:
+                pass
+            line += 1
+
+    def type_attr(self, full_path, st=None):
+        """Цвет обычного файла по его типу (правила [colors]); до init_colors — без цвета, тип не определяем."""
+        if not self.colors_ready:
+            return curses.A_NORMAL
+        if st is None:
+            try:
+                st = self.fs.stat(full_path)
+            except OSError:
+                return curses.A_NORMAL
+        if not stat.S_ISREG(st.st_mode):
+            return curses.A_NORMAL
+        color = self.types.rules_for(self.types.detect(self.fs, full_path, st))[0]
+        if color is None or color >= curses.COLORS:
+            return curses.A_NORMAL
+        pair = self._type_pairs.get(color)
+        if pair is None:
+            pair = self._type_pairs[color] = 20 + len(self._type_pairs)
+            curses.init_pair(pair, color, -1)
+        return curses.color_pair(pair)
+
+    def _opener_for(self, full_path):
+        try:
+            st = self.fs.stat(full_path)
+        except OSError:
+            return None
+        return self.types.rules_for(self.types.detect(self.fs, full_path, st))[1]
+
+    def draw_job_progress(self, job):
+        """Строка прогресса текущей операции внизу экрана."""
+        rate = job.bytes / job.elapsed() if job.elapsed() > 0 else 0
+        done = f"{format_size(job.bytes)}"
+        if job.total:
+            done += f" из {format_size(job.total)} ({job.bytes * 100 // job.total}%)"
+        text = f" {job.name}: {job.files} файл(ов), {done} ({format_size(rate)}/s) "
+        try:
+            self.stdscr.move(self.height - 1, 0)
+            self.stdscr.clrtoeol()
+            self.stdscr.addstr(self.height - 1, 0, text[:self.width-1], self.pair(9))
+            self.stdscr.refresh()
+        except curses.error:
+            pass
 
     def show_message(self, message):
         # Показываем сообщение в центре; ждём нажатия клавиши
@@ -158,17 +4683,26 @@ class FileManager:
             for idx, ln in enumerate(lines):
                 self.stdscr.addstr(start_y + idx, max(0, self.width // 2 - min(len(ln), self.width-1) // 2), ln[:self.width-1], curses.A_BOLD)
             self.stdscr.refresh()
-            self.stdscr.get_wch()
+            self.wait_key()
         except curses.error:
             pass  # если не удалось нарисовать — игнорируем
 
+    def wait_key(self):
+        """Дождаться клавиши, не считая таймаутов фонового опроса; ввод — только через stdscr (его перехватывает запись сессии)."""
+        while True:
+            try:
+                return self.stdscr.get_wch()
+            except curses.error:
+                continue
+
     def show_help_popup(
                 self,
-                help_text="←: Вернуться | →: Войти\Запустить \n c: Отметить для копирования \n m: Отметить для перемещения \n d: Отметить для удаления \n p: Применить метки \n x: Очистить буфер \n .: Показать\Скрыть скрытые файлы \n Space: Выбрать файл \n r: Переименовать \n n: Новый файл\папка \n ?: Помощь \n q: Выход ",
+                help_text="←: Вернуться | →: Войти\Запустить \n c: Отметить для копирования \n m: Отметить для перемещения \n d: Отметить для удаления \n p: Применить метки \n x: Очистить буфер \n .: Показать\Скрыть скрытые файлы \n Space: Выбрать файл \n r: Переименовать \n n: Новый файл\папка \n j: Перейти к частой директории \n g: Поиск по содержимому (Esc — остановить) \n a: Упаковать выделение в архив \n e: Распаковать архив \n t: Права/владелец/время (рекурсивно) \n R: Пакетное переименование (regex) \n U: Восстановить из корзины \n u: Отменить последнее переименование/перемещение/удаление \n w: Две панели | Tab: Другая панель \n T: Дерево (→ раскрыть, ← свернуть, Enter — перейти) \n i: Размер, время, права, владелец \n H: Контрольные суммы (на манифесте — проверить) \n v: Просмотр файла (/ поиск, : переход, F — follow) \n Tab: Дополнить путь при вводе \n ?: Помощь \n q: Выход ",
                 width_ratio=0.6,
                 height_ratio=0.4,
                 padding=4
             ):
+                import textwrap
                 # Разбираем текст на строки, учитывая переносы \n
                 lines = []
                 for part in help_text.split("\n"):
@@ -199,7 +4733,7 @@ class FileManager:
             
                     win.refresh()
                     try:
-                        win.get_wch()
+                        self.wait_key()
                     except Exception:
                         pass
             
@@ -211,7 +4745,8 @@ class FileManager:
                 except curses.error:
                     self.show_message(help_text)
 
-    def get_input(self, prompt, default='', none_on_cancel=False):
+    def get_input(self, prompt, default='', none_on_cancel=False, on_change=None, complete=False):
+                            """complete=True — Tab дополняет путь относительно текущей директории, повторный Tab перебирает варианты."""
                             win = self.stdscr
                             try:
                                 curses.curs_set(1)  # показать курсор на время ввода
@@ -223,11 +4758,41 @@ class FileManager:
                                 y = maxy - 1  # рисуем в последней строке
                                 buf = list(default)
                                 pos = len(buf)
+                                candidates = []  # варианты текущего дополнения
+                                cand_idx = -1
+                                cand_text = None  # буфер после последнего дополнения; изменился — перебор сброшен
+                                cand_tail = []
+
+                                def tab(step):
+                                    nonlocal buf, pos, candidates, cand_idx, cand_text, cand_tail
+                                    if candidates and ''.join(buf) == cand_text:
+                                        cand_idx = (cand_idx + step) % len(candidates) if cand_idx >= 0 or step > 0 \
+                                            else len(candidates) - 1
+                                        new = candidates[cand_idx]
+                                    else:
+                                        candidates = self.listings.complete(''.join(buf[:pos]), self.current_dir)
+                                        cand_tail = buf[pos:]
+                                        cand_idx = -1
+                                        if not candidates:
+                                            curses.beep()
+                                            return
+                                        new = os.path.commonprefix(candidates)
+                                        if len(candidates) == 1:
+                                            candidates = []
+                                        elif len(new) <= pos:
+                                            # общий префикс ничего не добавил — сразу к первому варианту
+                                            cand_idx = 0 if step > 0 else len(candidates) - 1
+                                            new = candidates[cand_idx]
+                                    buf = list(new) + cand_tail
+                                    pos = len(new)
+                                    cand_text = ''.join(buf)
 
                                 def render():
                                     nonlocal maxy, maxx, y
                                     maxy, maxx = win.getmaxyx()
                                     y = maxy - 1
+                                    if on_change is not None:
+                                        on_change(''.join(buf))  # живые подсказки над строкой ввода
                                     try:
                                         win.move(y, 0)
                                         win.clrtoeol()
@@ -240,6 +4805,10 @@ class FileManager:
                                             disp = display
                                             cursor_x = len(prompt) + pos
                                         win.addstr(y, 0, disp)
+                                        if candidates and cand_idx >= 0 and ''.join(buf) == cand_text:
+                                            hint = f"  ({cand_idx + 1}/{len(candidates)})"
+                                            if len(disp) + len(hint) < maxx - 1:
+                                                win.addstr(y, len(disp), hint, self.pair(9))
                                         cursor_x = max(0, min(maxx - 1, cursor_x))
                                         win.move(y, cursor_x)
                                         win.refresh()
@@ -253,7 +4822,12 @@ class FileManager:
                                     except KeyboardInterrupt:
                                         return None if none_on_cancel else ''
                                     except curses.error:
-                                        return ''.join(buf)
+                                        # таймаут опроса фоновых задач (poll_background) — это не Enter, ждём дальше
+                                        continue
+
+                                    if complete and ch in ('\t', curses.KEY_BTAB):
+                                        tab(-1 if ch == curses.KEY_BTAB else 1)
+                                        continue
 
                                     if isinstance(ch, str):
                                         if ch == '\n' or ch == '\r':
@@ -301,7 +4875,19 @@ class FileManager:
                                     pass
 
     def handle_input(self):
-        key = self.stdscr.get_wch()
+        try:
+            key = self.stdscr.get_wch()
+        except curses.error:
+            self.needs_redraw = False  # таймаут ожидания (идут фоновые задачи), ввода не было
+            return True
+
+        if key == "\x1b" and self.search is not None and self.search.running:
+            self.search.cancel()
+            return True
+
+        if self.tree is not None and key not in ("q", "w", "\t", "?"):
+            self.handle_tree_key(key)
+            return True
 
         if key == curses.KEY_UP:
             self.cursor_pos = max(0, self.cursor_pos - 1)
@@ -367,39 +4953,240 @@ class FileManager:
         elif key == "n":
             self.create_new_item()
 
+        elif key == "j":
+            self.jump_to_frecent()
+
+        elif key == "g":
+            self.start_content_search()
+
+        elif key == "a":
+            self.archive_selection()
+
+        elif key == "e":
+            self.extract_selection()
+
+        elif key == "t":
+            self.change_attributes()
+
+        elif key == "w":
+            self.toggle_dual()
+
+        elif key == "\t":
+            self.switch_pane()
+
+        elif key == "U":
+            self.restore_from_trash()
+
+        elif key == "R":
+            self.batch_rename()
+
+        elif key == "T":
+            self.toggle_tree()
+
+        elif key == "i":
+            self.show_details = not self.show_details
+
+        elif key == "H":
+            self.checksum_selection()
+
+        elif key == "u":
+            self.undo_last()
+
+        elif key == "v":
+            if self.cursor_pos < len(self.files):
+                self.view_file(os.path.join(self.current_dir, self.files[self.cursor_pos]))
+
         elif key == "?":
             self.show_help_popup()
 
         return True
 
+    # --- Дерево ---
+
+    def toggle_tree(self):
+        if self.tree is not None:
+            self.tree = None
+            return
+        if isinstance(self.fs, LocalBackend) and not self.fs.is_readonly(self.current_dir):
+            show_hidden = self.show_hidden
+
+            def lister(path):
+                return list_children(path, show_hidden)
+        else:
+            lister = self._tree_children
+        self.tree = TreeView(self.current_dir, lister, self._background().submit)
+
+    def _tree_children(self, path):
+        """Дети узла через бэкенд (архивы, MemoryBackend) — там нет d_type."""
+        names = self.fs.listdir(path)
+        if not self.show_hidden:
+            names = [n for n in names if not n.startswith('.')]
+        return [(n, self.fs.isdir(os.path.join(path, n))) for n in sorted(names)]
+
+    def handle_tree_key(self, key):
+        tree = self.tree
+        node = tree.current
+        if key == curses.KEY_UP:
+            tree.move(-1)
+        elif key == curses.KEY_DOWN:
+            tree.move(1)
+        elif key == curses.KEY_PPAGE:
+            tree.move(-self.max_items)
+        elif key == curses.KEY_NPAGE:
+            tree.move(self.max_items)
+        elif key == curses.KEY_HOME:
+            tree.move(-len(tree.visible))
+        elif key == curses.KEY_END:
+            tree.move(len(tree.visible))
+        elif key == curses.KEY_RIGHT:
+            if node.is_dir:
+                tree.expand(node)
+            else:
+                self.open_file(node.path)
+        elif key == curses.KEY_LEFT:
+            if node.is_dir and node.expanded and node.parent is not None:
+                tree.collapse(node)
+            elif node.parent is not None:
+                tree.cursor = tree.visible.index(node.parent)
+        elif key in ("\n", "\r", curses.KEY_ENTER):
+            # Перейти в директорию узла (для файла — в его директорию) и выйти из дерева
+            path = node.path if node.is_dir else node.parent.path
+            self.tree = None
+            self.change_directory(path)
+        elif key == "T" or key == "\x1b":
+            self.tree = None
+
     def open_selected_item(self):
         if self.cursor_pos < len(self.files):
             selected_file = self.files[self.cursor_pos]
             full_path = os.path.join(self.current_dir, selected_file)
 
-            if os.path.isdir(full_path):
+            if self.fs.isdir(full_path):
+                self.change_directory(full_path)
+            elif is_archive_name(selected_file) and isinstance(self.fs, LocalBackend) \
+                    and os.path.isfile(full_path):
+                # Архив открываем как директорию
+                try:
+                    open_archive(full_path)
+                except OSError as e:
+                    self.show_message(f"Не удалось открыть архив {selected_file}: {e.strerror or e}")
+                    return
                 self.change_directory(full_path)
             else:
                 self.open_file(full_path)
 
     def navigate_back(self):
+        if self.search is not None:
+            # Из результатов поиска — обратно в директорию, где искали
+            self.leave_search()
+            return
         parent_dir = os.path.dirname(self.current_dir)
         if parent_dir != self.current_dir:  # Проверяем, что мы не в корневой директории
             self.current_dir = parent_dir
             self.cursor_pos = 0
             self.offset = 0
             self.get_files()
+            self._record_visit()
 
     def change_directory(self, path):
         self.current_dir = os.path.abspath(path)
         self.cursor_pos = 0
         self.offset = 0
         self.get_files()
+        self._record_visit()
+
+    def _record_visit(self):
+        if self.frecency is not None and not self.fs.is_readonly(self.current_dir):
+            self.frecency.visit(self.current_dir)
+
+    def _local_here(self):
+        """Панель показывает локальную ФС (не MemoryBackend и не внутренность архива)."""
+        return isinstance(self.fs, LocalBackend) and not self.fs.is_readonly(self.current_dir)
+
+    def restore_from_trash(self):
+        """Восстановить из корзины: ввод фильтрует по исходному пути, Enter — верхний вариант (новые первыми)."""
+        if not isinstance(self.fs, LocalBackend):
+            self.show_message("Корзина недоступна")
+            return
+        entries = trash_entries()
+        if not entries:
+            self.show_message("Корзина пуста")
+            return
+        # Удалённое из текущей директории — первым
+        here = [e for e in entries if os.path.dirname(e.path) == self.current_dir]
+        entries = here + [e for e in entries if os.path.dirname(e.path) != self.current_dir]
+        matches = []
+
+        def show_matches(query):
+            nonlocal matches
+            q = query.lower()
+            matches = [e for e in entries if q in e.path.lower()][:max(1, self.height - 3)]
+            self.stdscr.erase()
+            for idx, e in enumerate(matches):
+                when = time.strftime("%Y-%m-%d %H:%M", time.localtime(e.deleted))
+                self._draw_line(self.height - 2 - idx, f"{when}  {e.path}", self.pair(1) if idx == 0 else self.pair(2))
+
+        query = self.get_input("Восстановить: ", none_on_cancel=True, on_change=show_matches)
+        if query is None or not matches:
+            return
+        try:
+            restored = restore_trash(matches[0])
+        except OSError as e:
+            self.show_message(f"Ошибка восстановления: {e}")
+            return
+        self.get_files()
+        self.show_message(f"Восстановлено: {restored}")
+
+    def jump_to_frecent(self):
+        """Перейти к директории из frecency-индекса: ввод фильтрует, Enter — лучший вариант."""
+        if self.frecency is None:
+            self.show_message("Индекс директорий недоступен")
+            return
+        matches = []
+
+        def show_matches(query):
+            nonlocal matches
+            matches = self.frecency.search(query, limit=max(1, self.height - 3))
+            self.stdscr.erase()
+            for idx, path in enumerate(matches):
+                attr = self.pair(1) if idx == 0 else self.pair(2)
+                try:
+                    self.stdscr.addstr(self.height - 2 - idx, 0, path[:self.width-1], attr)
+                except curses.error:
+                    pass
+
+        query = self.get_input("Перейти: ", none_on_cancel=True, on_change=show_matches)
+        if query is None or not matches:
+            return
+        target = matches[0]
+        if not os.path.isdir(target):
+            self.frecency.forget(target)
+            self.show_message(f"Директории больше нет: {target}")
+            return
+        self.change_directory(target)
 
     def open_file(self, full_path):
+        fs, inner = vfs_split(full_path)
+        if fs is not None:
+            # Член архива извлекаем во временную директорию и открываем копию
+            import tempfile
+            try:
+                full_path = fs.extract(inner, os.path.join(tempfile.mkdtemp(prefix="susanin-"), os.path.basename(inner)))
+            except Exception as e:
+                self.show_message(f"Ошибка извлечения из архива: {e}")
+                return
+        command = self._opener_for(full_path)
+        if not command and fs is None and self._wants_pager(full_path):
+            # Огромные тексты (логи) редактор загрузил бы целиком — показываем сами
+            self.view_file(full_path)
+            return
         try:
+            import subprocess
             curses.endwin()
-            if sys.platform.startswith("linux"):
+            if command:
+                # Программа из [open] — напрямую, без цепочки xdg-open
+                run_opener(command, full_path)
+            elif sys.platform.startswith("linux"):
                 subprocess.Popen(["xdg-open", full_path])
             elif sys.platform == "darwin":  # macOS
                 subprocess.Popen(["open", full_path])
@@ -407,21 +5194,301 @@ class FileManager:
                 os.startfile(full_path)
             else:
                 self.show_message("Неизвестная платформа: не знаю, как открыть файл")
+            self.stdscr.clear()  # экран после внешней программы — перерисовать целиком
             curses.doupdate()
         except Exception as e:
             self.show_message(f"Ошибка при открытии файла: {e}")
 
+    def _wants_pager(self, full_path):
+        try:
+            st = self.fs.stat(full_path)
+        except OSError:
+            return False
+        return st.st_size >= PAGER_MIN_SIZE and self.types.detect(self.fs, full_path, st).startswith("text/")
+
+    def view_file(self, full_path):
+        """
+        Встроенный просмотр через mmap: ↑↓ PgUp/PgDn Home/End, ←→ — по горизонтали,
+        / и ? — поиск вперёд/назад, n/N — повтор, : — переход (50%, 1234b, 0x1f00, номер строки),
+        F — следить за дописыванием, q/Esc — выход.
+        """
+        if self.fs.is_readonly(full_path) or not os.path.isfile(full_path):
+            self.show_message("Просмотр доступен только для обычных локальных файлов")
+            return
+        try:
+            view = MappedFile(full_path)
+        except (OSError, ValueError) as e:
+            self.show_message(f"Не удалось открыть {os.path.basename(full_path)}: {e}")
+            return
+        top, col, follow = 0, 0, False
+        needle, match, status = None, None, ""
+
+        def progress(pos):
+            # Долгий скан: показываем, где он, Esc прерывает
+            self._draw_line(self.height - 1, f" Поиск… {pos * 100 // max(1, view.size)}% (Esc — прервать)",
+                            curses.A_REVERSE)
+            self.stdscr.refresh()
+            self.stdscr.timeout(0)
+            try:
+                return self.stdscr.get_wch() == "\x1b"
+            except curses.error:
+                return False
+            finally:
+                self.stdscr.timeout(-1)
+
+        def find(forward):
+            nonlocal top, match, status
+            start = (match + 1 if match is not None else top) if forward else (match if match is not None else top)
+            hit = view.search(needle, start, forward, progress)
+            if hit is None:
+                status = f"не найдено: {needle.decode('utf-8', 'replace')}"
+            else:
+                match, status = hit, ""
+                top = view.line_start(hit)
+
+        try:
+            while True:
+                self.height, self.width = self.stdscr.getmaxyx()
+                rows = max(1, self.height - 1)
+                if follow and (view.refresh() or top < view.last_page(rows)):
+                    top = view.last_page(rows)
+
+                self.stdscr.erase()
+                pos = top
+                match_line = view.line_start(match) if match is not None else None
+                for y in range(rows):
+                    if pos >= view.size:
+                        break
+                    attr = self.pair(5) if pos == match_line else curses.A_NORMAL
+                    self._draw_line(y, pager_text(view.line(pos), col, self.width - 1), attr)
+                    nxt = view.next_line(pos)
+                    if nxt == pos:
+                        break
+                    pos = nxt
+                line_no = view.line_number(top)
+                info = f" {os.path.basename(full_path)} | {top}/{view.size} байт " \
+                       f"({top * 100 // max(1, view.size)}%) | строка {line_no or '?'}" \
+                       f"{' | FOLLOW' if follow else ''}{' | ' + status if status else ''}"
+                self._draw_line(self.height - 1, info, curses.A_REVERSE)
+                self.stdscr.refresh()
+
+                self.stdscr.timeout(PAGER_FOLLOW_INTERVAL if follow else -1)
+                try:
+                    key = self.stdscr.get_wch()
+                except curses.error:
+                    continue  # таймаут follow — проверить размер и перерисовать
+                finally:
+                    self.stdscr.timeout(-1)
+                status = ""
+                if key in ("q", "\x1b"):
+                    break
+                elif key == curses.KEY_DOWN:
+                    top = view.next_line(top)
+                elif key == curses.KEY_UP:
+                    top = view.prev_line(top)
+                elif key in (curses.KEY_NPAGE, " "):
+                    for _ in range(rows - 1):
+                        top = view.next_line(top)
+                elif key == curses.KEY_PPAGE:
+                    for _ in range(rows - 1):
+                        top = view.prev_line(top)
+                elif key in (curses.KEY_HOME, "g"):
+                    top, follow = 0, False
+                elif key in (curses.KEY_END, "G"):
+                    top = view.last_page(rows)
+                elif key == curses.KEY_RIGHT:
+                    col += 8
+                elif key == curses.KEY_LEFT:
+                    col = max(0, col - 8)
+                elif key == "F":
+                    follow = not follow
+                elif key in ("/", "?"):
+                    text = self.get_input("Искать вперёд: " if key == "/" else "Искать назад: ", none_on_cancel=True)
+                    if text:
+                        needle, match = text.encode("utf-8"), None
+                        find(key == "/")
+                elif key in ("n", "N") and needle:
+                    find(key == "n")
+                elif key == ":":
+                    text = (self.get_input("Перейти (50%, 1234b, 0x1f00, номер строки): ", none_on_cancel=True)
+                            or "").strip().lower()
+                    try:
+                        if text.endswith("%"):
+                            top = view.line_start(int(float(text[:-1]) * view.size / 100))
+                        elif text.endswith("b") or text.startswith("0x"):
+                            top = view.line_start(int(text.rstrip("b"), 0))
+                        elif text:
+                            top = view.goto_line(int(text), progress)
+                    except ValueError:
+                        status = f"не понял: {text}"
+                    follow = False
+        finally:
+            view.close()
+
+    def _readonly_here(self):
+        if self.fs.is_readonly(self.current_dir):
+            self.show_message("Архив доступен только для чтения")
+            return True
+        return False
+
     def rename_item(self):
+        if self._readonly_here():
+            return
         if self.cursor_pos < len(self.files) and self.files[self.cursor_pos] != "..":
             old_name = self.files[self.cursor_pos]
-            new_name = self.get_input(f"Переименовать {old_name} в: ")
+            new_name = self.get_input(f"Переименовать {old_name} в: ", complete=True)
             if new_name:
+                old_path, new_path = os.path.join(self.current_dir, old_name), os.path.join(self.current_dir, new_name)
                 try:
-                    os.rename(os.path.join(self.current_dir, old_name),
-                              os.path.join(self.current_dir, new_name))
-                    self.get_files()
+                    self.fs.rename(old_path, new_path)
                 except Exception as e:
                     self.show_message(f"Ошибка переименования: {e}")
+                    return
+                batch = self._undo_batch("rename")
+                if batch is not None:
+                    batch.add(old_path, new_path)
+                    self._record_undo(batch)
+                self.get_files()
+
+    def batch_rename(self):
+        """Переименовать выделение (или всё в директории) по регулярке с живым предпросмотром."""
+        if self._readonly_here():
+            return
+        names = sorted(self.selected_files - {".."}) if self.selected_files else \
+            [f for f in self.files if f != ".."]
+        if not names:
+            return
+        import re
+        rows = max(1, self.height - 3)
+
+        def preview(pattern, replacement):
+            # Пока печатают — только видимые строки; полный граф строится после Enter
+            self.stdscr.erase()
+            try:
+                pairs = batch_rename_names(names, pattern, replacement) if pattern else []
+            except (re.error, IndexError) as e:
+                pairs = []
+                self._draw_line(self.height - 2, f"Ошибка: {e}", self.pair(8))
+            for idx, (old, new) in enumerate(pairs[:rows]):
+                self._draw_line(self.height - 2 - idx, f"{old} → {new}", self.pair(2))
+
+        def preview_matches(pattern):
+            # Пока вводят регулярку, имена не меняются — показываем совпавшие имена с подсвеченными совпадениями
+            self.stdscr.erase()
+            try:
+                rx = re.compile(pattern) if pattern else None
+            except re.error as e:
+                self._draw_line(self.height - 2, f"Ошибка: {e}", self.pair(8))
+                return
+            shown = 0
+            for name in names if rx is not None else ():
+                spans = [m.span() for m in rx.finditer(name)]
+                if not spans:
+                    continue
+                segments, pos = [], 0
+                for start, end in spans:
+                    segments += [(name[pos:start], self.pair(2)), (name[start:end], self.pair(2) | curses.A_REVERSE)]
+                    pos = max(pos, end)
+                segments.append((name[pos:], self.pair(2)))
+                self._draw_segments(self.height - 2 - shown, segments)
+                shown += 1
+                if shown >= rows:
+                    break
+
+        pattern = self.get_input("Regex: ", none_on_cancel=True, on_change=preview_matches)
+        if not pattern:
+            return
+        replacement = self.get_input("Заменить на (\\1, {n:03}): ", none_on_cancel=True,
+                                     on_change=lambda r: preview(pattern, r))
+        if replacement is None:
+            return
+        try:
+            pairs = batch_rename_names(names, pattern, replacement)
+        except (re.error, IndexError) as e:
+            self.show_message(f"Ошибка в шаблоне: {e}")
+            return
+        if not pairs:
+            self.show_message("Ни одно имя не меняется")
+            return
+        plan = RenamePlan(self.current_dir, pairs, self.fs.listdir(self.current_dir))
+        if plan.conflicts:
+            lines = [f"{old}: {why}" for old, why in list(plan.conflicts.items())[:10]]
+            answer = self.get_input(f"Конфликтов: {len(plan.conflicts)} ({'; '.join(lines)}). "
+                                    f"Переименовать остальные {len(plan.mapping)}? (y/n): ")
+            if answer.lower() != "y":
+                return
+        job = Job("rename", progress=self.draw_job_progress)
+        job.undo = self._undo_batch("rename")
+        ok, error = plan.apply(self.fs.rename_noreplace, job)
+        self._record_undo(job.undo)
+        job.finish(0 if ok else 1)
+        self.selected_files.clear()
+        self.get_files()
+        if ok:
+            self.show_message(f"Переименовано: {len(plan.mapping)}\n" + job.summary())
+        else:
+            self.show_message(f"Ошибка, изменения откачены:\n{error}")
+
+    # --- Отмена ---
+
+    def _undo_batch(self, op):
+        """Сборщик обратимых переименований для операции; None, если журнал не ведётся (не локальная ФС)."""
+        return UndoBatch(op) if self.undo_log is not None else None
+
+    def _record_undo(self, batch):
+        if batch is None or self.undo_log is None:
+            return
+        try:
+            self.undo_log.record(batch)
+        except OSError:
+            pass  # без журнала операция всё равно выполнена
+
+    def undo_last(self):
+        """Отменить последнюю обратимую операцию (переименование, перемещение в пределах ФС, корзину)."""
+        if self.undo_log is None:
+            self.show_message("Журнал отмены ведётся только для локальной ФС")
+            return
+        entry = self.undo_log.last()
+        if entry is None:
+            self.show_message("Нечего отменять")
+            return
+        when = time.strftime("%H:%M:%S", time.localtime(entry["t"]))
+        answer = self.get_input(f"Отменить «{entry['op']}» ({when}, {len(entry['items'])} объект(ов))? (y/n): ")
+        if answer.lower() != "y":
+            return
+        job = Job("undo", progress=self.draw_job_progress)
+        restored, errors = self.undo_log.undo(entry, job)
+        job.finish(len(errors))
+        self.get_files()
+        if errors:
+            self.show_message(f"Восстановлено: {restored}, пропущено: {len(errors)}\n" + "\n".join(errors[:20]))
+        else:
+            self.show_message(f"Восстановлено: {restored}\n" + job.summary())
+
+    def _draw_line(self, y, text, attr=0):
+        try:
+            self.stdscr.addstr(y, 0, text[:self.width - 1], attr)
+        except curses.error:
+            pass
+
+    def _draw_segments(self, y, segments):
+        """Строка из кусков [(текст, атрибут)], подряд с начала строки; лишнее обрезается."""
+        room = self.width - 1
+        try:
+            self.stdscr.move(y, 0)
+            for text, attr in segments:
+                fitted = []
+                for ch in text:
+                    room -= char_width(ch)
+                    if room < 0:
+                        break
+                    fitted.append(ch)
+                if fitted:
+                    self.stdscr.addstr("".join(fitted), attr)
+                if room < 0:
+                    break
+        except curses.error:
+            pass
 
     # --- Метки операций (новое) ---
 
@@ -438,17 +5505,13 @@ class FileManager:
             else:
                 self.action_map[fname] = action
 
+    def _input_path(self, text):
+        """Путь из строки ввода: ~ раскрываем, относительный — от текущей директории (как в Tab-дополнении)."""
+        return os.path.join(self.current_dir, os.path.expanduser(text))
+
     def _unique_dest(self, dest_path):
         """Если dest_path существует, возвращает уникальный путь с суффиксом _copy, _copy1, ..."""
-        if not os.path.exists(dest_path):
-            return dest_path
-        base, ext = os.path.splitext(dest_path)
-        count = 1
-        new_path = f"{base}_copy{ext}"
-        while os.path.exists(new_path):
-            new_path = f"{base}_copy{count}{ext}"
-            count += 1
-        return new_path
+        return DestClaims().claim(self.fs, dest_path)
 
     def execute_marked_actions(self):
         """Выполнить все пометки: сначала запросить папки назначения для copy/move, затем применить."""
@@ -464,101 +5527,55 @@ class FileManager:
         # Запрос папок назначения для copy/move (если есть)
         copy_dest = None
         move_dest = None
+        # В режиме двух панелей по умолчанию — директория неактивной панели
+        target = self.other_pane.current_dir if self.dual else ''
         if to_copy:
-            copy_dest = self.get_input("Папка назначения для COPY (оставьте пустой, чтобы задавать для каждого): ").strip()
-            if copy_dest == "":
-                copy_dest = None
+            copy_dest = self.get_input("Папка назначения для COPY (оставьте пустой, чтобы задавать для каждого): ",
+                                       default=target, complete=True).strip()
+            copy_dest = self._input_path(copy_dest) if copy_dest else None
         if to_move:
-            move_dest = self.get_input("Папка назначения для MOVE (оставьте пустой, чтобы задавать для каждого): ").strip()
-            if move_dest == "":
-                move_dest = None
+            move_dest = self.get_input("Папка назначения для MOVE (оставьте пустой, чтобы задавать для каждого): ",
+                                       default=target, complete=True).strip()
+            move_dest = self._input_path(move_dest) if move_dest else None
 
         errors = []
+        job = Job("apply", progress=self.draw_job_progress)
+        if MANIFEST_ON_COPY and to_copy:
+            job.manifest = Manifest(MANIFEST_ON_COPY)
+        job.undo = self._undo_batch("apply")
+        claims = DestClaims()
+        copy_dirs = []
+        prompts = {'copy': "Куда копировать {}? (папка): ", 'move': "Куда переместить {}? (папка): "}
 
-        # Выполняем copy
-        for fname in to_copy:
-            src = os.path.join(self.current_dir, fname)
-            if not os.path.exists(src):
-                errors.append(f"Copy: исходник не найден: {fname}")
-                continue
-
-            # определяем dest
-            if copy_dest:
-                dest = os.path.join(copy_dest, fname)
-            else:
-                # спрашиваем для файла
-                dest_dir = self.get_input(f"Куда копировать {fname}? (папка): ").strip()
-                if not dest_dir:
-                    errors.append(f"Copy: пропущено для {fname}")
-                    continue
-                dest = os.path.join(dest_dir, fname)
-
-            # проверка назначения
-            if not os.path.isdir(os.path.dirname(dest)):
-                errors.append(f"Copy: папка назначения не существует для {fname}: {os.path.dirname(dest)}")
-                continue
-
-            # уникализируем имя
-            dest = self._unique_dest(dest)
-
-            try:
-                if os.path.isdir(src):
-                    shutil.copytree(src, dest)
-                else:
-                    shutil.copy2(src, dest)
-            except Exception as e:
-                errors.append(f"Copy {fname}: {e}")
-
-        # Выполняем move
-        for fname in to_move:
-            src = os.path.join(self.current_dir, fname)
-            if not os.path.exists(src):
-                errors.append(f"Move: исходник не найден: {fname}")
-                continue
-
-            if move_dest:
-                dest = os.path.join(move_dest, fname)
-            else:
-                dest_dir = self.get_input(f"Куда переместить {fname}? (папка): ").strip()
-                if not dest_dir:
-                    errors.append(f"Move: пропущено для {fname}")
-                    continue
-                dest = os.path.join(dest_dir, fname)
-
-            if not os.path.isdir(os.path.dirname(dest)):
-                errors.append(f"Move: папка назначения не существует для {fname}: {os.path.dirname(dest)}")
-                continue
-
-            # защита от перемещения в потомка
-            try:
-                src_real = os.path.realpath(src)
-                dest_real = os.path.realpath(dest)
-                if dest_real.startswith(src_real + os.sep) or dest_real == src_real:
-                    errors.append(f"Move: нельзя переместить {fname} внутрь него самого")
-                    continue
-            except Exception:
-                pass
-
-            dest = self._unique_dest(dest)
-
-            try:
-                shutil.move(src, dest)
-            except Exception as e:
-                errors.append(f"Move {fname}: {e}")
-
-        # Выполняем delete
-        for fname in to_delete:
-            target = os.path.join(self.current_dir, fname)
-            if not os.path.exists(target):
-                errors.append(f"Delete: не найден {fname}")
-                continue
+        # Порядок как прежде: copy, move, delete; проверки — в apply_operation (общие с пакетным режимом)
+        delete_action = 'trash' if USE_TRASH else 'delete'
+        for action, names, common_dest in (('copy', to_copy, copy_dest), ('move', to_move, move_dest),
+                                           (delete_action, to_delete, None)):
+            for fname in names:
+                dest_dir = common_dest
+                if action in ('copy', 'move') and not dest_dir:
+                    # спрашиваем для файла
+                    dest_dir = self.get_input(prompts[action].format(fname), complete=True).strip()
+                    if not dest_dir:
+                        errors.append(f"{action.capitalize()}: пропущено для {fname}")
+                        continue
+                    dest_dir = self._input_path(dest_dir)
+                try:
+                    apply_operation(self.fs, action, os.path.join(self.current_dir, fname), dest_dir,
+                                    job, claims, name=fname)
+                    if action == 'copy':
+                        copy_dirs.append(dest_dir)
+                except OperationError as e:
+                    errors.append(str(e))
+        if job.manifest is not None:
             try:
-                if os.path.isdir(target):
-                    shutil.rmtree(target)
-                else:
-                    os.remove(target)
-            except Exception as e:
-                errors.append(f"Delete {fname}: {e}")
+                write_copy_manifests(job.manifest, copy_dirs, self.fs, claims)
+            except OSError as e:
+                errors.append(f"Манифест: {e}")
+        self._record_undo(job.undo)
+        job.finish(len(errors))
+        if to_delete and USE_TRASH and self._local_here():
+            purge_trash_async()
 
         # Очистим метки и обновим список
         self.action_map.clear()
@@ -567,7 +5584,7 @@ class FileManager:
         if errors:
             self.show_message("Ошибки:\n" + "\n".join(errors))
         else:
-            self.show_message("Операции выполнены успешно")
+            self.show_message("Операции выполнены успешно\n" + job.summary())
 
     # --- Конец меток операций ---
 
@@ -613,12 +5630,19 @@ class FileManager:
         if not self.clipboard:
             self.show_message("Буфер пуст")
             return
+        if self._readonly_here():
+            return
 
         # Пытаемся вставить все элементы в self.current_dir
         errors = []
+        job = Job("paste", progress=self.draw_job_progress)
+        if MANIFEST_ON_COPY and self.clipboard_action == 'copy':
+            job.manifest = Manifest(MANIFEST_ON_COPY)
+        if self.clipboard_action == 'move':
+            job.undo = self._undo_batch("paste")
         for src in self.clipboard:
             try:
-                if not os.path.exists(src):
+                if not self.fs.exists(src):
                     errors.append(f"Исходник не найден: {src}")
                     continue
                 name = os.path.basename(src.rstrip(os.sep))
@@ -632,25 +5656,27 @@ class FileManager:
                         errors.append(f"Нельзя переместить {name} внутрь него самого")
                         continue
 
+                if self.clipboard_action == 'move':
+                    # rename в пределах ФС, иначе копия со сверкой; имя уникализируется внутри
+                    self.fs.move(src, dest, job)
+                    continue
+
                 # Получаем уникальное имя, если нужно
-                if os.path.exists(dest):
+                if self.fs.exists(dest):
                     dest = self._unique_dest(dest)
 
-                if os.path.isdir(src):
-                    # Копирование/перемещения директорий
-                    if self.clipboard_action == 'copy':
-                        shutil.copytree(src, dest)
-                    else:
-                        shutil.move(src, dest)
-                else:
-                    # Файлы: используем copy2 (копирует метаданные) или move
-                    if self.clipboard_action == 'copy':
-                        shutil.copy2(src, dest)
-                    else:
-                        shutil.move(src, dest)
+                # copy_file копирует метаданные (как copy2) и сохраняет дыры разрежённых файлов
+                self.fs.copy(src, dest, job)
 
             except Exception as e:
                 errors.append(f"{os.path.basename(src)}: {e}")
+        if job.manifest is not None:
+            try:
+                write_copy_manifests(job.manifest, [self.current_dir], self.fs)
+            except OSError as e:
+                errors.append(f"Манифест: {e}")
+        self._record_undo(job.undo)
+        job.finish(len(errors))
 
         # После операции обновляем список
         self.get_files()
@@ -662,7 +5688,7 @@ class FileManager:
         if errors:
             self.show_message("Ошибки:\n" + "\n".join(errors))
         else:
-            self.show_message("Операция выполнена")
+            self.show_message("Операция выполнена\n" + job.summary())
 
     def copy_items(self):
         # Старый метод заменён на clipboard-поведение. Оставляем для совместимости:
@@ -673,6 +5699,8 @@ class FileManager:
         self.cut_to_clipboard()
 
     def delete_items(self):
+        if self._readonly_here():
+            return
         targets = self.selected_files if self.selected_files else {self.files[self.cursor_pos]}
         # Преобразуем в корректный список имён (исключая "..")
         targets = [t for t in targets if t != ".."]
@@ -681,45 +5709,599 @@ class FileManager:
             return
         confirm = self.get_input(f"Удалить {', '.join(targets)}? (y/n): ")
         if confirm.lower() == 'y':
+            job = Job("delete")
+            failed = 0
             for fname in targets:
-                file_to_delete = os.path.join(self.current_dir, fname)
                 try:
-                    if os.path.isdir(file_to_delete):
-                        shutil.rmtree(file_to_delete)
-                    else:
-                        os.remove(file_to_delete)
+                    apply_operation(self.fs, 'trash' if USE_TRASH else 'delete',
+                                    os.path.join(self.current_dir, fname), job=job, name=fname)
                     self.get_files()
-                except Exception as e:
-                    self.show_message(f"Ошибка удаления {fname}: {e}")
+                except OperationError as e:
+                    failed += 1
+                    self.show_message(str(e))
+            job.finish(failed)
             self.selected_files.clear()
 
+    def archive_selection(self):
+        """Упаковать выделение (или файл под курсором) в .tar.gz/.tar/.zip в текущей директории."""
+        if self._readonly_here():
+            return
+        targets = self._get_targets_fullpaths()
+        if not targets:
+            self.show_message("Нечего упаковывать")
+            return
+        default = os.path.basename(targets[0]) + ".tar.gz" if len(targets) == 1 else "archive.tar.gz"
+        name = self.get_input("Архив (.tar.gz/.tar/.zip): ", default=default, complete=True).strip()
+        if not name:
+            return
+        job = Job("archive", progress=self.draw_job_progress)
+        try:
+            dest = create_archive(targets, self._input_path(name), job)
+        except Exception as e:
+            job.finish(1)
+            self.show_message(f"Ошибка архивации: {e}")
+            return
+        job.finish()
+        self.selected_files.clear()
+        self.get_files()
+        self.show_message(f"Создан {os.path.basename(dest)}\n" + job.summary())
+
+    def extract_selection(self):
+        """Распаковать архивы из выделения (или архив под курсором) в указанную папку."""
+        archives = [t for t in self._get_targets_fullpaths()
+                    if archive_format(t) and os.path.isfile(t) and not self.fs.is_readonly(os.path.dirname(t))]
+        if not archives:
+            self.show_message("Не выбран архив (.tar, .tar.gz, .tgz, .zip)")
+            return
+        dest_dir = self.get_input("Распаковать в: ", default=self.current_dir, complete=True).strip()
+        if not dest_dir:
+            return
+        dest_dir = self._input_path(dest_dir)
+        if not os.path.isdir(dest_dir):
+            self.show_message(f"Папка назначения не существует: {dest_dir}")
+            return
+        errors = []
+        job = Job("extract", progress=self.draw_job_progress)
+        for archive in archives:
+            try:
+                _, errs = extract_archive(archive, dest_dir, job)
+                errors.extend(errs)
+            except Exception as e:
+                errors.append(f"{os.path.basename(archive)}: {e}")
+        job.finish(len(errors))
+        self.selected_files.clear()
+        self.get_files()
+        if errors:
+            self.show_message("Ошибки:\n" + "\n".join(errors))
+        else:
+            self.show_message("Распаковано\n" + job.summary())
+
+    def change_attributes(self):
+        """Права, владелец и время для выделения (или файла под курсором), рекурсивно."""
+        if self._readonly_here():
+            return
+        targets = self._get_targets_fullpaths()
+        if not targets:
+            self.show_message("Нечего менять")
+            return
+        mode = self.get_input("Права (755, u+x,go-w; пусто — не менять): ", none_on_cancel=True)
+        if mode is None:
+            return
+        owner = self.get_input("Владелец (user:group; пусто — не менять): ", none_on_cancel=True)
+        if owner is None:
+            return
+        when = self.get_input("Время (now, YYYY-MM-DD HH:MM; пусто — не менять): ", none_on_cancel=True)
+        if when is None:
+            return
+        try:
+            uid, gid = parse_owner(owner) if owner.strip() else (-1, -1)
+            change = AttrChange(parse_mode(mode) if mode.strip() else None, uid, gid,
+                                parse_time(when) if when.strip() else None)
+        except ValueError as e:
+            self.show_message(str(e))
+            return
+        job = Job("attrs", progress=self.draw_job_progress)
+        errors = change_attrs(targets, change, job)
+        job.finish(len(errors))
+        self.selected_files.clear()
+        self.get_files()
+        if errors:
+            self.show_message("Ошибки:\n" + "\n".join(errors[:20]))
+        else:
+            self.show_message("Атрибуты применены\n" + job.summary())
+
+    def checksum_selection(self):
+        """Манифест под курсором (без выделения) — проверить; иначе посчитать суммы выделения в манифест."""
+        targets = self._get_targets_fullpaths()
+        if not targets:
+            self.show_message("Нечего хешировать")
+            return
+        if self._readonly_here():
+            return
+        if not self.selected_files and is_manifest_name(os.path.basename(targets[0])):
+            try:
+                manifest = Manifest.load(targets[0])
+            except (OSError, ValueError) as e:
+                self.show_message(f"Не удалось прочитать манифест: {e}")
+                return
+            job = Job("verify", progress=self.draw_job_progress)
+            ok, failures = verify_manifest(manifest, job)
+            job.finish(len(failures))
+            text = f"Проверено {len(manifest.entries)} ({manifest.algo}): совпало {ok}, проблем {len(failures)}\n"
+            self.show_message(text + ("\n".join(failures[:20]) if failures else job.summary()))
+            return
+
+        algo = self.get_input("Алгоритм (sha256/blake2b): ", default="sha256", none_on_cancel=True)
+        if algo is None:
+            return
+        try:
+            algo = parse_algo(algo)
+        except ValueError as e:
+            self.show_message(str(e))
+            return
+        name = self.get_input("Файл манифеста: ", default=MANIFEST_NAMES[algo], none_on_cancel=True,
+                              complete=True)
+        if not name or not name.strip():
+            return
+        path = self._input_path(name.strip())
+        job = Job("manifest", progress=self.draw_job_progress)
+        manifest, errors = generate_manifest(targets, algo, job, exclude={path})
+        try:
+            manifest.write(path)
+        except OSError as e:
+            errors.append(f"{path}: {e}")
+        job.finish(len(errors))
+        self.selected_files.clear()
+        self.get_files()
+        if errors:
+            self.show_message("Ошибки:\n" + "\n".join(errors[:20]))
+        else:
+            self.show_message(f"Манифест {os.path.basename(path)}: {len(manifest.entries)} файл(ов)\n" + job.summary())
+
     def create_new_item(self):
-        name = self.get_input("Имя нового файла/директории: ")
+        if self._readonly_here():
+            return
+        name = self.get_input("Имя нового файла/директории: ", complete=True)
         if name:
             create_type = self.get_input("Файл (f) или директория (d)? ")
             if create_type.lower() == 'f':
                 try:
-                    open(os.path.join(self.current_dir, name), 'a').close()
+                    self.fs.create_file(os.path.join(self.current_dir, name))
                     self.get_files()
                 except Exception as e:
                     self.show_message(f"Ошибка создания файла: {e}")
             elif create_type.lower() == 'd':
                 try:
-                    os.mkdir(os.path.join(self.current_dir, name))
+                    self.fs.mkdir(os.path.join(self.current_dir, name))
                     self.get_files()
                 except Exception as e:
                     self.show_message(f"Ошибка создания директории: {e}")
 
-    def run(self):
+    def run(self, first_frame_only=False):
+        self.draw()
+        if first_frame_only:
+            return
+        # Первый кадр уже на экране — доводим состояние до полного
+        self.init_colors()
+        if self.listing_partial:
+            self.get_files()
+        if self.frecency is not None:
+            self._record_visit()
+            self.frecency.compact_async()
+        if isinstance(self.fs, LocalBackend):
+            purge_trash_async()
         while True:
-            self.draw()
+            # По таймауту опроса перерисовываем, только если фоновые задачи что-то изменили
+            if self.poll_background() or self.needs_redraw:
+                self.draw()
+            self.needs_redraw = True
             if not self.handle_input():
                 break
 
-def main(stdscr):
-    fm = FileManager(stdscr)
-    fm.run()
+    def _update_git_marks(self, pane=None, rescan=False):
+        pane = pane or self.pane
+        if self.git is not None and not self.fs.is_readonly(pane.current_dir):
+            pane.git_generation = self.git.generation
+            pane.git_marks = self.git.get(pane.current_dir, rescan)
+
+    def poll_background(self):
+        """
+        Забрать результаты фоновых задач; пока они идут, ввод ждём с таймаутом, чтобы их подхватывать.
+        True — что-то изменилось и экран нужно перерисовать.
+        """
+        busy = changed = False
+        for pane in (self.panes if self.dual else [self.pane]):
+            if pane.loader is not None:
+                if pane.loader[1].done():
+                    self._finish_pane_load(pane)
+                    changed = True
+                else:
+                    busy = True
+            if self.git is not None and pane.search is None:
+                if self.git.generation != pane.git_generation:
+                    self._update_git_marks(pane)
+                    changed = True
+                busy = busy or self.git.busy
+            if pane.tree is not None:
+                loading, loaded = pane.tree.poll()
+                busy = busy or loading
+                changed = changed or loaded
+            if pane.search is not None:
+                if len(pane.search.results) > len(pane.files):
+                    pane.files.extend(pane.search.results[len(pane.files):])
+                    changed = True
+                busy = busy or pane.search.running
+                if not pane.search.running and pane.search.pool is not None:
+                    pane.search.finish()
+                    changed = True
+        self.stdscr.timeout(100 if busy else -1)
+        return changed
+
+    def start_content_search(self):
+        if not isinstance(self.fs, LocalBackend) or self.fs.is_readonly(self.current_dir):
+            self.show_message("Поиск по содержимому доступен только на локальной ФС")
+            return
+        text = self.get_input("Искать текст: ")
+        if not text:
+            return
+        glob = self.get_input("Маска файлов (пусто — все): ").strip()
+        if self.search is not None:
+            self.leave_search()
+        self.search = ContentSearch(self.current_dir, text, glob, self.show_hidden).start()
+        self.cursor_pos = 0
+        self.offset = 0
+        self.selected_files.clear()
+        self.action_map.clear()
+        self.get_files()
+
+    def leave_search(self):
+        self.search.cancel()
+        self.search = None
+        self.cursor_pos = 0
+        self.offset = 0
+        self.selected_files.clear()
+        self.action_map.clear()
+        self.get_files()
+
+def bench_copytree(count=1_000_000, per_dir=1000, base=None):
+    """Сравнить copy_tree и shutil.copytree на синтетическом дереве из count мелких файлов."""
+    import shutil
+    import tempfile
+    root = tempfile.mkdtemp(prefix="susanin-bench-", dir=base)
+    try:
+        src = os.path.join(root, "src")
+        os.mkdir(src)
+        payload = b"x" * 64
+        print(f"Создаю дерево: {count} файлов по {per_dir} в директории ...", flush=True)
+        for i in range(count):
+            if i % per_dir == 0:
+                d = os.path.join(src, f"d{i // per_dir // per_dir:03d}", f"d{i // per_dir:06d}")
+                os.makedirs(d)
+            with open(os.path.join(d, f"f{i:07d}.dat"), "wb") as f:
+                f.write(payload)
+
+        results = []
+        for label, fn in (("shutil.copytree", lambda s, d: shutil.copytree(s, d, symlinks=True)),
+                          ("copy_tree", lambda s, d: copy_tree(s, d))):
+            dest = os.path.join(root, label)
+            t0 = time.perf_counter()
+            fn(src, dest)
+            elapsed = time.perf_counter() - t0
+            results.append((label, elapsed))
+            print(f"{label:16} {elapsed:8.2f} с  {count / elapsed:10.0f} файлов/с", flush=True)
+            shutil.rmtree(dest)
+        print(f"Ускорение: x{results[0][1] / results[1][1]:.2f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def bench_startup(runs=10):
+    """Время до первого кадра: запуск main.py --first-frame в псевдотерминале, холодный и тёплый кэш."""
+    import pty
+    import statistics
+
+    def once():
+        t0 = time.perf_counter()
+        pid, fd = pty.fork()
+        if pid == 0:
+            os.environ.setdefault("TERM", "xterm-256color")
+            os.environ.setdefault("LINES", "40")
+            os.environ.setdefault("COLUMNS", "120")
+            os.execv(sys.executable, [sys.executable, os.path.abspath(__file__), "--first-frame"])
+        try:
+            while os.read(fd, 65536):
+                pass
+        except OSError:
+            pass  # EIO — потомок закрыл терминал
+        os.waitpid(pid, 0)
+        os.close(fd)
+        return time.perf_counter() - t0
+
+    cold = None
+    try:
+        os.sync()
+        with open("/proc/sys/vm/drop_caches", "w") as f:
+            f.write("3\n")
+        cold = once()
+    except OSError:
+        print("Сбросить кэш ОС не удалось (нужен root) — холодный запуск не измерен")
+    warm = [once() for _ in range(runs)]
+    if cold is not None:
+        print(f"холодный кэш: {cold * 1000:7.1f} мс")
+    print(f"тёплый кэш:   {statistics.median(warm) * 1000:7.1f} мс (медиана, мин {min(warm) * 1000:.1f}, {runs} запусков)")
+
+
+def bench_frecency(count=100_000, queries=("src", "proj lib", "zz9", "home user docs")):
+    """Время поиска по frecency-индексу из count путей (база во временном файле)."""
+    import random
+    import tempfile
+    rnd = random.Random(1)
+    words = ["home", "user", "src", "lib", "docs", "proj", "build", "test", "data", "cache", "tmp", "opt"]
+    with tempfile.TemporaryDirectory() as tmp:
+        index = FrecencyIndex(os.path.join(tmp, "dirs.db"))
+        now = time.time()
+        with open(index.log, "w") as f:
+            for i in range(count):
+                path = "/" + "/".join(rnd.choice(words) for _ in range(rnd.randint(2, 7))) + f"{i}"
+                f.write(f"{int(now - rnd.randint(0, 30 * 86400))}\t{path}\n")
+        t0 = time.perf_counter()
+        index.compact()
+        print(f"слияние {count} путей: {(time.perf_counter() - t0) * 1000:.1f} мс")
+        t0 = time.perf_counter()
+        index.load()
+        print(f"загрузка базы: {(time.perf_counter() - t0) * 1000:.1f} мс")
+        for q in queries:
+            t0 = time.perf_counter()
+            for _ in range(100):
+                found = index.search(q)
+            print(f"{q!r:18} {(time.perf_counter() - t0) * 10:.3f} мс, {len(found)} совпадений")
+
+
+def bench_grep(root, text):
+    """Сравнить ContentSearch с наивным однопоточным обходом (os.walk + чтение целиком)."""
+    needle = text.encode("utf-8", "surrogateescape")
+    t0 = time.perf_counter()
+    naive = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in filenames:
+            try:
+                with open(os.path.join(dirpath, name), "rb") as f:
+                    if needle in f.read():
+                        naive += 1
+            except OSError:
+                pass
+    naive_time = time.perf_counter() - t0
+    print(f"наивный обход   {naive_time:8.2f} с, {naive} файлов")
+
+    t0 = time.perf_counter()
+    search = ContentSearch(root, text, show_hidden=True).start()
+    while search.running:
+        time.sleep(0.01)
+    search.finish()
+    elapsed = time.perf_counter() - t0
+    print(f"ContentSearch   {elapsed:8.2f} с, {len(search.results)} файлов ({search.workers} процессов)")
+    print(f"Ускорение: x{naive_time / elapsed:.2f}")
+
+
+# --- Запись и воспроизведение сессий ---
+
+class _ScreenProxy:
+    """Обёртка над окном curses: всё, что не переопределено, уходит в настоящее окно."""
+
+    def __init__(self, win):
+        self._win = win
+
+    def __getattr__(self, name):
+        return getattr(self._win, name)
+
+
+class RecordingScreen(_ScreenProxy):
+    """
+    Пишет каждую полученную клавишу с отметкой времени в JSON-lines файл:
+    первая строка — заголовок (директория, размер терминала), далее {"t", "key"} или {"t", "code"}.
+    """
+
+    def __init__(self, win, path):
+        super().__init__(win)
+        import json
+        self._json = json
+        self._file = open(path, "w", encoding="utf-8")
+        self._started = time.monotonic()
+        lines, cols = win.getmaxyx()
+        self._write({"version": 1, "cwd": os.getcwd(), "term": os.environ.get("TERM"), "lines": lines, "cols": cols})
+
+    def _write(self, record):
+        self._file.write(self._json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+
+    def get_wch(self):
+        key = self._win.get_wch()  # таймаут (curses.error) не записываем
+        t = round(time.monotonic() - self._started, 4)
+        self._write({"t": t, "key": key} if isinstance(key, str) else {"t": t, "code": key})
+        return key
+
+
+class ReplayFinished(Exception):
+    """Записанные клавиши кончились."""
+
+
+class ReplayScreen(_ScreenProxy):
+    """
+    Отдаёт записанные клавиши вместо ввода и меряет задержку ввод→отрисовка: от выдачи
+    клавиши до последнего refresh перед запросом следующей. Байты в терминал считает
+    ByteCounter по другую сторону псевдотерминала.
+    """
+
+    def __init__(self, win, keys, counter, speed=1.0):
+        super().__init__(win)
+        self._keys = keys
+        self._counter = counter
+        self._speed = speed
+        self._index = 0
+        self._given = None  # время выдачи текущей клавиши
+        self._painted = None  # время последнего refresh после неё
+        self._bytes_before = 0
+        self.samples = []  # (клавиша, задержка в с или None, байт)
+
+    def refresh(self, *args):
+        self._win.refresh(*args)
+        self._painted = time.perf_counter()
+
+    def _close_sample(self):
+        if self._given is None:
+            return
+        self._counter.settle()
+        latency = self._painted - self._given if self._painted is not None else None
+        total = self._counter.total
+        self.samples.append((self._keys[self._index - 1][1], latency, total - self._bytes_before))
+        self._bytes_before = total
+        self._given = None
+
+    def get_wch(self):
+        self._close_sample()
+        if self._index >= len(self._keys):
+            raise ReplayFinished()
+        delay, key = self._keys[self._index]
+        if self._speed > 0 and delay > 0:
+            time.sleep(delay / self._speed)
+        self._counter.settle()
+        self._bytes_before = self._counter.total
+        self._index += 1
+        self._painted = None
+        self._given = time.perf_counter()
+        return key
+
+
+class ByteCounter:
+    """Читает ведущую сторону псевдотерминала в фоне и считает байты, выведенные curses."""
+
+    def __init__(self, fd):
+        self.fd = fd
+        self.total = 0
+        self._last = time.monotonic()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        while True:
+            try:
+                data = os.read(self.fd, 65536)
+            except OSError:
+                return
+            if not data:
+                return
+            self.total += len(data)
+            self._last = time.monotonic()
+
+    def settle(self, quiet=0.005, limit=0.2):
+        """Подождать, пока вывод дочитан: quiet секунд тишины, но не дольше limit."""
+        end = time.monotonic() + limit
+        while time.monotonic() < end and time.monotonic() - self._last < quiet:
+            time.sleep(quiet / 2)
+
+
+def load_session(path):
+    """Заголовок и [(пауза перед клавишей, клавиша)] из файла записи."""
+    import json
+    with open(path, encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        keys = []
+        prev = 0.0
+        for line in f:
+            if not line.strip():
+                continue
+            rec = json.loads(line)
+            keys.append((max(0.0, rec["t"] - prev), rec["key"] if "key" in rec else rec["code"]))
+            prev = rec["t"]
+    return header, keys
+
+
+def replay_session(path, speed=1.0, budget_ms=None):
+    """
+    Воспроизвести запись в FileManager на настоящем curses, подключённом к псевдотерминалу
+    того же размера, что при записи. Печатает распределение задержек и объём вывода;
+    с budget_ms возвращает False, если p95 задержки его превысил (для регрессионных проверок).
+    """
+    import pty
+    import statistics
+    header, keys = load_session(path)
+    if os.path.isdir(header.get("cwd", "")):
+        os.chdir(header["cwd"])
+    os.environ["TERM"] = header.get("term") or "xterm-256color"
+    os.environ["LINES"], os.environ["COLUMNS"] = str(header.get("lines", 24)), str(header.get("cols", 80))
+    master, slave = pty.openpty()
+    saved = os.dup(0), os.dup(1)
+    counter = ByteCounter(master)
+    replay = None
+
+    def run(stdscr):
+        nonlocal replay
+        replay = ReplayScreen(stdscr, keys, counter, speed)
+        try:
+            FileManager(replay).run()
+        except ReplayFinished:
+            pass
+        replay._close_sample()  # последняя клавиша (обычно q) завершила работу без нового запроса ввода
+
+    os.dup2(slave, 0)
+    os.dup2(slave, 1)
+    try:
+        curses.wrapper(run)
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved[0], 0)
+        os.dup2(saved[1], 1)
+        for fd in (*saved, slave):
+            os.close(fd)
+
+    samples = replay.samples
+    latencies = sorted(lat * 1000 for _, lat, _ in samples if lat is not None)
+    written = sum(b for _, _, b in samples)
+    print(f"клавиш: {len(samples)}, с отрисовкой: {len(latencies)}, выведено: {format_size(written)}"
+          f" ({written // max(1, len(samples))} B на клавишу)")
+    if not latencies:
+        return True
+
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+    print(f"задержка ввод→отрисовка, мс: медиана {statistics.median(latencies):.2f}, p90 {pct(0.9):.2f}, "
+          f"p95 {pct(0.95):.2f}, p99 {pct(0.99):.2f}, макс {latencies[-1]:.2f}")
+    slowest = sorted((s for s in samples if s[1] is not None), key=lambda s: s[1], reverse=True)[:5]
+    print("медленнее всех: " + ", ".join(f"{k!r} {lat * 1000:.1f} мс/{b} B" for k, lat, b in slowest))
+    if budget_ms is not None and pct(0.95) > budget_ms:
+        print(f"p95 {pct(0.95):.2f} мс больше бюджета {budget_ms} мс")
+        return False
+    return True
+
+
+def main(stdscr, first_frame_only=False, record=None):
+    fm = FileManager(RecordingScreen(stdscr, record) if record else stdscr)
+    fm.run(first_frame_only)
 
 if __name__ == "__main__":
-    curses.wrapper(main)
+    if len(sys.argv) > 1 and sys.argv[1] == "--bench-copytree":
+        # python main.py --bench-copytree [число файлов] [каталог для дерева]
+        bench_copytree(int(sys.argv[2]) if len(sys.argv) > 2 else 1_000_000,
+                       base=sys.argv[3] if len(sys.argv) > 3 else None)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bench-grep":
+        # python main.py --bench-grep <каталог> <текст>
+        bench_grep(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bench-frecency":
+        bench_frecency(int(sys.argv[2]) if len(sys.argv) > 2 else 100_000)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--bench-startup":
+        bench_startup(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
+    elif len(sys.argv) > 1 and sys.argv[1] == "--batch":
+        # Пакетный режим: план из файла или stdin, без curses
+        sys.exit(batch_main(sys.argv[2:]))
+    elif len(sys.argv) > 2 and sys.argv[1] == "--record":
+        # python main.py --record <файл> — обычная работа с записью нажатий
+        curses.wrapper(main, False, sys.argv[2])
+    elif len(sys.argv) > 2 and sys.argv[1] == "--replay":
+        # python main.py --replay <файл> [скорость, 0 — без пауз] [бюджет p95, мс]
+        ok = replay_session(sys.argv[2], float(sys.argv[3]) if len(sys.argv) > 3 else 1.0,
+                            float(sys.argv[4]) if len(sys.argv) > 4 else None)
+        sys.exit(0 if ok else 1)
+    else:
+        # --first-frame: нарисовать первый кадр и выйти (для bench_startup)
+        curses.wrapper(main, "--first-frame" in sys.argv[1:])
 
@@ -0,0 +1,406 @@
+import errno
+import os
+import stat
+import subprocess
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+import main  # noqa: E402
+
+
+def test_parallel_gzip_archive_round_trip(tmp_path):
+    # Больше GZIP_BLOCK: архив состоит из нескольких gzip-членов
+    src = tmp_path / "data"
+    src.mkdir()
+    payload = os.urandom(3 * main.GZIP_BLOCK)
+    (src / "big.bin").write_bytes(payload)
+    (src / "small.txt").write_text("привет\n")
+    archive = main.create_archive([str(src)], str(tmp_path / "out.tar.gz"))
+    assert os.path.getsize(archive) > main.GZIP_BLOCK
+
+    fs = main.ArchiveFS(archive)
+    assert sorted(fs.listdir("data")) == ["big.bin", "small.txt"]
+    f = fs.open("data/big.bin")
+    try:
+        assert f.read(len(payload) + 1) == payload
+    finally:
+        f.close()
+
+    dest = tmp_path / "one"
+    fs.extract("data/small.txt", str(dest))
+    assert dest.read_text() == "привет\n"
+
+    out = tmp_path / "unpacked"
+    out.mkdir()
+    created, errors = main.extract_archive(archive, str(out))
+    assert not errors
+    assert (out / "data" / "big.bin").read_bytes() == payload
+
+    if subprocess.run(["tar", "--version"], capture_output=True).returncode == 0:
+        listing = subprocess.run(["tar", "tzf", archive], capture_output=True, text=True, check=True).stdout
+        assert "data/big.bin" in listing
+
+
+def test_git_dir_marks_precomputed_per_directory():
+    statuses = main.parse_porcelain(b" M src/app/main.py\0?? src/new.txt\0!! build/\0!! src/app/x.pyc\0UU README\0")
+    marks = main.git_dir_marks(statuses)
+    assert marks[""] == {"src": "M", "build": "!", "README": "U"}
+    assert marks["src"] == {"app": "M", "new.txt": "?"}
+    assert marks["src/app"] == {"main.py": "M", "x.pyc": "!"}
+
+
+def test_grep_smart_case_beyond_ascii(tmp_path):
+    path = tmp_path / "t.txt"
+    # Совпадение попадает на стык блоков чтения, причём разрезая двухбайтовый символ
+    path.write_bytes(b"x" * (main.SEARCH_CHUNK - 3) + "ПРИВЕТ, Straße\n".encode())
+    search = main.ContentSearch(str(tmp_path), "привет, strasse")
+    assert search.ignore_case
+    assert main.grep_file(str(path), search.needle, search.ignore_case)
+    assert not main.grep_file(str(path), "пока".casefold(), True)
+    exact = main.ContentSearch(str(tmp_path), "Привет")
+    assert not exact.ignore_case
+    assert not main.grep_file(str(path), exact.needle, exact.ignore_case)
+
+
+def test_frecency_visit_updates_loaded_index_in_place(tmp_path):
+    index = main.FrecencyIndex(str(tmp_path / "dirs.db"))
+    index.visit("/home/u/src")
+    index.visit("/home/u/docs")
+    assert not os.path.exists(index.log)  # пока только в памяти
+    assert index.search("src") == ["/home/u/src"]
+    paths = index.paths
+    for _ in range(3):
+        index.visit("/home/u/docs")
+    index.visit("/srv/new")
+    assert index.paths is paths  # без перечитывания базы
+    assert index.search("") == ["/home/u/docs", "/home/u/src", "/srv/new"]
+    index.flush()
+    fresh = main.FrecencyIndex(index.db)
+    assert fresh.search("") == ["/home/u/docs", "/home/u/src", "/srv/new"]
+
+
+def test_parse_mode_assign_clears_special_bits_like_chmod(tmp_path):
+    assert main.parse_mode("u=rw")(0o104755, False) == 0o655
+    assert main.parse_mode("g=rx")(0o102755, False) == 0o755
+    assert main.parse_mode("g=rx")(0o42755, True) == 0o2755
+    assert main.parse_mode("g=s")(0o42755, True) == 0o2705
+    assert main.parse_mode("u+x")(0o104655, False) == 0o4755
+    # Сверка с системным chmod
+    f = tmp_path / "f"
+    f.touch()
+    for start, spec in ((0o4755, "u=rw"), (0o2775, "g=r"), (0o1777, "o=rx"), (0o6755, "a=r")):
+        os.chmod(f, start)
+        subprocess.run(["chmod", spec, str(f)], check=True)
+        assert main.parse_mode(spec)(start, False) == os.stat(f).st_mode & 0o7777, spec
+
+
+def test_run_plan_copies_before_deleting_source(tmp_path):
+    bk = tmp_path / "bk"
+    bk.mkdir()
+    plan = []
+    for i in range(20):
+        f = tmp_path / f"f{i}"
+        f.write_text(str(i))
+        plan += [("copy", str(f), str(bk)), ("delete", str(f), None)]
+    report = main.run_plan(plan, fs=main.LocalBackend(), workers=4)
+    assert report["failed"] == 0, [r["error"] for r in report["results"] if r["error"]]
+    assert [r["action"] for r in report["results"]] == [op[0] for op in plan]
+    assert sorted(p.name for p in bk.iterdir()) == sorted(f"f{i}" for i in range(20))
+    assert (bk / "f7").read_text() == "7"
+    assert not any(p.name.startswith("f") for p in tmp_path.iterdir())
+
+
+def test_batch_rejects_malformed_input(tmp_path):
+    for text in ("[1, 2]", '{"operations": 3}', '[{"action": "cp", "src": 1, "dest": "x"}]', "[{"):
+        try:
+            main.parse_plan(text, str(tmp_path))
+        except ValueError:
+            continue
+        raise AssertionError(text)
+    plan = tmp_path / "plan.txt"
+    plan.write_text("rm x\n")
+    for argv in ([str(plan), "--workers"], [str(plan), "--workers", "0"], [str(plan), "--report"]):
+        try:
+            main.batch_main(argv)
+        except SystemExit as e:
+            assert "--batch" in str(e)
+        else:
+            raise AssertionError(argv)
+
+
+def _age_trash_entry(entry, days):
+    old = time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(time.time() - days * 86400))
+    with open(entry.info) as f:
+        text = f.read()
+    with open(entry.info, "w") as f:
+        f.write("".join(f"DeletionDate={old}\n" if line.startswith("DeletionDate=") else line
+                        for line in text.splitlines(True)))
+
+
+def test_purge_trash_keeps_recent_and_caches_sizes(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_DATA_HOME", str(tmp_path / "share"))
+    trash = main.home_trash()
+    big = tmp_path / "big"
+    big.mkdir()
+    (big / "blob").write_bytes(os.urandom(3 * 1024 * 1024))
+    fresh = main.trash_path(str(big))
+    assert fresh.trash_dir == trash
+    # Только что удалённое сверх объёма не трогаем: его ещё можно вернуть
+    assert main.purge_trash(max_bytes=2 * 1024 * 1024, dirs=[trash]) == 0
+    assert os.path.isdir(fresh.file)
+
+    # Старое (не из этого запуска) — вытесняется по объёму, удалённое в этом запуске — нет
+    old_dir = tmp_path / "old"
+    old_dir.mkdir()
+    (old_dir / "blob").write_bytes(os.urandom(1024 * 1024))
+    old = main._trash_into(trash, str(old_dir), main.rename_noreplace)
+    _age_trash_entry(old, 5)
+    _age_trash_entry(fresh, 5)
+    assert main.purge_trash(max_bytes=1024, dirs=[trash]) == 1
+    assert not os.path.lexists(old.file) and os.path.isdir(fresh.file)
+
+    # Размер директории берётся из directorysizes, без повторного обхода
+    with open(os.path.join(trash, main.TRASH_SIZES)) as f:
+        assert f.read().endswith(" big\n")
+
+    def no_walk(path):
+        raise AssertionError(path)
+    monkeypatch.setattr(main, "_tree_size", no_walk)
+    assert main.purge_trash(max_bytes=1024, dirs=[trash]) == 0
+
+
+def test_open_archive_corrupt_is_oserror_and_cache_is_bounded(tmp_path):
+    import zipfile
+    good = tmp_path / "good.zip"
+    with zipfile.ZipFile(good, "w") as zf:
+        zf.writestr("a.txt", os.urandom(50_000))
+    (tmp_path / "bad.zip").write_bytes(good.read_bytes()[:1000])
+    main.create_archive([str(good)], str(tmp_path / "g.tar.gz"))
+    (tmp_path / "bad.tar.gz").write_bytes((tmp_path / "g.tar.gz").read_bytes()[:2000])
+    for name in ("bad.zip", "bad.tar.gz"):
+        path = str(tmp_path / name)
+        try:
+            main.open_archive(path)
+        except OSError:
+            pass
+        else:
+            raise AssertionError(name)
+        assert main.vfs_split(path + "/a.txt") == (None, path + "/a.txt")
+    for i in range(main.ARCHIVE_CACHE_MAX + 3):
+        copy = tmp_path / f"c{i}.zip"
+        copy.write_bytes(good.read_bytes())
+        assert main.open_archive(str(copy)).entry("a.txt") is not None
+    assert len(main._ARCHIVE_CACHE) == main.ARCHIVE_CACHE_MAX
+
+
+def test_file_types_do_not_sniff_archive_members(tmp_path, monkeypatch):
+    src = tmp_path / "src"
+    src.mkdir()
+    (src / "README").write_text("text\n")
+    (src / "notes.txt").write_text("text\n")
+    archive = main.create_archive([str(src)], str(tmp_path / "a.tar.gz"))
+    fs = main.LocalBackend()
+    types = main.FileTypes(config=str(tmp_path / "none.conf"))
+    assert types.detect(fs, str(src / "README"), os.stat(src / "README")) == "text/plain"
+
+    def no_open(self, name):
+        raise AssertionError(name)
+    monkeypatch.setattr(main.ArchiveFS, "open", no_open)
+    for name, mime in (("README", "application/octet-stream"), ("notes.txt", "text/plain")):
+        path = os.path.join(archive, "src", name)
+        assert types.detect(fs, path, fs.stat(path)) == mime
+
+
+def test_batch_rename_counter_after_group_reference():
+    assert main.batch_rename_names(["img_7.jpg", "img_9.jpg", "notes"], r"img_(\d+)", r"p\1{n:02}") == [
+        ("img_7.jpg", "p701.jpg"), ("img_9.jpg", "p902.jpg")]
+    # {n} внутри имени — это текст, а не номер
+    assert main.batch_rename_names(["x{n}y"], r"x(.*)y", r"\1-{n}") == [("x{n}y", "{n}-1")]
+
+
+def _tar_with(path, members):
+    import io
+    import tarfile
+    with tarfile.open(path, "w") as tf:
+        for name, kind, arg in members:
+            ti = tarfile.TarInfo(name)
+            if kind == "file":
+                ti.size = len(arg)
+                tf.addfile(ti, io.BytesIO(arg))
+                continue
+            ti.type = {"dir": tarfile.DIRTYPE, "link": tarfile.SYMTYPE, "hardlink": tarfile.LNKTYPE}[kind]
+            ti.linkname = arg or ""
+            tf.addfile(ti)
+
+
+def test_extract_rejects_paths_and_links_leaving_destination(tmp_path):
+    archive = str(tmp_path / "evil.tar")
+    _tar_with(archive, [
+        ("../evil", "file", b"x"),
+        ("/abs", "file", b"x"),
+        ("d", "dir", None),
+        ("d/f", "file", b"data"),
+        ("d/ok", "link", "f"),
+        ("d/up", "link", "../d/f"),
+        ("d/l1", "link", ".."),
+        ("d/l1/x", "link", ".."),       # через ссылку l1: оказалась бы в dest и смотрела бы наружу
+        ("d/y", "link", "l1/../.."),     # лексически внутри, на деле — родитель dest
+        ("d/abs", "link", "/etc/passwd"),
+        ("d/hard", "hardlink", "d/f"),
+        ("d/hard2", "hardlink", "../outside"),
+    ])
+    dest = tmp_path / "out"
+    dest.mkdir()
+    created, errors = main.extract_archive(archive, str(dest))
+    assert created == [str(dest / "d")]
+    assert sorted(os.listdir(dest / "d")) == ["f", "hard", "l1", "ok", "up"]
+    assert (dest / "d" / "ok").read_bytes() == (dest / "d" / "up").read_bytes() == b"data"
+    assert os.path.samefile(dest / "d" / "hard", dest / "d" / "f")
+    assert len(errors) == 6, errors
+    assert sorted(os.listdir(tmp_path)) == ["evil.tar", "out"]
+    root = os.path.realpath(dest)
+    for name in os.listdir(dest / "d"):
+        real = os.path.realpath(dest / "d" / name)
+        assert real == root or real.startswith(root + os.sep), name
+
+
+def test_copied_symlinks_are_counted(tmp_path):
+    (tmp_path / "f").write_text("x")
+    os.symlink("f", tmp_path / "link")
+    job = main.Job("test")
+    main.copy_file(str(tmp_path / "link"), str(tmp_path / "link2"), job)
+    assert os.readlink(tmp_path / "link2") == "f" and job.files == 1
+    tree = tmp_path / "tree"
+    tree.mkdir()
+    (tree / "a").write_text("a")
+    os.symlink("a", tree / "b")
+    job = main.Job("test")
+    main.copy_tree(str(tree), str(tmp_path / "tree2"), job)
+    assert os.readlink(tmp_path / "tree2" / "b") == "a" and job.files == 2
+
+
+def _names(path):
+    return {p.name: p.read_text() for p in path.iterdir()}
+
+
+def test_rename_plan_chain_and_cycle(tmp_path):
+    for name in ("a", "b", "c", "x", "y"):
+        (tmp_path / name).write_text(name)
+    # Цепочка a -> b -> c -> d и цикл x <-> y
+    plan = main.RenamePlan(str(tmp_path), [("a", "b"), ("b", "c"), ("c", "d"), ("x", "y"), ("y", "x")],
+                           os.listdir(tmp_path))
+    assert not plan.conflicts
+    assert plan.apply() == (True, None)
+    assert _names(tmp_path) == {"b": "a", "c": "b", "d": "c", "y": "x", "x": "y"}
+
+
+def test_rename_plan_conflicts_and_rollback(tmp_path):
+    for name in ("a", "b", "keep"):
+        (tmp_path / name).write_text(name)
+    plan = main.RenamePlan(str(tmp_path), [("a", "keep"), ("b", "bad/name")], os.listdir(tmp_path))
+    assert set(plan.conflicts) == {"a", "b"} and not plan.steps
+
+    plan = main.RenamePlan(str(tmp_path), [("a", "b"), ("b", "a")], os.listdir(tmp_path))
+    calls = []
+
+    def flaky(src, dest):
+        calls.append((src, dest))
+        if len(calls) == 2:
+            raise OSError(5, "сбой")
+        main.rename_noreplace(src, dest)
+    ok, error = plan.apply(flaky)
+    assert not ok and "сбой" in error
+    assert _names(tmp_path) == {"a": "a", "b": "b", "keep": "keep"}
+
+
+def test_move_path_names_and_exdev_fallback(tmp_path, monkeypatch):
+    src_dir, dest_dir = tmp_path / "src", tmp_path / "dest"
+    src_dir.mkdir()
+    dest_dir.mkdir()
+    (dest_dir / "f.txt").write_text("old")
+    (dest_dir / "f_copy.txt").write_text("old copy")
+    (src_dir / "f.txt").write_text("new")
+    moved = main.move_path(str(src_dir / "f.txt"), str(dest_dir / "f.txt"))
+    assert moved == str(dest_dir / "f_copy1.txt") and (dest_dir / "f_copy1.txt").read_text() == "new"
+
+    # rename отвечает EXDEV (bind mount) — перенос копией со сверкой
+    tree = src_dir / "tree"
+    (tree / "sub").mkdir(parents=True)
+    (tree / "sub" / "g").write_text("g")
+
+    def exdev(src, dest):
+        raise OSError(errno.EXDEV, os.strerror(errno.EXDEV), src, None, dest)
+    monkeypatch.setattr(main, "rename_noreplace", exdev)
+    job = main.Job("test")
+    moved = main.move_path(str(tree), str(dest_dir / "tree"), job)
+    assert moved == str(dest_dir / "tree")
+    assert (dest_dir / "tree" / "sub" / "g").read_text() == "g" and not tree.exists()
+    assert job.files == 1
+
+
+def test_copy_file_keeps_holes(tmp_path):
+    src = tmp_path / "sparse.img"
+    size = 64 * 1024 * 1024
+    with open(src, "wb") as f:
+        f.truncate(size)
+        f.seek(size // 2)
+        f.write(b"data" * 1024)
+    if os.stat(src).st_blocks * 512 >= size // 4:
+        pytest.skip("ФС не поддерживает разрежённые файлы")
+    dest = tmp_path / "copy.img"
+    main.copy_file(str(src), str(dest))
+    with open(src, "rb") as a, open(dest, "rb") as b:
+        while True:
+            chunk = a.read(1024 * 1024)
+            assert chunk == b.read(1024 * 1024)
+            if not chunk:
+                break
+    assert os.stat(dest).st_blocks * 512 < size // 4
+
+
+def test_copy_tree_preserves_metadata(tmp_path):
+    src = tmp_path / "src"
+    (src / "ro").mkdir(parents=True)
+    (src / "ro" / "f").write_text("f")
+    (src / "x.sh").write_text("#!/bin/sh\n")
+    os.symlink("x.sh", src / "link")
+    os.chmod(src / "x.sh", 0o750)
+    os.utime(src / "x.sh", ns=(1_000_000_000, 1_500_000_000_123))
+    os.utime(src / "link", ns=(1_000_000_000, 1_200_000_000_000), follow_symlinks=False)
+    os.utime(src / "ro", ns=(1_000_000_000, 1_300_000_000_000))
+    os.chmod(src / "ro", 0o500)
+    try:
+        dest = tmp_path / "dest"
+        main.copy_tree(str(src), str(dest))
+        for rel in ("x.sh", "ro", "ro/f"):
+            a, b = os.stat(src / rel), os.stat(dest / rel)
+            assert (stat.S_IMODE(a.st_mode), a.st_mtime_ns) == (stat.S_IMODE(b.st_mode), b.st_mtime_ns), rel
+        assert os.readlink(dest / "link") == "x.sh"
+        assert os.lstat(dest / "link").st_mtime_ns == 1_200_000_000_000
+    finally:
+        os.chmod(src / "ro", 0o700)
+        if (tmp_path / "dest" / "ro").exists():
+            os.chmod(tmp_path / "dest" / "ro", 0o700)
+
+
+def test_undo_log_undo_and_skips(tmp_path):
+    log = main.UndoLog(str(tmp_path / "undo.log"))
+    for name in ("a", "b", "c"):
+        (tmp_path / name).write_text(name)
+    batch = main.UndoBatch("rename")
+    for name in ("a", "b", "c"):
+        os.rename(tmp_path / name, tmp_path / (name + "2"))
+        batch.add(str(tmp_path / name), str(tmp_path / (name + "2")))
+    log.record(batch)
+    os.utime(tmp_path / "b2", ns=(0, 0))  # изменён после операции
+    (tmp_path / "c").write_text("занято")  # исходное имя снова занято
+    entry = log.last()
+    restored, errors = log.undo(entry)
+    assert restored == 1 and len(errors) == 2
+    assert (tmp_path / "a").read_text() == "a"
+    assert (tmp_path / "b2").exists() and (tmp_path / "c2").exists()
+    assert log.last() is None  # отменённая операция больше не предлагается